@@ -0,0 +1,54 @@
+""" datagen.py
+Seeded generator of synthetic catalogs and orders for benchmarks.
+The same seed always produces the same data.
+
+Class CatalogSpec
+Functions:
+    generate_skus
+    generate_entity_names
+    generate_order_lines
+"""
+
+import random
+from dataclasses import dataclass
+
+
+@dataclass
+class CatalogSpec:
+    num_skus: int = 1_000
+    num_suppliers: int = 20
+    num_customers: int = 200
+    mean_lines_per_order: float = 5.0  # Order sizes: 1 + exponential
+    max_qty: int = 100
+    seed: int = 42
+
+
+def generate_skus(spec: CatalogSpec) -> list[str]:
+    rng = random.Random(spec.seed)
+    families = ['Bolt', 'Nut', 'Washer', 'Screw', 'Bracket', 'Hinge', 'Panel']
+    return [
+        f'{rng.choice(families)} {i:07d} ({rng.randint(1, 99)}mm)'
+        for i in range(spec.num_skus)
+    ]
+
+
+def generate_entity_names(spec: CatalogSpec,
+                          entity_type: str) -> list[str]:
+    num_entities = (
+        spec.num_suppliers if entity_type == 'supplier'
+        else spec.num_customers
+    )
+    return [f'{entity_type.title()} {i:06d}' for i in range(num_entities)]
+
+
+def generate_order_lines(rng: random.Random, skus: list[int],
+                         spec: CatalogSpec) -> list[tuple[int, int]]:
+    # Distinct SKUs per order; sizes follow 1 + exponential distribution
+    num_lines = 1 + int(rng.expovariate(
+        1 / max(spec.mean_lines_per_order - 1, 1e-9)
+    ))
+    num_lines = min(num_lines, len(skus))
+    return [
+        (sku, rng.randint(1, spec.max_qty))
+        for sku in rng.sample(skus, num_lines)
+    ]
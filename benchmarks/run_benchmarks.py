@@ -0,0 +1,187 @@
+""" run_benchmarks.py
+Times StockBackbone operations at several catalog sizes, against in-memory
+and file databases, and outputs the results as JSON.
+
+Usage:
+    python -m benchmarks.run_benchmarks --scales 1000 10000 \
+        --backends memory file --ops 200 --output bench.json
+
+Functions:
+    run_scenario
+    run_benchmarks
+    main
+    _issue_if_possible
+    _timed
+    _summarize
+"""
+
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from benchmarks.datagen import (
+    CatalogSpec, generate_skus, generate_entity_names, generate_order_lines
+)
+from sbb.exceptions import NotEnoughStockToFullfillOrder
+from sbb.sbb import StockBackbone
+
+
+DEFAULT_SCALES = [1_000, 10_000, 100_000]
+BACKENDS = ['memory', 'file']
+
+
+def run_scenario(num_skus: int, backend: str, num_ops: int,
+                 seed: int = 42) -> dict:
+    spec = CatalogSpec(num_skus=num_skus, seed=seed)
+    rng = random.Random(seed)
+    db_name = ':memory:' if backend == 'memory' else f'bench_{num_skus}'
+    sbb = StockBackbone(db_name)
+    timings = dict()
+
+    try:
+        # Catalog is seeded in one transaction: not part of the measures
+        seed_start = time.perf_counter()
+        with sbb.transaction():
+            skus = sbb.create_skus(generate_skus(spec)).ids
+            supplier_ids = sbb.create_suppliers(
+                generate_entity_names(spec, 'supplier')
+            ).ids
+            customer_ids = sbb.create_customers(
+                generate_entity_names(spec, 'customer')
+            ).ids
+        seed_duration = time.perf_counter() - seed_start
+
+        timings['create_sku'] = _timed(
+            lambda i: sbb.create_sku(f'Benchmark product {i}'), num_ops
+        )
+
+        po_ids = list()
+        timings['make_PO'] = _timed(lambda i: po_ids.append(sbb.make_PO(
+            rng.choice(supplier_ids), generate_order_lines(rng, skus, spec)
+        )), num_ops)
+        timings['receive_PO'] = _timed(
+            lambda i: sbb.receive_PO('full-delivery', po_ids[i]), num_ops
+        )
+
+        # Sale orders only use SKUs received above, so that they can ship
+        received_skus = list({
+            ol.sku for the_order in sbb.get_orders(po_ids)
+            for ol in the_order.lines
+        })
+        so_spec = CatalogSpec(num_skus=num_skus, max_qty=1, seed=seed)
+        so_ids = list()
+        timings['make_SO'] = _timed(lambda i: so_ids.append(sbb.make_SO(
+            rng.choice(customer_ids),
+            generate_order_lines(rng, received_skus, so_spec)
+        )), num_ops)
+        timings['issue_SO'] = _timed(
+            lambda i: _issue_if_possible(sbb, so_ids[i]), num_ops
+        )
+
+        order_ids = po_ids + so_ids
+        timings['get_order'] = _timed(
+            lambda i: sbb.get_order(rng.choice(order_ids)), num_ops
+        )
+        timings['get_inventory_level'] = _timed(
+            lambda i: sbb._db.get_inventory_level(rng.sample(skus, 10)),
+            num_ops
+        )
+    finally:
+        sbb._db.close_connection()
+        if backend == 'file':
+            for suffix in ['.db', '.db-wal', '.db-shm']:
+                Path('data', db_name + suffix).unlink(missing_ok=True)
+
+    return {
+        'num_skus': num_skus,
+        'backend': backend,
+        'seed_catalog_s': round(seed_duration, 6),
+        'operations': {
+            name: _summarize(durations)
+            for name, durations in timings.items()
+        },
+    }
+
+
+def run_benchmarks(scales: list[int], backends: list[str], num_ops: int,
+                   seed: int = 42) -> dict:
+    return {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'num_ops': num_ops,
+            'seed': seed,
+        },
+        'results': [
+            run_scenario(num_skus, backend, num_ops, seed)
+            for num_skus in scales
+            for backend in backends
+        ],
+    }
+
+
+def main(argv: list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scales', type=int, nargs='+',
+                        default=DEFAULT_SCALES, help='Numbers of SKUs')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS,
+                        default=BACKENDS)
+    parser.add_argument('--ops', type=int, default=200,
+                        help='Calls timed per operation')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='JSON file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scales, args.backends, args.ops, args.seed)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+def _issue_if_possible(sbb: StockBackbone, order_id: int) -> None:
+    # Sale orders outnumbering receipts may run out of stock
+    try:
+        sbb.issue_SO('ship-full', order_id)
+    except NotEnoughStockToFullfillOrder:
+        pass
+
+
+def _timed(operation: Callable[[int], None], num_ops: int) -> list[float]:
+    durations = list()
+    for i in range(num_ops):
+        start = time.perf_counter()
+        operation(i)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def _summarize(durations: list[float]) -> dict:
+    durations_us = sorted(d * 1e6 for d in durations)
+    def percentile(p: float) -> float:
+        return durations_us[min(int(p * len(durations_us)),
+                                len(durations_us) - 1)]
+    return {
+        'count': len(durations_us),
+        'total_s': round(sum(durations), 6),
+        'mean_us': round(statistics.fmean(durations_us), 2),
+        'p50_us': round(percentile(0.50), 2),
+        'p95_us': round(percentile(0.95), 2),
+        'p99_us': round(percentile(0.99), 2),
+        'ops_per_s': round(len(durations) / sum(durations), 2),
+    }
+
+
+if __name__ == '__main__':
+    main()
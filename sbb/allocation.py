@@ -0,0 +1,92 @@
+""" allocation.py
+Allocation of stock to sale orders, shared by the shipping paths.
+Rules:
+    - A line requires its open quantity: qty_ordered - qty_delivered.
+    - Orders are served one after the other: by ascending order id ('fifo'),
+      or in the sequence given by the caller ('priority').
+    - Without partial shipments, an order is served only if stock covers all
+      of its lines (like issue_SO 'ship-full'); otherwise it takes nothing.
+    - With partial shipments, each line takes whatever stock remains.
+    - Stock reserved by an order is only available to that order, on top of
+      the stock shared by all orders.
+
+Functions:
+    qty_required
+    order_sequence
+    allocate_wave
+"""
+
+from sbb.exceptions import SBB_Exception
+from sbb.sbb_objects import Order, OrderLine, WaveResult
+
+
+ALLOCATION_POLICIES = ('fifo', 'priority')
+
+
+def qty_required(order_line: OrderLine) -> float:
+    return order_line.qty_ordered - order_line.qty_delivered
+
+
+def order_sequence(orders: list[Order], policy: str) -> list[Order]:
+    match policy:
+        case 'fifo':
+            return sorted(orders, key=lambda the_order: the_order.id)
+        case 'priority':
+            return list(orders)
+        case _:
+            raise SBB_Exception(f'Unexpected allocation policy: {policy}')
+
+
+def allocate_wave(orders: list[Order], stock: dict[int, float],
+                  policy: str = 'fifo', allow_partial: bool = False,
+                  reserved: dict[int, dict[int, float]] = None
+                  ) -> tuple[WaveResult, dict]:
+    # stock: sku -> qty available to all orders, consumed in place.
+    # reserved: order_id -> {sku: qty reserved by the order}.
+    # Returns the result + {order_id: {position: qty allocated}}
+    result = WaveResult()
+    allocations = dict()
+    if reserved is None:
+        reserved = dict()
+    for the_order in order_sequence(orders, policy):
+        own_stock = reserved.get(the_order.id, dict())
+        for sku, qty in own_stock.items():
+            stock[sku] = max(stock.get(sku, 0), 0) + qty
+        open_lines = [ol for ol in the_order.lines if qty_required(ol) > 0]
+        # SKUs appearing on several lines share the same stock
+        required_by_sku = dict()
+        for ol in open_lines:
+            required_by_sku[ol.sku] = (
+                required_by_sku.get(ol.sku, 0) + qty_required(ol)
+            )
+        fully_covered = all(
+            stock.get(sku, 0) >= qty for sku, qty in required_by_sku.items()
+        )
+        partly_covered = any(stock.get(sku, 0) > 0 for sku in required_by_sku)
+
+        if fully_covered:
+            result.fulfilled.append(the_order.id)
+        elif partly_covered:
+            result.partial.append(the_order.id)
+        else:
+            result.unfulfilled.append(the_order.id)
+
+        if fully_covered or allow_partial:
+            order_allocation = dict()
+            for ol in open_lines:
+                qty = min(qty_required(ol), max(stock.get(ol.sku, 0), 0))
+                if qty > 0:
+                    stock[ol.sku] -= qty
+                    order_allocation[ol.position] = qty
+            if order_allocation:
+                allocations[the_order.id] = order_allocation
+
+        # Reserved stock left unused stays with the order
+        for sku, qty in own_stock.items():
+            qty_used = sum(
+                allocations.get(the_order.id, dict()).get(ol.position, 0)
+                for ol in open_lines if ol.sku == sku
+            )
+            stock[sku] -= qty - min(qty, qty_used)
+
+    return result, allocations
@@ -0,0 +1,181 @@
+""" async_sbb.py
+Asyncio interface to user.
+Reads run concurrently on a pool of threads. Writes are queued to a single
+writer thread, which applies whatever has accumulated in one transaction
+(each write in its own savepoint, so that one failure doesn't affect others).
+
+Class AsyncStockBackbone - methods:
+    make_PO
+    make_SO
+    make_POs
+    make_SOs
+    get_order
+    get_orders
+    receive_PO
+    issue_SO
+
+    create_supplier
+    create_customer
+    create_sku
+
+    is_entity
+    is_sku
+
+    close
+    _read
+    _write
+    _writer_loop
+    _apply_writes
+"""
+
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from sbb.group_commit import apply_commands
+from sbb.sbb import StockBackbone
+from sbb.sbb_objects import Order, OrderLine
+
+
+class AsyncStockBackbone():
+    MAX_READERS = 4
+    MAX_WRITE_BATCH = 100
+
+    def __init__(self, db_name: str, cache_existence: bool = False,
+                 inventory_cache_size: int = 0,
+                 max_readers: int = MAX_READERS,
+                 max_write_batch: int = MAX_WRITE_BATCH) -> None:
+        self._sbb = StockBackbone(db_name, cache_existence,
+                                  inventory_cache_size)
+        self._readers = ThreadPoolExecutor(max_readers,
+                                           thread_name_prefix='sbb-reader')
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='sbb-writer')
+        self._max_write_batch = max_write_batch
+        self._write_queue = None  # Created with the writer task, in the loop
+        self._writer_task = None
+
+    async def __aenter__(self) -> 'AsyncStockBackbone':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+    ##############################
+    ########## Regular use #######
+    ##############################
+
+    async def make_PO(self, supplier_id: int,
+                      PO_lines: list[OrderLine]) -> int:
+        return await self._write(self._sbb.make_PO, supplier_id, PO_lines)
+
+    async def make_SO(self, customer_id: int,
+                      SO_lines: list[OrderLine]) -> int:
+        return await self._write(self._sbb.make_SO, customer_id, SO_lines)
+
+    async def make_POs(self,
+                       POs: list[tuple[int, list[OrderLine]]]) -> list[int]:
+        return await self._write(self._sbb.make_POs, POs)
+
+    async def make_SOs(self,
+                       SOs: list[tuple[int, list[OrderLine]]]) -> list[int]:
+        return await self._write(self._sbb.make_SOs, SOs)
+
+    async def get_order(self, order_id: int) -> Order:
+        return await self._read(self._sbb.get_order, order_id)
+
+    async def get_orders(self, order_ids: list[int]) -> list[Order]:
+        return await self._read(self._sbb.get_orders, order_ids)
+
+    async def receive_PO(self, mode: str, order_id: int,
+                         delivered_qtys: dict[int, float] = None) -> bool:
+        return await self._write(self._sbb.receive_PO, mode, order_id,
+                                 delivered_qtys)
+
+    async def issue_SO(self, mode: str, order_id: int,
+                       shipped_qtys: dict[int, float] = None) -> bool:
+        return await self._write(self._sbb.issue_SO, mode, order_id,
+                                 shipped_qtys)
+
+
+    ##############################
+    ########## Configuration #####
+    ##############################
+
+    async def create_supplier(self, supplier_name: str) -> int:
+        return await self._write(self._sbb.create_supplier, supplier_name)
+
+    async def create_customer(self, customer_name: str) -> int:
+        return await self._write(self._sbb.create_customer, customer_name)
+
+    async def create_sku(self, sku_desc: str) -> int:
+        return await self._write(self._sbb.create_sku, sku_desc)
+
+
+    ##############################
+    ########## Support ###########
+    ##############################
+
+    async def is_entity(self, entity_id: int) -> bool:
+        return await self._read(self._sbb.is_entity, entity_id)
+
+    async def is_sku(self, sku: int) -> bool:
+        return await self._read(self._sbb.is_sku, sku)
+
+    async def close(self) -> None:
+        if self._writer_task is not None:
+            await self._write_queue.put(None)  # Writer stops after this
+            await self._writer_task
+            self._writer_task = None
+        self._readers.shutdown()
+        self._writer.shutdown()
+        self._sbb.close()
+
+    async def _read(self, method: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, method, *args)
+
+    async def _write(self, method: Callable, *args) -> Any:
+        if self._writer_task is None:
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer_loop())
+        result = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((method, args, result))
+        return await result
+
+    async def _writer_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            batch = list()
+            command = await self._write_queue.get()
+            while command is not None:
+                batch.append(command)
+                if (len(batch) == self._max_write_batch
+                        or self._write_queue.empty()):
+                    break
+                command = self._write_queue.get_nowait()
+            stop = command is None
+            if not batch:
+                continue
+
+            try:
+                outcomes = await loop.run_in_executor(
+                    self._writer, self._apply_writes, batch
+                )
+            except Exception as error:  # Batch couldn't be committed
+                outcomes = [(None, error)] * len(batch)
+
+            for (_, _, result), (value, error) in zip(batch, outcomes):
+                if result.cancelled():
+                    continue
+                if error is None:
+                    result.set_result(value)
+                else:
+                    result.set_exception(error)
+
+    def _apply_writes(self, batch: list[tuple]) -> list[tuple[Any, Exception]]:
+        # Runs on the writer thread: one commit for the whole batch
+        return apply_commands(self._sbb,
+                              [(method, args) for method, args, _ in batch])
@@ -0,0 +1,169 @@
+""" availability.py
+Vectorized availability of stock for open sale order lines (needs NumPy).
+Follows the allocation rules of allocation.py with partial shipments:
+orders are served by ascending id ('fifo') or in the given sequence
+('priority'), lines by position, and each line takes whatever stock of its
+SKU remains. Stock reserved by an order only serves that order, before the
+stock available to promise. The report matches what
+issue_SOs(allow_partial=True) would ship, without writing anything.
+
+Class AvailabilityReport - methods:
+    short_lines
+    covered_orders
+Functions:
+    compute_availability
+    allocate_lines
+    _sum_before
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from sbb.allocation import ALLOCATION_POLICIES
+from sbb.exceptions import SBB_Exception
+from sbb.sbb_objects import OrderBatch, InventoryFrame
+
+
+@dataclass(slots=True)
+class AvailabilityReport:
+    # One entry per open line, grouped by SKU, in serving sequence per SKU
+    order_id: np.ndarray
+    position: np.ndarray
+    sku: np.ndarray
+    qty_required: np.ndarray
+    qty_allocated: np.ndarray
+    shortage: np.ndarray
+    # One entry per SKU ordered, by ascending SKU. stock_qty: available to
+    # promise, plus what the orders reported have reserved.
+    demand_sku: np.ndarray
+    demand_qty: np.ndarray
+    stock_qty: np.ndarray
+    shortage_qty: np.ndarray
+
+    def short_lines(self) -> list[tuple[int, int, int, float]]:
+        # (order_id, position, sku, shortage) of lines not fully covered
+        short = self.shortage > 0
+        return list(zip(self.order_id[short].tolist(),
+                        self.position[short].tolist(),
+                        self.sku[short].tolist(),
+                        self.shortage[short].tolist()))
+
+    def covered_orders(self) -> list[int]:
+        # Orders whose open lines are all covered, by ascending id
+        short_orders = np.unique(self.order_id[self.shortage > 0])
+        return np.setdiff1d(self.order_id, short_orders).tolist()
+
+
+def compute_availability(db, order_ids: list[int] = None,
+                         policy: str = 'fifo') -> AvailabilityReport:
+    # db: SBB_DBAdmin. order_ids=None covers every open sale order line.
+    if policy not in ALLOCATION_POLICIES:
+        raise SBB_Exception(f'Unexpected allocation policy: {policy}')
+    if policy == 'priority' and order_ids is None:
+        raise SBB_Exception('Priority allocation needs the order sequence')
+
+    batch = db.get_order_batch(order_ids=order_ids, order_type='sale',
+                               open_only=True)
+    # Same stock as issue_SOs: available to promise, plus own reservations
+    available = db.get_available_to_promise(list(set(batch.sku)))
+    frame = InventoryFrame()
+    frame.extend((0, sku, qty) for sku, qty in available.items())
+    reserved = db.get_reserved_qty(list(set(batch.order_id)))
+
+    rank = None
+    if policy == 'priority':
+        sequence = {order_id: i for i, order_id
+                    in enumerate(dict.fromkeys(order_ids))}
+        rank = np.fromiter((sequence[order_id] for order_id in batch.order_id),
+                           dtype=np.int64, count=len(batch))
+    return allocate_lines(batch, frame, rank, reserved)
+
+
+def allocate_lines(batch: OrderBatch, frame: InventoryFrame,
+                   rank: np.ndarray = None,
+                   reserved: dict[int, dict[int, float]] = None
+                   ) -> AvailabilityReport:
+    # rank: serving sequence of each line's order (None = by order id).
+    # frame: stock available to all orders. reserved: order_id -> {sku: qty
+    # reserved by the order}, as in allocation.allocate_wave.
+    order_id = np.frombuffer(batch.order_id, dtype=np.int64)
+    position = np.frombuffer(batch.position, dtype=np.int64)
+    sku = np.frombuffer(batch.sku, dtype=np.int64)
+    required = (np.frombuffer(batch.qty_ordered, dtype=np.float64)
+                - np.frombuffer(batch.qty_delivered, dtype=np.float64))
+    if rank is None:
+        rank = order_id
+
+    # Lines grouped by SKU, each group in serving sequence
+    sequence = np.lexsort((position, rank, sku))
+    order_id, position, sku, required = (
+        order_id[sequence], position[sequence], sku[sequence],
+        required[sequence]
+    )
+
+    # Lines of an order and SKU are adjacent: the order's reserved stock
+    # serves them first, in position sequence
+    own_reserved = np.zeros(len(sku))
+    if reserved:
+        own_reserved = np.fromiter(
+            (reserved.get(line_order, {}).get(line_sku, 0)
+             for line_order, line_sku in zip(order_id.tolist(), sku.tolist())),
+            dtype=np.float64, count=len(sku)
+        )
+    first_of_order = np.ones(len(sku), dtype=bool)
+    first_of_order[1:] = (sku[1:] != sku[:-1]) | (order_id[1:] != order_id[:-1])
+    own_allocated = np.clip(
+        own_reserved - _sum_before(required, np.flatnonzero(first_of_order)),
+        0, required
+    )
+    shared_required = required - own_allocated
+
+    # Stock of each SKU (0 if it has no position), never below 0
+    stock_skus = np.frombuffer(frame.sku, dtype=np.int64)
+    stock_qtys = np.frombuffer(frame.qty, dtype=np.float64)
+    by_sku = np.argsort(stock_skus, kind='stable')
+    stock_skus, stock_qtys = stock_skus[by_sku], stock_qtys[by_sku]
+    demand_sku, group_start = np.unique(sku, return_index=True)
+    found = np.searchsorted(stock_skus, demand_sku)
+    found = np.minimum(found, max(len(stock_skus) - 1, 0))
+    stock_qty = np.zeros(len(demand_sku))
+    if len(stock_skus):
+        has_stock = stock_skus[found] == demand_sku
+        stock_qty[has_stock] = np.maximum(stock_qtys[found[has_stock]], 0)
+
+    # Shared stock goes to the lines in serving sequence, within each SKU
+    group_sizes = np.diff(np.append(group_start, len(sku)))
+    allocated = own_allocated + np.clip(
+        np.repeat(stock_qty, group_sizes)
+        - _sum_before(shared_required, group_start),
+        0, shared_required
+    )
+
+    demand_qty = (np.add.reduceat(required, group_start)
+                  if len(sku) else np.zeros(0))
+    if len(sku):
+        stock_qty = stock_qty + np.add.reduceat(
+            np.where(first_of_order, own_reserved, 0), group_start
+        )
+    return AvailabilityReport(
+        order_id=order_id,
+        position=position,
+        sku=sku,
+        qty_required=required,
+        qty_allocated=allocated,
+        shortage=required - allocated,
+        demand_sku=demand_sku,
+        demand_qty=demand_qty,
+        stock_qty=stock_qty,
+        shortage_qty=np.maximum(demand_qty - stock_qty, 0),
+    )
+
+
+def _sum_before(values: np.ndarray, group_start: np.ndarray) -> np.ndarray:
+    # Sum of the values before each one, within its group of adjacent values
+    group_sizes = np.diff(np.append(group_start, len(values)))
+    cumulative = np.cumsum(values)
+    return cumulative - values - np.repeat(
+        (cumulative - values)[group_start], group_sizes
+    )
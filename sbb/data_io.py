@@ -0,0 +1,324 @@
+""" data_io.py
+Streaming import and export of SKUs, external entities, orders and
+inventory levels, as CSV or JSONL files.
+Files are read and written chunk by chunk, so memory stays flat whatever
+their size. Each chunk of rows is validated in bulk, then inserted in one
+transaction: invalid rows are reported and skipped, the rest of the file
+is still imported.
+
+Columns imported (extra columns are ignored):
+    skus:       desc
+    entities:   name, entity_type ('supplier' or 'customer')
+    orders:     order, order_type, entity_id, sku, qty_ordered,
+                qty_delivered (optional, default 0).
+                Rows with the same 'order' key make one order: they must
+                follow each other. Lines are numbered in file sequence.
+    inventory:  sku, qty (absolute level; the last row of a SKU wins)
+Exports write the same columns, plus the ids assigned by the database.
+
+Usage:
+    python -m sbb.data_io import skus catalog.csv --db my_db
+    python -m sbb.data_io export orders orders.jsonl --db my_db
+
+Functions:
+    import_file
+    export_file
+    read_rows
+    main
+    _import_skus
+    _import_entities
+    _import_orders
+    _import_inventory
+    _chunks
+    _file_format
+    _missing_columns
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import sqlite3
+from collections.abc import Iterator
+
+from sbb.exceptions import SBB_Exception
+from sbb.sbb import StockBackbone
+from sbb.sbb_objects import Order, OrderLine, ImportReport, RejectedRow
+
+
+CHUNK_SIZE = 1000  # Rows per transaction
+FORMATS = ('csv', 'jsonl')
+IMPORT_COLUMNS = {
+    'skus': ['desc'],
+    'entities': ['name', 'entity_type'],
+    'orders': ['order', 'order_type', 'entity_id', 'sku', 'qty_ordered'],
+    'inventory': ['sku', 'qty'],
+}
+EXPORT_COLUMNS = {  # Same sequence as SBB_DBAdmin.EXPORT_QUERIES
+    'skus': ['sku', 'desc'],
+    'entities': ['id', 'name', 'entity_type'],
+    'orders': ['order', 'order_type', 'entity_id', 'position', 'sku',
+               'qty_ordered', 'qty_delivered'],
+    'inventory': ['sku', 'qty'],
+}
+
+
+def import_file(sbb: StockBackbone, kind: str, path: str, fmt: str = None,
+                chunk_size: int = CHUNK_SIZE) -> ImportReport:
+    importers = {
+        'skus': _import_skus,
+        'entities': _import_entities,
+        'orders': _import_orders,
+        'inventory': _import_inventory,
+    }
+    if kind not in importers:
+        raise SBB_Exception(f'Unexpected kind of rows: {kind}')
+
+    report = ImportReport(kind=kind)
+    numbered_rows = enumerate(read_rows(path, fmt), start=1)
+    for chunk in _chunks(numbered_rows, kind, chunk_size):
+        report.rows_read += len(chunk)
+        rejected = list()
+        valid_rows = list()
+        for row_number, row in chunk:
+            reason = _missing_columns(row, kind)
+            if reason is None:
+                valid_rows.append((row_number, row))
+            else:
+                rejected.append(RejectedRow(row_number, row, reason))
+
+        try:
+            with sbb.transaction():
+                num_imported = importers[kind](sbb, valid_rows, rejected)
+        except (SBB_Exception, sqlite3.Error) as error:
+            # Rows already rejected keep their own reason
+            already_rejected = {rejected_row.row_number
+                                for rejected_row in rejected}
+            num_imported = 0
+            rejected.extend(
+                RejectedRow(row_number, row, f'Chunk rolled back: {error}')
+                for row_number, row in valid_rows
+                if row_number not in already_rejected
+            )
+        report.rows_imported += num_imported
+        report.rejected.extend(rejected)
+    return report
+
+
+def export_file(sbb: StockBackbone, kind: str, path: str, fmt: str = None,
+                chunk_size: int = CHUNK_SIZE) -> int:
+    # Returns the number of rows written
+    if kind not in EXPORT_COLUMNS:
+        raise SBB_Exception(f'Unexpected kind of rows: {kind}')
+    fmt = _file_format(path, fmt)
+    columns = EXPORT_COLUMNS[kind]
+    num_rows = 0
+    with open(path, 'w', newline='') as export:
+        if fmt == 'csv':
+            writer = csv.writer(export)
+            writer.writerow(columns)
+        for row in sbb.iter_rows(kind, chunk_size):
+            if fmt == 'csv':
+                writer.writerow(row)
+            else:
+                export.write(json.dumps(dict(zip(columns, row))) + '\n')
+            num_rows += 1
+    return num_rows
+
+
+def read_rows(path: str, fmt: str = None) -> Iterator[dict | None]:
+    # Unreadable JSONL lines are yielded as None, to be rejected
+    fmt = _file_format(path, fmt)
+    with open(path, newline='') as source:
+        if fmt == 'csv':
+            yield from csv.DictReader(source)
+            return
+        for line in source:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                row = None
+            yield row if isinstance(row, dict) else None
+
+
+def main(argv: list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('kind', choices=list(IMPORT_COLUMNS))
+    parser.add_argument('path')
+    parser.add_argument('--db', required=True, help='Database name')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='Default: from the file extension')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    sbb = StockBackbone(args.db)
+    try:
+        if args.command == 'export':
+            num_rows = export_file(sbb, args.kind, args.path, args.format,
+                                   args.chunk_size)
+            print(f'Exported {num_rows} rows')
+        else:
+            report = import_file(sbb, args.kind, args.path, args.format,
+                                 args.chunk_size)
+            print(f'Imported {report.rows_imported} of {report.rows_read} rows')
+            for rejected_row in report.rejected:
+                print(f'Row {rejected_row.row_number} rejected: '
+                      f'{rejected_row.reason}')
+    finally:
+        sbb.close()
+
+
+def _import_skus(sbb: StockBackbone, rows: list[tuple[int, dict]],
+                 rejected: list[RejectedRow]) -> int:
+    result = sbb.create_skus([row['desc'] for _, row in rows])
+    rejected.extend(RejectedRow(rows[i][0], rows[i][1], error)
+                    for i, error in result.errors.items())
+    return len(rows) - len(result.errors)
+
+
+def _import_entities(sbb: StockBackbone, rows: list[tuple[int, dict]],
+                     rejected: list[RejectedRow]) -> int:
+    create_entities = {
+        'supplier': sbb.create_suppliers,
+        'customer': sbb.create_customers,
+    }
+    rows_by_type = {entity_type: list() for entity_type in create_entities}
+    for row_number, row in rows:
+        if row['entity_type'] in create_entities:
+            rows_by_type[row['entity_type']].append((row_number, row))
+        else:
+            rejected.append(RejectedRow(row_number, row,
+                                        'Invalid entity type'))
+
+    num_imported = 0
+    for entity_type, typed_rows in rows_by_type.items():
+        if not typed_rows:
+            continue
+        result = create_entities[entity_type]([
+            row['name'] for _, row in typed_rows
+        ])
+        rejected.extend(RejectedRow(typed_rows[i][0], typed_rows[i][1], error)
+                        for i, error in result.errors.items())
+        num_imported += len(typed_rows) - len(result.errors)
+    return num_imported
+
+
+def _import_orders(sbb: StockBackbone, rows: list[tuple[int, dict]],
+                   rejected: list[RejectedRow]) -> int:
+    rows_by_order = dict()
+    for row_number, row in rows:
+        rows_by_order.setdefault(str(row['order']), list()).append(
+            (row_number, row)
+        )
+
+    orders = list()
+    order_rows = list()  # Rows of each order, to reject them together
+    for numbered_rows in rows_by_order.values():
+        first_row = numbered_rows[0][1]
+        try:
+            the_order = Order(order_type=first_row['order_type'],
+                              entity_id=int(first_row['entity_id']))
+            for _, row in numbered_rows:
+                if ((row['order_type'], str(row['entity_id']))
+                        != (first_row['order_type'],
+                            str(first_row['entity_id']))):
+                    raise ValueError('Inconsistent order header')
+                the_order.lines.append(OrderLine(
+                    sku=int(row['sku']),
+                    qty_ordered=float(row['qty_ordered']),
+                    qty_delivered=float(row.get('qty_delivered') or 0)
+                ))
+        except (TypeError, ValueError) as error:
+            rejected.extend(RejectedRow(row_number, row, str(error))
+                            for row_number, row in numbered_rows)
+            continue
+        orders.append(the_order)
+        order_rows.append(numbered_rows)
+
+    result = sbb.create_orders(orders)
+    num_rows = 0
+    for i, numbered_rows in enumerate(order_rows):
+        if i in result.errors:
+            rejected.extend(RejectedRow(row_number, row, result.errors[i])
+                            for row_number, row in numbered_rows)
+        else:
+            num_rows += len(numbered_rows)
+    return num_rows
+
+
+def _import_inventory(sbb: StockBackbone, rows: list[tuple[int, dict]],
+                      rejected: list[RejectedRow]) -> int:
+    levels = dict()
+    numbered_rows = list()
+    for row_number, row in rows:
+        try:
+            sku, qty = int(row['sku']), float(row['qty'])
+        except (TypeError, ValueError):
+            rejected.append(RejectedRow(row_number, row, 'Invalid number'))
+            continue
+        if not (math.isfinite(qty) and qty >= 0):
+            rejected.append(RejectedRow(row_number, row, 'Invalid quantity'))
+            continue
+        levels[sku] = qty
+        numbered_rows.append((row_number, row, sku))
+
+    missing_skus = sbb.missing_skus(list(levels))
+    for row_number, row, sku in numbered_rows:
+        if sku in missing_skus:
+            rejected.append(RejectedRow(row_number, row,
+                                        f'SKU doesn\'t exist: {sku}'))
+            levels.pop(sku, None)
+
+    sbb.set_inventory_levels(levels)
+    return sum(1 for _, _, sku in numbered_rows if sku not in missing_skus)
+
+
+def _chunks(numbered_rows: Iterator[tuple[int, dict]], kind: str,
+            chunk_size: int) -> Iterator[list[tuple[int, dict]]]:
+    if kind != 'orders':
+        while chunk := list(itertools.islice(numbered_rows, chunk_size)):
+            yield chunk
+        return
+
+    # An order is never split between 2 chunks
+    chunk = list()
+    order_groups = itertools.groupby(
+        numbered_rows,
+        key=lambda numbered_row: (numbered_row[1] or {}).get('order')
+    )
+    for _, order_rows in order_groups:
+        chunk.extend(order_rows)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def _file_format(path: str, fmt: str | None) -> str:
+    if fmt is None:
+        fmt = str(path).rsplit('.', 1)[-1].lower()
+    if fmt not in FORMATS:
+        raise SBB_Exception(f'Unexpected file format: {fmt}')
+    return fmt
+
+
+def _missing_columns(row: dict | None, kind: str) -> str | None:
+    # Returns why the row can't be read, or None
+    if row is None:
+        return 'Unreadable row'
+    missing = [
+        column for column in IMPORT_COLUMNS[kind]
+        if row.get(column) in (None, '')
+    ]
+    if missing:
+        return f'Missing columns: {", ".join(missing)}'
+    return None
+
+
+if __name__ == '__main__':
+    main()
@@ -4,46 +4,556 @@ The methods below receive requests and interact with database.
 
 Class SBB_DBAdmin - methods:
     add_order
+    add_orders
     get_order
+    get_orders
+    iter_orders
+    get_order_batch
+    archive_orders
+    list_orders
+    list_order_lines
     add_order_lines
+    add_order_batch
     set_order_lines
 
     change_inventory
     set_inventory_level
     update_inventory_level
     get_inventory_level
+    get_inventory_frame
+    list_inventory
+    warm_inventory_cache
+    inventory_cache_stats
+    get_inventory_at
+    take_stock_snapshot
+    _decrement_inventory
+    _log_movements
+
+    get_total_on_hand
+    get_sku_aggregates
+    get_open_order_qty
+    rebuild_aggregates
+
+    reserve_order_lines
+    consume_reservations
+    cancel_reservations
+    release_expired_reservations
+    _delete_expired_reservations
+    get_available_to_promise
+    get_reserved_qty
 
     add_external_entity
+    add_external_entities
     add_sku
+    add_skus
+    list_skus
+    list_entities
+    iter_rows
+
+    transaction
+    read_snapshot
+    _write
+    _reset_caches
 
     is_entity
     is_sku
+    missing_entities
+    missing_skus
+    _existing_ids
+    _select_orders
+    _copy_to_archive
+    _delete_archived
+    _attach_archive
+    _attach_existing_archive
+    _attach_archive_to
+    _select_inventory
+    _add_known_ids
+    _load_existence_cache
+    _push_next_expiry
+    _next_id
+    _group_order_rows
+    _keyset_page
 
+    enable_instrumentation
+    disable_instrumentation
+
+    _con
+    _cur
     close_connection
     is_db_setup
     setup_db
+    get_schema_version
+    migrate_db
 """
 
+import heapq
 import sqlite3
+import time
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+from contextlib import contextmanager
+from pathlib import Path
+
+from sbb.db_pool import SBB_ConnectionPool
+from sbb.exceptions import SBB_Exception, ReadOnlyDatabase, NotEnoughStock
+from sbb.instrumentation import SBB_Instrumentation
+from sbb.inventory_cache import SBB_InventoryCache
+from sbb.sbb_objects import (
+    Order, OrderLine, StockPosition, StockChange, OrderBatch, InventoryFrame,
+    SkuAggregate, Product, ExternalEntity, Page
+)
+
+
+# Aggregates (schema version 4) are kept up to date by triggers, whichever
+# method writes inventory or order lines. Open qty of a line is never < 0.
+_OPEN_QTY = "MAX({row}.qty_ordered - {row}.qty_delivered, 0)"
+_OPEN_QTY_UPSERTS = f"""
+    INSERT INTO sku_aggregate (sku, open_po_qty, open_so_qty)
+    SELECT {{row}}.sku,
+           {{sign}}(orders.order_type = 'purchase') * {_OPEN_QTY},
+           {{sign}}(orders.order_type = 'sale') * {_OPEN_QTY}
+    FROM orders WHERE orders.id = {{row}}.order_id
+    ON CONFLICT(sku) DO UPDATE SET
+        open_po_qty = open_po_qty + excluded.open_po_qty,
+        open_so_qty = open_so_qty + excluded.open_so_qty;
+    INSERT INTO entity_aggregate (entity_id, order_type, open_qty)
+    SELECT orders.entity_id, orders.order_type, {{sign}}{_OPEN_QTY}
+    FROM orders WHERE orders.id = {{row}}.order_id
+    ON CONFLICT(entity_id, order_type) DO UPDATE SET
+        open_qty = open_qty + excluded.open_qty;
+"""
+_ON_HAND_UPSERTS = """
+    INSERT INTO sku_aggregate (sku, on_hand) VALUES ({row}.sku, {sign}{row}.qty)
+    ON CONFLICT(sku) DO UPDATE SET on_hand = on_hand + excluded.on_hand;
+    UPDATE stock_total SET on_hand = on_hand + ({sign}{row}.qty);
+"""
+# Used by rebuild_aggregates: follows the current schema (migration 4 has
+# its own copy, as released migrations never change)
+AGGREGATE_REBUILD = [
+    "DELETE FROM sku_aggregate;",
+    f"""
+    INSERT INTO sku_aggregate (sku, on_hand, open_po_qty, open_so_qty)
+    SELECT sku, SUM(on_hand), SUM(open_po_qty), SUM(open_so_qty) FROM (
+        SELECT sku, qty AS on_hand, 0 AS open_po_qty, 0 AS open_so_qty
+        FROM inventory
+        UNION ALL
+        SELECT ol.sku, 0,
+               (orders.order_type = 'purchase') * {_OPEN_QTY.format(row='ol')},
+               (orders.order_type = 'sale') * {_OPEN_QTY.format(row='ol')}
+        FROM order_line AS ol JOIN orders ON orders.id = ol.order_id
+    )
+    GROUP BY sku;
+    """,
+    "DELETE FROM entity_aggregate;",
+    f"""
+    INSERT INTO entity_aggregate (entity_id, order_type, open_qty)
+    SELECT orders.entity_id, orders.order_type,
+           SUM({_OPEN_QTY.format(row='ol')})
+    FROM order_line AS ol JOIN orders ON orders.id = ol.order_id
+    GROUP BY orders.entity_id, orders.order_type;
+    """,
+    "DELETE FROM stock_total;",
+    """
+    INSERT INTO stock_total (id, on_hand)
+    SELECT 1, COALESCE(SUM(qty), 0) FROM inventory;
+    """,
+]
+
+# Reserved qty (schema version 5) follows the reservation table likewise
+_RESERVED_QTY_UPSERT = """
+    INSERT INTO sku_aggregate (sku, reserved_qty)
+    VALUES ({row}.sku, {sign}{row}.qty)
+    ON CONFLICT(sku) DO UPDATE SET
+        reserved_qty = reserved_qty + excluded.reserved_qty;
+"""
+RESERVED_QTY_REBUILD = [  # To run after AGGREGATE_REBUILD
+    """
+    INSERT INTO sku_aggregate (sku, reserved_qty)
+    SELECT sku, SUM(qty) FROM reservation WHERE true GROUP BY sku
+    ON CONFLICT(sku) DO UPDATE SET reserved_qty = excluded.reserved_qty;
+    """,
+]
 
-from sbb.sbb_objects import Order, OrderLine, StockPosition, StockChange
+# Schema changes applied on top of the tables created by setup_db (version 1).
+# Append new (version, statements) entries; never edit released ones.
+SCHEMA_MIGRATIONS = [
+    (2, [
+        # Merge duplicate inventory positions before enforcing one per SKU
+        """
+        UPDATE inventory SET
+            qty = (SELECT SUM(qty) FROM inventory AS dup
+                   WHERE dup.sku = inventory.sku)
+        WHERE position_id IN (SELECT MIN(position_id) FROM inventory
+                              GROUP BY sku HAVING COUNT(*) > 1);
+        """,
+        """
+        DELETE FROM inventory
+        WHERE position_id NOT IN (SELECT MIN(position_id) FROM inventory
+                                  GROUP BY sku);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_line_order
+        ON order_line (order_id, position);
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_sku
+        ON inventory (sku);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_type_entity
+        ON orders (order_type, entity_id);
+        """,
+    ]),
+    (3, [
+        # Append-only ledger of every inventory change (qty is signed)
+        """
+        CREATE TABLE IF NOT EXISTS stock_movement (
+            id INTEGER PRIMARY KEY,
+            created_at REAL NOT NULL,
+            sku INTEGER NOT NULL,
+            qty REAL NOT NULL,
+            movement_code TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_stock_movement_sku
+        ON stock_movement (sku, id);
+        """,
+        # Inventory materialized up to (and including) last_movement_id
+        """
+        CREATE TABLE IF NOT EXISTS stock_snapshot (
+            id INTEGER PRIMARY KEY,
+            created_at REAL NOT NULL,
+            last_movement_id INTEGER NOT NULL
+        );
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_stock_snapshot_created
+        ON stock_snapshot (created_at);
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stock_snapshot_line (
+            snapshot_id INTEGER NOT NULL,
+            sku INTEGER NOT NULL,
+            qty REAL NOT NULL,
+            PRIMARY KEY (snapshot_id, sku)
+        );
+        """,
+        # Opening snapshot of the stock held before the ledger existed
+        """
+        INSERT INTO stock_snapshot (id, created_at, last_movement_id)
+        VALUES (1, (julianday('now') - 2440587.5) * 86400.0, 0);
+        """,
+        """
+        INSERT INTO stock_snapshot_line (snapshot_id, sku, qty)
+        SELECT 1, sku, qty FROM inventory;
+        """,
+    ]),
+    (4, [
+        # Aggregates for dashboards, read without scanning history
+        """
+        CREATE TABLE IF NOT EXISTS sku_aggregate (
+            sku INTEGER PRIMARY KEY,
+            on_hand REAL NOT NULL DEFAULT 0,
+            open_po_qty REAL NOT NULL DEFAULT 0,
+            open_so_qty REAL NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS entity_aggregate (
+            entity_id INTEGER NOT NULL,
+            order_type TEXT NOT NULL,
+            open_qty REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (entity_id, order_type)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stock_total (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            on_hand REAL NOT NULL
+        );
+        """,
+        # Initial fill: frozen copy of AGGREGATE_REBUILD as of version 4
+        "DELETE FROM sku_aggregate;",
+        """
+        INSERT INTO sku_aggregate (sku, on_hand, open_po_qty, open_so_qty)
+        SELECT sku, SUM(on_hand), SUM(open_po_qty), SUM(open_so_qty) FROM (
+            SELECT sku, qty AS on_hand, 0 AS open_po_qty, 0 AS open_so_qty
+            FROM inventory
+            UNION ALL
+            SELECT ol.sku, 0,
+                   (orders.order_type = 'purchase')
+                   * MAX(ol.qty_ordered - ol.qty_delivered, 0),
+                   (orders.order_type = 'sale')
+                   * MAX(ol.qty_ordered - ol.qty_delivered, 0)
+            FROM order_line AS ol JOIN orders ON orders.id = ol.order_id
+        )
+        GROUP BY sku;
+        """,
+        "DELETE FROM entity_aggregate;",
+        """
+        INSERT INTO entity_aggregate (entity_id, order_type, open_qty)
+        SELECT orders.entity_id, orders.order_type,
+               SUM(MAX(ol.qty_ordered - ol.qty_delivered, 0))
+        FROM order_line AS ol JOIN orders ON orders.id = ol.order_id
+        GROUP BY orders.entity_id, orders.order_type;
+        """,
+        "DELETE FROM stock_total;",
+        """
+        INSERT INTO stock_total (id, on_hand)
+        SELECT 1, COALESCE(SUM(qty), 0) FROM inventory;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_aggregate_inventory_insert
+        AFTER INSERT ON inventory
+        BEGIN {_ON_HAND_UPSERTS.format(row='NEW', sign='+')} END;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_aggregate_inventory_update
+        AFTER UPDATE OF sku, qty ON inventory
+        BEGIN
+            {_ON_HAND_UPSERTS.format(row='OLD', sign='-')}
+            {_ON_HAND_UPSERTS.format(row='NEW', sign='+')}
+        END;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_aggregate_inventory_delete
+        AFTER DELETE ON inventory
+        BEGIN {_ON_HAND_UPSERTS.format(row='OLD', sign='-')} END;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_aggregate_order_line_insert
+        AFTER INSERT ON order_line
+        BEGIN {_OPEN_QTY_UPSERTS.format(row='NEW', sign='+')} END;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_aggregate_order_line_update
+        AFTER UPDATE OF order_id, sku, qty_ordered, qty_delivered
+        ON order_line
+        BEGIN
+            {_OPEN_QTY_UPSERTS.format(row='OLD', sign='-')}
+            {_OPEN_QTY_UPSERTS.format(row='NEW', sign='+')}
+        END;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_aggregate_order_line_delete
+        AFTER DELETE ON order_line
+        BEGIN {_OPEN_QTY_UPSERTS.format(row='OLD', sign='-')} END;
+        """,
+    ]),
+    (5, [
+        # Soft reservations of stock by sale order lines, until expires_at
+        """
+        CREATE TABLE IF NOT EXISTS reservation (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            sku INTEGER NOT NULL,
+            qty REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservation_expiry
+        ON reservation (expires_at);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservation_line
+        ON reservation (order_id, position);
+        """,
+        """
+        ALTER TABLE sku_aggregate
+        ADD COLUMN reserved_qty REAL NOT NULL DEFAULT 0;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_aggregate_reservation_insert
+        AFTER INSERT ON reservation
+        BEGIN {_RESERVED_QTY_UPSERT.format(row='NEW', sign='+')} END;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_aggregate_reservation_update
+        AFTER UPDATE OF sku, qty ON reservation
+        BEGIN
+            {_RESERVED_QTY_UPSERT.format(row='OLD', sign='-')}
+            {_RESERVED_QTY_UPSERT.format(row='NEW', sign='+')}
+        END;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_aggregate_reservation_delete
+        AFTER DELETE ON reservation
+        BEGIN {_RESERVED_QTY_UPSERT.format(row='OLD', sign='-')} END;
+        """,
+    ]),
+    (6, [
+        # Keyset pages of order lines filtered by SKU (the rowid is in the
+        # index, so 'sku = ? AND id > ? ORDER BY id' needs no sort)
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_line_sku
+        ON order_line (sku);
+        """,
+    ]),
+    (7, [
+        # Creation time, to archive old closed orders. Orders created before
+        # this version are dated from the migration.
+        """
+        ALTER TABLE orders ADD COLUMN created_at REAL;
+        """,
+        """
+        UPDATE orders SET created_at = (julianday('now') - 2440587.5) * 86400.0;
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_created
+        ON orders (created_at);
+        """,
+    ]),
+    (8, [
+        # Snapshots after this version only hold the SKUs moved since the
+        # previous one: latest line of a SKU up to a given snapshot
+        """
+        CREATE INDEX IF NOT EXISTS idx_stock_snapshot_line_sku
+        ON stock_snapshot_line (sku, snapshot_id);
+        """,
+    ]),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+# Archive database (data/<name>_archive.db), attached as 'archive'. It holds
+# the closed orders moved out of the hot tables by archive_orders.
+ARCHIVE_SETUP = [
+    """
+    CREATE TABLE IF NOT EXISTS archive.orders (
+        id INTEGER PRIMARY KEY,
+        order_type TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        created_at REAL,
+        archived_at REAL NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS archive.order_line (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        sku INTEGER NOT NULL,
+        qty_ordered INTEGER NOT NULL,
+        qty_delivered INTEGER NOT NULL
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS archive.idx_order_line_order
+    ON order_line (order_id, position);
+    """,
+]
 
 
 class SBB_DBAdmin():
     DB_TABLES = [
-        'purchase_order', 'po_line', 'sale_order', 'so_line', 
-        'product', 'inventory', 'external_entity'
+        'orders', 'order_line', 'product', 'inventory', 'external_entity',
+        'schema_version'
+    ]
+    MAX_QUERY_PARAMS = 900  # Below SQLite's historical limit of 999
+    SNAPSHOT_INTERVAL = 10_000  # Stock movements between 2 stock snapshots
+    RESERVATION_REFRESH_INTERVAL = 1.0  # Seconds between heap refreshes
+    NOT_INSTRUMENTED = [  # Context managers, generators, connection admin
+        'transaction', 'read_snapshot', 'iter_orders', 'iter_rows',
+        'close_connection',
+        'enable_instrumentation', 'disable_instrumentation'
     ]
+    ORDER_QUERY = """
+        SELECT
+            orders.id, orders.order_type, orders.entity_id,
+            ol.position, ol.sku, ol.qty_ordered, ol.qty_delivered
+        FROM orders
+        LEFT JOIN order_line AS ol ON ol.order_id = orders.id
+        """
+    ARCHIVE_ORDER_QUERY = """
+        SELECT
+            orders.id, orders.order_type, orders.entity_id,
+            ol.position, ol.sku, ol.qty_ordered, ol.qty_delivered
+        FROM archive.orders AS orders
+        LEFT JOIN archive.order_line AS ol ON ol.order_id = orders.id
+        """
+    OPEN_ORDER_CONDITION = """
+        EXISTS (SELECT 1 FROM order_line AS open_ol
+                WHERE open_ol.order_id = orders.id
+                AND open_ol.qty_delivered < open_ol.qty_ordered)
+        """
+    EXPORT_QUERIES = {  # Columns as read back by data_io imports
+        'skus': "SELECT sku, desc FROM product ORDER BY sku",
+        'entities': """
+            SELECT id, name, entity_type FROM external_entity ORDER BY id
+            """,
+        'orders': """
+            SELECT orders.id, orders.order_type, orders.entity_id,
+                   ol.position, ol.sku, ol.qty_ordered, ol.qty_delivered
+            FROM orders
+            JOIN order_line AS ol ON ol.order_id = orders.id
+            ORDER BY orders.id, ol.position
+            """,
+        'inventory': "SELECT sku, qty FROM inventory ORDER BY sku",
+    }
+
+    def __init__(self, db_name: str, cache_existence: bool = False,
+                 busy_timeout: float = SBB_ConnectionPool.BUSY_TIMEOUT,
+                 inventory_cache_size: int = 0,
+                 snapshot_interval: int | None = SNAPSHOT_INTERVAL,
+                 read_only: bool = False) -> None:
+        # read_only: reporting access to a database set up by a writer.
+        # Caches are not available, as they would miss the writer's changes.
+        self._db_name = db_name
+        if read_only and (db_name == ':memory:'):
+            raise SBB_Exception('An in-memory database cannot be read-only')
+        if read_only and (cache_existence or inventory_cache_size > 0):
+            raise SBB_Exception('Caches are not available read-only')
 
-    def __init__(self, db_name: str) -> None:
         if db_name == ':memory:':
-            self._con = sqlite3.connect(':memory:')
+            self._pool = SBB_ConnectionPool(':memory:', busy_timeout)
+            self._archive_path = ':memory:'
         else:
-            self._con = sqlite3.connect(f'data/{db_name}.db')
-        self._cur = self._con.cursor()
-        
-        if not self.is_db_setup():
+            self._pool = SBB_ConnectionPool(f'data/{db_name}.db', busy_timeout,
+                                            read_only)
+            self._archive_path = f'data/{db_name}_archive.db'
+
+        if read_only:
+            try:
+                is_db_setup = self.is_db_setup()
+            except sqlite3.OperationalError:
+                is_db_setup = False
+            if not is_db_setup:
+                self.close_connection()
+                raise SBB_Exception(f'Database not set up: {db_name}')
+        elif not self.is_db_setup():
             self.setup_db()
+
+        # In-memory sets of known SKUs / entity ids (None = disabled), with
+        # the (SKUs, entity ids) added at each open transaction level
+        self._known_skus = None
+        self._known_entities = None
+        self._known_ids_added = list()
+        if cache_existence:
+            self._load_existence_cache()
+
+        self._snapshot_interval = snapshot_interval  # None = manual only
+        self._instrumentation = None
+
+        # In-memory inventory levels of the hottest SKUs (None = disabled)
+        self._inventory_cache = None
+        if inventory_cache_size > 0:
+            self._inventory_cache = SBB_InventoryCache(inventory_cache_size)
+
+        # Min-heap of reservation expiry times, so that releasing expired
+        # reservations costs nothing until one is due. It holds the earliest
+        # expiry on disk as of its last refresh, plus times that may be stale
+        # (harmless).
+        self._reservation_expiries = list()
+        self._expiries_refreshed_at = 0.0
+        if not read_only:
+            self._push_next_expiry()
+
+        # Archive, if there is one (otherwise created by archive_orders).
+        # Connections opened later attach it before any transaction.
+        self._archive_connections = set()
+        self._pool.add_connect_hook(self._attach_existing_archive)
         
     
     ##############################
@@ -51,209 +561,1224 @@ class SBB_DBAdmin():
     ##############################
 
     def add_order(self, the_order: Order) -> int:
-        self._cur.execute("""
-                          INSERT INTO orders 
-                          (order_type, entity_id)
-                          VALUES (?, ?);
-                          """,
-                          [the_order.order_type, the_order.entity_id])
-        self._con.commit()
-        return self._cur.lastrowid
+        with self._write():
+            self._cur.execute("""
+                              INSERT INTO orders 
+                              (order_type, entity_id, created_at)
+                              VALUES (?, ?, ?);
+                              """,
+                              [the_order.order_type, the_order.entity_id,
+                               time.time()])
+            return self._cur.lastrowid
+
+    def add_orders(self, orders: list[Order]) -> list[int]:
+        created_at = time.time()
+        with self._write():
+            # Ids read under the write lock, as other threads insert too
+            first_id = self._next_id('orders', 'id')
+            order_ids = list(range(first_id, first_id + len(orders)))
+            for order_id, the_order in zip(order_ids, orders):
+                the_order.id = order_id
+                for ol in the_order.lines:
+                    ol.order_id = order_id
+
+            self._cur.executemany("""
+                INSERT INTO orders
+                (id, order_type, entity_id, created_at)
+                VALUES (?, ?, ?, ?);
+                                  """,
+                                  [
+                                      [the_order.id, the_order.order_type,
+                                       the_order.entity_id, created_at]
+                                      for the_order in orders
+                                  ])
+            self._cur.executemany("""
+                INSERT INTO order_line
+                (order_id, position, sku, qty_ordered, qty_delivered)
+                VALUES (?, ?, ?, ?, ?);
+                                  """,
+                                  [
+                                      [ol.order_id, ol.position, ol.sku,
+                                       ol.qty_ordered, ol.qty_delivered]
+                                      for the_order in orders
+                                      for ol in the_order.lines
+                                  ])
+        return order_ids
     
-    def get_order(self, order_id: int) -> Order:
-        order = (
-            self._cur
-            .execute("""
-                     SELECT
-                        orders.id, orders.order_type, orders.entity_id,
-                        ol.position, ol.sku, ol.qty_ordered, ol.qty_delivered
-                     FROM orders
-                     LEFT JOIN order_line AS ol
-                     WHERE orders.id = ?
-                     """, [order_id])
-            .fetchall()
+    def get_order(self, order_id: int) -> Order | None:
+        # Archived orders are read from the archive
+        the_order = self._select_orders(SBB_DBAdmin.ORDER_QUERY,
+                                        [order_id]).get(order_id)
+        if (the_order is None) and self._attach_archive():
+            the_order = self._select_orders(SBB_DBAdmin.ARCHIVE_ORDER_QUERY,
+                                            [order_id]).get(order_id)
+        return the_order
+
+    def get_orders(self, order_ids: list[int]) -> list[Order]:
+        # Orders are returned in the requested sequence; unknown ids are
+        # skipped. Archived orders are read from the archive.
+        unique_ids = list(dict.fromkeys(order_ids))
+        orders_found = self._select_orders(SBB_DBAdmin.ORDER_QUERY, unique_ids)
+        archived_ids = [
+            order_id for order_id in unique_ids if order_id not in orders_found
+        ]
+        if archived_ids and self._attach_archive():
+            orders_found.update(self._select_orders(
+                SBB_DBAdmin.ARCHIVE_ORDER_QUERY, archived_ids
+            ))
+        return [
+            orders_found[order_id] for order_id in order_ids
+            if order_id in orders_found
+        ]
+
+    def iter_orders(self, order_type: str = None, entity_id: int = None,
+                    open_only: bool = False,
+                    chunk_size: int = 1000) -> Iterator[Order]:
+        conditions = list()
+        params = list()
+        if order_type is not None:
+            conditions.append('orders.order_type = ?')
+            params.append(order_type)
+        if entity_id is not None:
+            conditions.append('orders.entity_id = ?')
+            params.append(entity_id)
+        if open_only:
+            conditions.append(SBB_DBAdmin.OPEN_ORDER_CONDITION)
+        where_clause = (
+            ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
         )
-        return Order(
-            id=order[0][0],
-            order_type=order[0][1],
-            entity_id=order[0][2],
-            lines=[
-                OrderLine(position=ol[3], sku=ol[4], 
-                          qty_ordered=ol[5], qty_delivered=ol[6])
-                for ol in order
-            ]
+
+        # Own cursor, so that other calls can run while the caller iterates
+        cursor = self._con.cursor()
+        cursor.execute(f"""
+                       {SBB_DBAdmin.ORDER_QUERY}
+                       {where_clause}
+                       ORDER BY orders.id, ol.position
+                       """, params)
+
+        def fetch_rows() -> Iterator[tuple]:
+            while rows := cursor.fetchmany(chunk_size):
+                yield from rows
+
+        try:
+            yield from SBB_DBAdmin._group_order_rows(fetch_rows())
+        finally:
+            cursor.close()
+
+    def get_order_batch(self, order_ids: list[int] = None,
+                        order_type: str = None,
+                        open_only: bool = False) -> OrderBatch:
+        # Lines go straight into columns: no Order / OrderLine objects.
+        # open_only keeps the lines not fully delivered.
+        batch = OrderBatch()
+        conditions = list()
+        params = list()
+        if order_type is not None:
+            conditions.append('orders.order_type = ?')
+            params.append(order_type)
+        if open_only:
+            conditions.append('ol.qty_delivered < ol.qty_ordered')
+
+        def fill(id_condition: list[str], id_params: list) -> None:
+            where_clause = ' AND '.join(conditions + id_condition)
+            batch.extend(self._cur.execute(f"""
+                SELECT ol.order_id, ol.position, ol.sku,
+                       ol.qty_ordered, ol.qty_delivered
+                FROM order_line AS ol
+                JOIN orders ON orders.id = ol.order_id
+                {('WHERE ' + where_clause) if where_clause else ''}
+                ORDER BY ol.order_id, ol.position
+                """, params + id_params))
+
+        if order_ids is None:
+            fill([], [])
+        else:
+            unique_ids = list(dict.fromkeys(order_ids))
+            for i in range(0, len(unique_ids), SBB_DBAdmin.MAX_QUERY_PARAMS):
+                chunk = unique_ids[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+                fill([f"ol.order_id IN ({','.join(len(chunk)*['?'])})"], chunk)
+        return batch
+
+    def archive_orders(self, cutoff: datetime | float,
+                       chunk_size: int = 1000) -> int:
+        # Moves the closed orders (all lines delivered) created before cutoff
+        # to the archive database, one transaction per chunk of orders.
+        # Returns the number of orders archived.
+        if self._pool.read_only:
+            raise ReadOnlyDatabase(self._db_name)
+        if self._pool.state().tx_depth > 0:
+            raise SBB_Exception('Orders cannot be archived within a transaction')
+        if isinstance(cutoff, datetime):
+            cutoff = cutoff.timestamp()
+        chunk_size = min(chunk_size, SBB_DBAdmin.MAX_QUERY_PARAMS)
+        self._attach_archive(create=True)
+
+        # The newest order and the order of the newest line are kept, so that
+        # SQLite (next rowid = MAX(rowid) + 1) never reuses an archived id.
+        # Attached databases in WAL mode commit one file after the other:
+        # a chunk is committed to the archive first, then deleted from main
+        # in a second transaction. A crash in between leaves the orders in
+        # both files (main is read first); the next run finishes the chunk.
+        num_archived = 0
+        while True:
+            with self.transaction():
+                order_ids = [row[0] for row in self._cur.execute(f"""
+                    SELECT orders.id FROM main.orders
+                    WHERE orders.created_at < ?
+                    AND EXISTS (SELECT 1 FROM main.order_line AS ol
+                                WHERE ol.order_id = orders.id)
+                    AND NOT {SBB_DBAdmin.OPEN_ORDER_CONDITION}
+                    AND orders.id < (SELECT MAX(id) FROM main.orders)
+                    AND orders.id IS NOT (SELECT order_id FROM main.order_line
+                                          ORDER BY id DESC LIMIT 1)
+                    ORDER BY orders.id
+                    LIMIT ?
+                    """, [cutoff, chunk_size])]
+                if not order_ids:
+                    return num_archived
+                self._copy_to_archive(order_ids)
+            num_archived += self._delete_archived(order_ids)
+
+    def list_orders(self, order_type: str = None, entity_id: int = None,
+                    open_only: bool = False, after: int = None,
+                    limit: int = 100) -> Page:
+        # Page of orders (with their lines) by ascending id, after order id
+        # 'after'. Pass the page's next_cursor as 'after' to get the next one.
+        conditions = list()
+        params = list()
+        if order_type is not None:
+            conditions.append('orders.order_type = ?')
+            params.append(order_type)
+        if entity_id is not None:
+            conditions.append('orders.entity_id = ?')
+            params.append(entity_id)
+        if open_only:
+            conditions.append(SBB_DBAdmin.OPEN_ORDER_CONDITION)
+        rows, next_cursor = self._keyset_page(
+            "SELECT orders.id FROM orders", 'orders.id',
+            conditions, params, after, limit
         )
+        return Page(self.get_orders([row[0] for row in rows]), next_cursor)
+
+    def list_order_lines(self, order_id: int = None, sku: int = None,
+                         open_only: bool = False, after: int = None,
+                         limit: int = 100) -> Page:
+        # Page of order lines by ascending line id, after line id 'after'
+        conditions = list()
+        params = list()
+        if order_id is not None:
+            conditions.append('ol.order_id = ?')
+            params.append(order_id)
+        if sku is not None:
+            conditions.append('ol.sku = ?')
+            params.append(sku)
+        if open_only:
+            conditions.append('ol.qty_delivered < ol.qty_ordered')
+        rows, next_cursor = self._keyset_page(
+            """
+            SELECT ol.id, ol.order_id, ol.position, ol.sku,
+                   ol.qty_ordered, ol.qty_delivered
+            FROM order_line AS ol
+            """, 'ol.id', conditions, params, after, limit
+        )
+        return Page([OrderLine(*row) for row in rows], next_cursor)
 
     def add_order_lines(self, order_lines: list[OrderLine]) -> int:
-        self._cur.executemany("""
-            INSERT INTO order_line 
-            (order_id, position, sku, qty_ordered, qty_delivered)
-            VALUES (?, ?, ?, ?, ?);
-                              """,
-                              [
-                                  [ol.order_id, ol.position, ol.sku,
-                                   ol.qty_ordered, ol.qty_delivered]
-                                  for ol in order_lines
-                              ])
-        self._con.commit()
-        return self._cur.rowcount
-    
-    def set_order_lines(self, mode: str, data: list) -> None:
-        if mode == 'delivered_qty':
+        with self._write():
             self._cur.executemany("""
-                              UPDATE order_line SET
-                                  qty_delivered = ?
-                              WHERE id = ?
-                              """,
-                              [
-                                  [ol.qty_delivered, ol.position]
-                                  for ol in data
-                              ])
+                INSERT INTO order_line 
+                (order_id, position, sku, qty_ordered, qty_delivered)
+                VALUES (?, ?, ?, ?, ?);
+                                  """,
+                                  [
+                                      [ol.order_id, ol.position, ol.sku,
+                                       ol.qty_ordered, ol.qty_delivered]
+                                      for ol in order_lines
+                                  ])
+            return self._cur.rowcount
 
+    def add_order_batch(self, batch: OrderBatch) -> int:
+        # Same as add_order_lines, read from the columns
+        with self._write():
+            self._cur.executemany("""
+                INSERT INTO order_line
+                (order_id, position, sku, qty_ordered, qty_delivered)
+                VALUES (?, ?, ?, ?, ?);
+                                  """,
+                                  batch.rows())
+            return self._cur.rowcount
+    
+    def set_order_lines(self, mode: str,
+                        data: list[OrderLine] | OrderBatch) -> None:
+        if isinstance(data, OrderBatch):
+            params = zip(data.qty_delivered, data.order_id, data.position)
+        else:
+            params = (
+                [ol.qty_delivered, ol.order_id, ol.position] for ol in data
+            )
+        with self._write():
+            match mode:
+                case 'delivered_qty':  # Absolute delivered quantities
+                    self._cur.executemany("""
+                                      UPDATE order_line SET
+                                          qty_delivered = ?
+                                      WHERE order_id = ? AND position = ?
+                                      """,
+                                      params)
+                case 'delivered_qty_delta':  # qty_delivered = qty just delivered
+                    self._cur.executemany("""
+                                      UPDATE order_line SET
+                                          qty_delivered = qty_delivered + ?
+                                      WHERE order_id = ? AND position = ?
+                                      """,
+                                      params)
 
     def change_inventory(self, change_code: str,
-                         data: list[StockChange | StockPosition]) -> bool:
-        match change_code:
-            case '101':  # Increase inventory because of PO-receipt
-                inventory_levels = self.get_inventory_level(
-                    [item.sku for item in data]
-                )  # List[StockPosition, ...]
-                inv_pos_to_create = list()
-                inv_position_to_update = list()
-                for item in data:
-                    search_existing_inv = [
-                        inv for inv in inventory_levels
-                        if inv.sku == item.sku
-                    ]
-                    if len(search_existing_inv) == 1:
-                        inv = search_existing_inv[0]
-                        inv_position_to_update.append(StockChange(
-                            position=inv.position, qty=inv.qty + item.qty
-                        ))
-                    elif len(search_existing_inv) == 1:
-                        raise Exception(f'Unexpected number of inv. positions')
-                    else:
-                        inv_pos_to_create.append(StockPosition(
-                            sku=item.sku, qty=item.qty
-                        ))
-                
-                success = True
-                if len(inv_pos_to_create) > 0:
-                    new_lines = self.set_inventory_level(inv_pos_to_create)
-                    success = new_lines == len(inv_pos_to_create)
-                
-                if len(inv_position_to_update) > 0:
-                    self.update_inventory_level(inv_position_to_update)
-
-                return success
-            
-            case '201':  # Decrease inventory because of SO-issue
-                self.update_inventory_level(data)
+                         data: list[StockChange] | InventoryFrame) -> bool:
+        # Quantities are relative; duplicate SKUs are merged first
+        if isinstance(data, InventoryFrame):
+            qty_by_sku = data.qty_by_sku()
+        else:
+            qty_by_sku = dict()
+            for item in data:
+                qty_by_sku[item.sku] = qty_by_sku.get(item.sku, 0) + item.qty
+
+        with self._write():
+            match change_code:
+                case '101':  # Increase inventory because of PO-receipt
+                    self._cur.executemany("""
+                        INSERT INTO inventory (sku, qty)
+                        VALUES (?, ?)
+                        ON CONFLICT(sku) DO UPDATE SET
+                            qty = qty + excluded.qty;
+                                          """,
+                                          list(qty_by_sku.items()))
+                    qty_change_by_sku = qty_by_sku
+
+                case '201':  # Decrease inventory because of SO-issue
+                    # Checked and applied by the same statement: stock read
+                    # beforehand could be stale. Any shortage rolls back.
+                    self._decrement_inventory(qty_by_sku)
+                    qty_change_by_sku = {
+                        sku: -qty for sku, qty in qty_by_sku.items()
+                    }
+
+                case _:
+                    raise Exception(f'Unexpected change code: {change_code}')
+
+            success = (change_code == '201') or (
+                self._cur.rowcount == len(qty_by_sku)
+            )
+            if self._inventory_cache is not None:
+                self._inventory_cache.add_qty(qty_change_by_sku)
+            self._log_movements(change_code, qty_change_by_sku)
+            return success
     
     def set_inventory_level(self, new_positions: list[StockPosition]) -> int:
-        self._cur.executemany("""
-                              INSERT INTO inventory 
-                              (sku, qty)
-                              VALUES (?, ?);
-                              """,
-                              [
-                                  [position.sku, position.qty]
-                                  for position in new_positions
-                              ])
-        self._con.commit()
-        return self._cur.rowcount
+        with self._write():
+            self._cur.executemany("""
+                                  INSERT INTO inventory 
+                                  (sku, qty)
+                                  VALUES (?, ?);
+                                  """,
+                                  [
+                                      [position.sku, position.qty]
+                                      for position in new_positions
+                                  ])
+            num_positions = self._cur.rowcount
+            if self._inventory_cache is not None:  # Positions ids unknown
+                self._inventory_cache.invalidate([
+                    position.sku for position in new_positions
+                ])
+            self._log_movements('561', {  # Initial entry of stock
+                position.sku: position.qty for position in new_positions
+            })
+            return num_positions
 
     def update_inventory_level(self, 
                                position_changes: list[StockChange]) -> None:
-        self._cur.executemany("""
-                              UPDATE inventory SET
-                                  qty = ?
-                              WHERE position_id = ?
-                              """,
-                              [
-                                  [position.qty, position.position]
-                                  for position in position_changes
-                              ])
+        with self._write():
+            # Previous levels are needed to record the movements
+            position_ids = [position.position for position in position_changes]
+            previous_levels = dict()
+            for i in range(0, len(position_ids), SBB_DBAdmin.MAX_QUERY_PARAMS):
+                chunk = position_ids[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+                previous_levels.update(
+                    (row[0], (row[1], row[2]))
+                    for row in self._cur.execute(f"""
+                        SELECT position_id, sku, qty FROM inventory
+                        WHERE position_id IN ({','.join(len(chunk)*['?'])})
+                        """, chunk)
+                )
+
+            self._cur.executemany("""
+                                  UPDATE inventory SET
+                                      qty = ?
+                                  WHERE position_id = ?
+                                  """,
+                                  [
+                                      [position.qty, position.position]
+                                      for position in position_changes
+                                  ])
+            if self._inventory_cache is not None:
+                for position in position_changes:
+                    self._inventory_cache.update_position(position.position,
+                                                          position.qty)
+
+            qty_change_by_sku = dict()
+            for position in position_changes:
+                if position.position in previous_levels:
+                    sku, previous_qty = previous_levels[position.position]
+                    qty_change_by_sku[sku] = (
+                        qty_change_by_sku.get(sku, 0)
+                        + position.qty - previous_qty
+                    )
+                    previous_levels[position.position] = (sku, position.qty)
+            self._log_movements('711', qty_change_by_sku)  # Adjustment
 
     def get_inventory_level(self, skus: list[int]) -> list[StockPosition]:
-        lines = (
-            self._cur
-            .execute(f"""
-                     SELECT position_id, sku, qty FROM inventory
-                     WHERE sku in ({','.join(len(skus)*['?'])})""",
-                     skus)
-            .fetchall()
-        )
+        # Positions are returned in the sequence of the requested SKUs
+        if self._inventory_cache is None:
+            positions = {
+                stock_position.sku: stock_position
+                for stock_position in self._select_inventory(skus)
+            }
+        else:
+            # Generation read first: rows selected while another thread
+            # writes (or before it commits) are returned, but not cached
+            generation = self._inventory_cache.generation()
+            positions, missing = self._inventory_cache.lookup(skus)
+            if missing:
+                fetched = self._select_inventory(missing)
+                fetched_skus = {stock_position.sku for stock_position in fetched}
+                self._inventory_cache.store(fetched, [
+                    sku for sku in missing if sku not in fetched_skus
+                ], generation)
+                positions.update(
+                    (stock_position.sku, stock_position)
+                    for stock_position in fetched
+                )
 
         return [
-            StockPosition(position=line[0], sku=line[1], qty=line[2])
-            for line in lines
+            positions[sku] for sku in dict.fromkeys(skus)
+            if positions.get(sku) is not None
             ]
 
+    def get_inventory_frame(self, skus: list[int] = None) -> InventoryFrame:
+        # Columnar positions of the given SKUs (None = whole inventory).
+        # Bulk path: reads the table directly, bypassing the inventory cache.
+        frame = InventoryFrame()
+        if skus is None:
+            frame.extend(self._cur.execute(
+                "SELECT position_id, sku, qty FROM inventory ORDER BY sku"
+            ))
+            return frame
+        skus = list(dict.fromkeys(skus))
+        for i in range(0, len(skus), SBB_DBAdmin.MAX_QUERY_PARAMS):
+            chunk = skus[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+            frame.extend(self._cur.execute(f"""
+                SELECT position_id, sku, qty FROM inventory
+                WHERE sku IN ({','.join(len(chunk)*['?'])})
+                """, chunk))
+        return frame
+
+    def list_inventory(self, in_stock_only: bool = False, after: int = None,
+                       limit: int = 100) -> Page:
+        # Page of stock positions by ascending SKU (one position per SKU),
+        # after SKU 'after'
+        rows, next_cursor = self._keyset_page(
+            "SELECT sku, position_id, qty FROM inventory", 'sku',
+            ['qty > 0'] if in_stock_only else [], [], after, limit
+        )
+        return Page([StockPosition(position=position, sku=sku, qty=qty)
+                     for sku, position, qty in rows], next_cursor)
+
+    def warm_inventory_cache(self, skus: list[int] = None) -> None:
+        # Loads the given SKUs, or the whole inventory up to the cache size
+        if self._inventory_cache is None:
+            return
+        generation = self._inventory_cache.generation()
+        if skus is None:
+            rows = self._cur.execute(
+                "SELECT position_id, sku, qty FROM inventory LIMIT ?",
+                [self._inventory_cache.max_size]
+            )
+            self._inventory_cache.store([
+                StockPosition(position=row[0], sku=row[1], qty=row[2])
+                for row in rows
+            ], generation=generation)
+        else:
+            fetched = self._select_inventory(skus)
+            fetched_skus = {stock_position.sku for stock_position in fetched}
+            self._inventory_cache.store(fetched, [
+                sku for sku in skus if sku not in fetched_skus
+            ], generation)
+
+    def inventory_cache_stats(self) -> dict | None:
+        if self._inventory_cache is None:
+            return None
+        return self._inventory_cache.stats()
+
+    def get_inventory_at(self, skus: list[int],
+                         at: datetime | float) -> list[StockPosition]:
+        # Nearest snapshot before `at` (for each SKU, its line in the latest
+        # snapshot up to that one), plus the movements since then
+        if isinstance(at, datetime):
+            at = at.timestamp()
+        snapshot = self._cur.execute("""
+            SELECT id, last_movement_id FROM stock_snapshot
+            WHERE created_at <= ?
+            ORDER BY created_at DESC LIMIT 1
+            """, [at]).fetchone()
+        snapshot_id, last_movement_id = (
+            (None, 0) if snapshot is None else snapshot
+        )
+
+        qty_by_sku = dict()
+        skus = list(dict.fromkeys(skus))
+        for i in range(0, len(skus), SBB_DBAdmin.MAX_QUERY_PARAMS):
+            chunk = skus[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+            placeholders = ','.join(len(chunk)*['?'])
+            qty_by_sku.update(self._cur.execute(f"""
+                SELECT sku, qty FROM stock_snapshot_line AS line
+                WHERE sku IN ({placeholders})
+                AND snapshot_id = (
+                    SELECT MAX(snapshot_id) FROM stock_snapshot_line
+                    WHERE sku = line.sku AND snapshot_id <= ?
+                )
+                """, chunk + [snapshot_id]))
+            for sku, qty in self._cur.execute(f"""
+                SELECT sku, SUM(qty) FROM stock_movement
+                WHERE sku IN ({placeholders})
+                AND id > ? AND created_at <= ?
+                GROUP BY sku
+                """, chunk + [last_movement_id, at]).fetchall():
+                qty_by_sku[sku] = qty_by_sku.get(sku, 0) + qty
+
+        return [
+            StockPosition(sku=sku, qty=qty_by_sku[sku])
+            for sku in skus if sku in qty_by_sku
+        ]
+
+    def take_stock_snapshot(self) -> int:
+        # Only the SKUs moved since the previous snapshot: the cost depends
+        # on the activity in between, not on the size of the inventory
+        with self._write():
+            previous_movement_id = self._cur.execute("""
+                SELECT COALESCE(MAX(last_movement_id), 0) FROM stock_snapshot
+                """).fetchone()[0]
+            self._cur.execute("""
+                INSERT INTO stock_snapshot (created_at, last_movement_id)
+                SELECT ?, COALESCE(MAX(id), 0) FROM stock_movement;
+                """, [time.time()])
+            snapshot_id = self._cur.lastrowid
+            self._cur.execute("""
+                INSERT INTO stock_snapshot_line (snapshot_id, sku, qty)
+                SELECT ?, moved.sku, COALESCE(inventory.qty, 0)
+                FROM (SELECT DISTINCT sku FROM stock_movement
+                      WHERE id > ?) AS moved
+                LEFT JOIN inventory ON inventory.sku = moved.sku;
+                """, [snapshot_id, previous_movement_id])
+            return snapshot_id
+
+    def _decrement_inventory(self, qty_by_sku: dict[int, float]) -> None:
+        # Raises NotEnoughStock if a SKU lacks stock (or has no position).
+        # Stock reserved (by other orders) is not available, unless expired.
+        self._delete_expired_reservations()
+        items = list(qty_by_sku.items())
+        decremented = set()
+        chunk_size = SBB_DBAdmin.MAX_QUERY_PARAMS // 2
+        for i in range(0, len(items), chunk_size):
+            chunk = items[i:i + chunk_size]
+            decremented.update(row[0] for row in self._cur.execute(f"""
+                UPDATE inventory SET
+                    qty = inventory.qty - issued.column2
+                FROM (VALUES {','.join(len(chunk)*['(?, ?)'])}) AS issued
+                WHERE inventory.sku = issued.column1
+                AND inventory.qty - COALESCE(
+                    (SELECT reserved_qty FROM sku_aggregate
+                     WHERE sku_aggregate.sku = inventory.sku), 0
+                ) >= issued.column2
+                RETURNING inventory.sku;
+                """, [value for item in chunk for value in item]).fetchall())
+
+        if len(decremented) < len(items):
+            sku, qty = next(
+                (sku, qty) for sku, qty in items if sku not in decremented
+            )
+            raise NotEnoughStock(
+                sku, qty, self.get_available_to_promise([sku])[sku]
+            )
+
+    def _log_movements(self, movement_code: str,
+                       qty_change_by_sku: dict[int, float]) -> None:
+        # Called within the write that changed the inventory
+        now = time.time()
+        self._cur.executemany("""
+            INSERT INTO stock_movement (created_at, sku, qty, movement_code)
+            VALUES (?, ?, ?, ?);
+            """, [
+                [now, sku, qty, movement_code]
+                for sku, qty in qty_change_by_sku.items() if qty != 0
+            ])
+
+        if self._snapshot_interval is not None:
+            num_movements_since_snapshot = self._cur.execute("""
+                SELECT COALESCE(MAX(stock_movement.id), 0)
+                       - (SELECT last_movement_id FROM stock_snapshot
+                          ORDER BY id DESC LIMIT 1)
+                FROM stock_movement
+                """).fetchone()[0]
+            if num_movements_since_snapshot >= self._snapshot_interval:
+                self.take_stock_snapshot()
+
     ##############################
     ########## Configuration #####
     ##############################
 
+    def get_total_on_hand(self) -> float:
+        return self._cur.execute(
+            "SELECT on_hand FROM stock_total WHERE id = 1"
+        ).fetchone()[0]
+
+    def get_sku_aggregates(self, skus: list[int]) -> list[SkuAggregate]:
+        # In the sequence of the requested SKUs; zeros if nothing recorded
+        found = dict()
+        unique_skus = list(dict.fromkeys(skus))
+        for i in range(0, len(unique_skus), SBB_DBAdmin.MAX_QUERY_PARAMS):
+            chunk = unique_skus[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+            found.update(
+                (row[0], SkuAggregate(*row))
+                for row in self._cur.execute(f"""
+                    SELECT sku, on_hand, open_po_qty, open_so_qty
+                    FROM sku_aggregate
+                    WHERE sku IN ({','.join(len(chunk)*['?'])})
+                    """, chunk)
+            )
+        return [found.get(sku, SkuAggregate(sku=sku)) for sku in unique_skus]
+
+    def get_open_order_qty(self, entity_ids: list[int],
+                           order_type: str) -> dict[int, float]:
+        # Open (not yet delivered) qty of the entities' orders of the type
+        open_qty = dict.fromkeys(entity_ids, 0)
+        unique_ids = list(open_qty)
+        for i in range(0, len(unique_ids), SBB_DBAdmin.MAX_QUERY_PARAMS):
+            chunk = unique_ids[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+            open_qty.update(self._cur.execute(f"""
+                SELECT entity_id, open_qty FROM entity_aggregate
+                WHERE order_type = ?
+                AND entity_id IN ({','.join(len(chunk)*['?'])})
+                """, [order_type] + chunk))
+        return open_qty
+
+    def rebuild_aggregates(self) -> None:
+        # Repair: recomputes all aggregates from inventory and order lines
+        with self._write():
+            for statement in AGGREGATE_REBUILD + RESERVED_QTY_REBUILD:
+                self._cur.execute(statement)
+
+    def reserve_order_lines(self, order_lines: list[OrderLine],
+                            expires_at: float) -> int:
+        # Reserves the open qty of the lines; raises NotEnoughStock (and
+        # rolls back) if a SKU has less available to promise than that
+        reserved_by_sku = dict()
+        reservations = list()
+        for ol in order_lines:
+            qty = ol.qty_ordered - ol.qty_delivered
+            if qty > 0:
+                reservations.append(
+                    [ol.order_id, ol.position, ol.sku, qty, expires_at]
+                )
+                reserved_by_sku[ol.sku] = reserved_by_sku.get(ol.sku, 0) + qty
+
+        with self._write():
+            self._delete_expired_reservations()  # Their stock is available
+            self._cur.executemany("""
+                INSERT INTO reservation
+                (order_id, position, sku, qty, expires_at)
+                VALUES (?, ?, ?, ?, ?);
+                                  """,
+                                  reservations)
+            skus = list(reserved_by_sku)
+            for i in range(0, len(skus), SBB_DBAdmin.MAX_QUERY_PARAMS):
+                chunk = skus[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+                short = self._cur.execute(f"""
+                    SELECT sku, on_hand - reserved_qty FROM sku_aggregate
+                    WHERE sku IN ({','.join(len(chunk)*['?'])})
+                    AND on_hand - reserved_qty < 0
+                    LIMIT 1
+                    """, chunk).fetchone()
+                if short is not None:
+                    sku, qty_left = short
+                    raise NotEnoughStock(sku, reserved_by_sku[sku],
+                                         qty_left + reserved_by_sku[sku])
+            if reservations:
+                heapq.heappush(self._reservation_expiries, expires_at)
+            return len(reservations)
+
+    def consume_reservations(self,
+                             delivery: list[OrderLine] | OrderBatch) -> None:
+        # delivery: qty_delivered = qty shipped now, taken from reservations
+        if isinstance(delivery, OrderBatch):
+            line_qtys = list(zip(delivery.qty_delivered, delivery.order_id,
+                                 delivery.position))
+        else:
+            line_qtys = [
+                (ol.qty_delivered, ol.order_id, ol.position) for ol in delivery
+            ]
+        with self._write():
+            self._cur.executemany("""
+                UPDATE reservation SET qty = qty - ?
+                WHERE order_id = ? AND position = ?
+                                  """,
+                                  line_qtys)
+            self._cur.executemany("""
+                DELETE FROM reservation
+                WHERE order_id = ? AND position = ? AND qty <= 0
+                                  """,
+                                  [line_qty[1:] for line_qty in line_qtys])
+
+    def cancel_reservations(self, order_ids: list[int]) -> int:
+        num_released = 0
+        unique_ids = list(dict.fromkeys(order_ids))
+        with self._write():
+            for i in range(0, len(unique_ids), SBB_DBAdmin.MAX_QUERY_PARAMS):
+                chunk = unique_ids[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+                self._cur.execute(f"""
+                    DELETE FROM reservation
+                    WHERE order_id IN ({','.join(len(chunk)*['?'])})
+                    """, chunk)
+                num_released += self._cur.rowcount
+        return num_released
+
+    def release_expired_reservations(self, now: float = None) -> int:
+        # Only deletes when the heap says a reservation is due. The heap is
+        # refreshed from disk when empty, and every
+        # RESERVATION_REFRESH_INTERVAL seconds, to learn about reservations
+        # made by other instances.
+        if now is None:
+            now = time.time()
+        if ((not self._reservation_expiries)
+                or (now - self._expiries_refreshed_at
+                    >= SBB_DBAdmin.RESERVATION_REFRESH_INTERVAL)):
+            self._push_next_expiry()
+        if (not self._reservation_expiries
+                or self._reservation_expiries[0] > now):
+            return 0
+        return self._delete_expired_reservations(now)
+
+    def _delete_expired_reservations(self, now: float = None) -> int:
+        # Whatever the heap says: writes that depend on reservations call it
+        # directly. The expiry index limits the delete to expired rows.
+        if now is None:
+            now = time.time()
+        with self._write():
+            self._cur.execute(
+                "DELETE FROM reservation WHERE expires_at <= ?", [now]
+            )
+            num_released = self._cur.rowcount
+            while (self._reservation_expiries
+                   and self._reservation_expiries[0] <= now):
+                heapq.heappop(self._reservation_expiries)
+            self._push_next_expiry()
+            return num_released
+
+    def get_available_to_promise(self, skus: list[int]) -> dict[int, float]:
+        # On hand minus live reservations, from the aggregates (0 if unknown)
+        if not self._pool.read_only:
+            self.release_expired_reservations()
+        available = dict.fromkeys(skus, 0)
+        unique_skus = list(available)
+        for i in range(0, len(unique_skus), SBB_DBAdmin.MAX_QUERY_PARAMS):
+            chunk = unique_skus[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+            available.update(self._cur.execute(f"""
+                SELECT sku, on_hand - reserved_qty FROM sku_aggregate
+                WHERE sku IN ({','.join(len(chunk)*['?'])})
+                """, chunk))
+        return available
+
+    def get_reserved_qty(self,
+                         order_ids: list[int]) -> dict[int, dict[int, float]]:
+        # {order_id: {sku: qty reserved}}, for orders holding reservations
+        reserved = dict()
+        unique_ids = list(dict.fromkeys(order_ids))
+        for i in range(0, len(unique_ids), SBB_DBAdmin.MAX_QUERY_PARAMS):
+            chunk = unique_ids[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+            for order_id, sku, qty in self._cur.execute(f"""
+                SELECT order_id, sku, SUM(qty) FROM reservation
+                WHERE order_id IN ({','.join(len(chunk)*['?'])})
+                GROUP BY order_id, sku
+                """, chunk):
+                reserved.setdefault(order_id, dict())[sku] = qty
+        return reserved
+
     def add_external_entity(self, supplier_name: str, entity_type: str) -> int:
-        self._cur.execute("""
-                          INSERT INTO external_entity 
-                          (name, entity_type)
-                          VALUES (?, ?);
-                          """,
-                          [supplier_name, entity_type])
-        self._con.commit()
-        return self._cur.lastrowid
+        with self._write():
+            self._cur.execute("""
+                              INSERT INTO external_entity 
+                              (name, entity_type)
+                              VALUES (?, ?);
+                              """,
+                              [supplier_name, entity_type])
+            if self._known_entities is not None:
+                self._add_known_ids(entity_ids=[self._cur.lastrowid])
+            return self._cur.lastrowid
+
+    def add_external_entities(self, names: list[str],
+                              entity_type: str) -> list[int]:
+        with self._write():
+            first_id = self._next_id('external_entity', 'id')
+            entity_ids = list(range(first_id, first_id + len(names)))
+            self._cur.executemany("""
+                                  INSERT INTO external_entity
+                                  (id, name, entity_type)
+                                  VALUES (?, ?, ?);
+                                  """,
+                                  [
+                                      [entity_id, name, entity_type]
+                                      for entity_id, name
+                                      in zip(entity_ids, names)
+                                  ])
+            if self._known_entities is not None:
+                self._add_known_ids(entity_ids=entity_ids)
+            return entity_ids
 
     def add_sku(self, sku_desc: str) -> int:
-        self._cur.execute("""
-                          INSERT INTO product (desc)
-                          VALUES (?);
-                          """,
-                          [(sku_desc)])
-        self._con.commit()
-        return self._cur.lastrowid
+        with self._write():
+            self._cur.execute("""
+                              INSERT INTO product (desc)
+                              VALUES (?);
+                              """,
+                              [(sku_desc)])
+            if self._known_skus is not None:
+                self._add_known_ids(skus=[self._cur.lastrowid])
+            return self._cur.lastrowid
+
+    def add_skus(self, sku_descs: list[str]) -> list[int]:
+        with self._write():
+            first_sku = self._next_id('product', 'sku')
+            skus = list(range(first_sku, first_sku + len(sku_descs)))
+            self._cur.executemany("""
+                                  INSERT INTO product (sku, desc)
+                                  VALUES (?, ?);
+                                  """,
+                                  zip(skus, sku_descs))
+            if self._known_skus is not None:
+                self._add_known_ids(skus=skus)
+            return skus
+
+    def list_skus(self, desc_contains: str = None, after: int = None,
+                  limit: int = 100) -> Page:
+        # Page of products by ascending SKU, after SKU 'after'
+        conditions = list()
+        params = list()
+        if desc_contains is not None:
+            conditions.append('instr(desc, ?) > 0')
+            params.append(desc_contains)
+        rows, next_cursor = self._keyset_page(
+            "SELECT sku, desc FROM product", 'sku',
+            conditions, params, after, limit
+        )
+        return Page([Product(*row) for row in rows], next_cursor)
+
+    def list_entities(self, entity_type: str = None, after: int = None,
+                      limit: int = 100) -> Page:
+        # Page of suppliers and / or customers by ascending id
+        conditions = list()
+        params = list()
+        if entity_type is not None:
+            conditions.append('entity_type = ?')
+            params.append(entity_type)
+        rows, next_cursor = self._keyset_page(
+            "SELECT id, name, entity_type FROM external_entity", 'id',
+            conditions, params, after, limit
+        )
+        return Page([ExternalEntity(*row) for row in rows], next_cursor)
+
+    def iter_rows(self, kind: str, chunk_size: int = 1000) -> Iterator[tuple]:
+        # Streams a whole table (see EXPORT_QUERIES), chunk by chunk
+        if kind not in SBB_DBAdmin.EXPORT_QUERIES:
+            raise Exception(f'Unexpected kind of rows: {kind}')
+        cursor = self._con.cursor()  # Own cursor, as in iter_orders
+        cursor.execute(SBB_DBAdmin.EXPORT_QUERIES[kind])
+        try:
+            while rows := cursor.fetchmany(chunk_size):
+                yield from rows
+        finally:
+            cursor.close()
         
 
+    ##############################
+    ########## Transactions ######
+    ##############################
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        # Outermost level commits on exit; nested levels are savepoints.
+        # The write lock is held until the outermost level exits.
+        if self._pool.read_only:
+            raise ReadOnlyDatabase(self._db_name)
+        with self._pool.write_lock:
+            state = self._pool.state()
+            savepoint = f'sbb_{state.tx_depth}'
+            if state.tx_depth == 0:
+                if state.con.in_transaction:
+                    state.con.commit()
+                self._cur.execute("BEGIN IMMEDIATE;")
+            else:
+                self._cur.execute(f"SAVEPOINT {savepoint};")
+            state.tx_depth += 1
+            if self._known_skus is not None:
+                self._known_ids_added.append((set(), set()))
+
+            try:
+                yield
+            except BaseException:
+                state.tx_depth -= 1
+                if state.tx_depth == 0:
+                    state.con.rollback()
+                else:
+                    self._cur.execute(f"ROLLBACK TO {savepoint};")
+                    self._cur.execute(f"RELEASE {savepoint};")
+                self._reset_caches()
+                raise
+            else:
+                state.tx_depth -= 1
+                if self._known_skus is not None:
+                    # Ids of a released savepoint now belong to its parent
+                    added_skus, added_entities = self._known_ids_added.pop()
+                    if self._known_ids_added:
+                        self._known_ids_added[-1][0].update(added_skus)
+                        self._known_ids_added[-1][1].update(added_entities)
+                if state.tx_depth == 0:
+                    state.con.commit()
+                    if self._inventory_cache is not None:
+                        # Readers that selected before the commit saw the
+                        # previous levels
+                        self._inventory_cache.new_generation()
+                else:
+                    self._cur.execute(f"RELEASE {savepoint};")
+
+    @contextmanager
+    def read_snapshot(self) -> Iterator[None]:
+        # Reads inside all see the same committed state of the database
+        # (WAL), whatever is committed meanwhile by writers
+        state = self._pool.state()
+        if state.con.in_transaction:  # Already isolated
+            yield
+            return
+        self._cur.execute("BEGIN;")
+        try:
+            yield
+        finally:
+            state.con.commit()  # Nothing to write: ends the snapshot
+
+    @contextmanager
+    def _write(self) -> Iterator[None]:
+        # Write methods join the active unit of work, or commit on their own
+        with self._pool.write_lock:
+            if self._pool.state().tx_depth > 0:
+                yield
+            else:
+                with self.transaction():
+                    yield
+
+    def _reset_caches(self) -> None:
+        # Caches may hold rows that were rolled back
+        self._push_next_expiry()
+        if self._known_skus is not None:  # Only ids added at this level
+            added_skus, added_entities = self._known_ids_added.pop()
+            self._known_skus -= added_skus
+            self._known_entities -= added_entities
+        if self._inventory_cache is not None:
+            self._inventory_cache.clear()
+
+
     ##############################
     ########## Support ###########
     ##############################
 
     def is_entity(self, entity_id: int) -> bool:
-        checker = (
-            self
-            ._cur
-            .execute("SELECT name FROM external_entity WHERE id=?",
-                     [(entity_id)])
-            .fetchone()
-        )
-        if checker is None:
-            return False
-        elif len(checker) == 1:
-            return True
-        raise Exception((
-            f'Unexpected exception: ',
-            f'More than 1 external entity found for id: {entity_id}'
-            ))
+        return not self.missing_entities([entity_id])
     
     def is_sku(self, sku: int) -> bool:
-        checker = (
-            self
-            ._cur
-            .execute("SELECT desc FROM product WHERE sku=?", [sku])
-            .fetchone()
-        )
-        if checker is None:
-            return False
-        elif len(checker) == 1:
+        return not self.missing_skus([sku])
+
+    def missing_entities(self, entity_ids: list[int]) -> set[int]:
+        to_check = set(entity_ids)
+        if self._known_entities is not None:
+            to_check -= self._known_entities
+            if not to_check:
+                return to_check
+        found = self._existing_ids('external_entity', 'id', to_check)
+        if self._known_entities is not None:
+            self._add_known_ids(entity_ids=found)
+        return to_check - found
+
+    def missing_skus(self, skus: list[int]) -> set[int]:
+        to_check = set(skus)
+        if self._known_skus is not None:
+            to_check -= self._known_skus
+            if not to_check:
+                return to_check
+        found = self._existing_ids('product', 'sku', to_check)
+        if self._known_skus is not None:
+            self._add_known_ids(skus=found)
+        return to_check - found
+
+    def _existing_ids(self, table: str, id_column: str,
+                      ids: set[int]) -> set[int]:
+        ids = list(ids)
+        found = set()
+        for i in range(0, len(ids), SBB_DBAdmin.MAX_QUERY_PARAMS):
+            chunk = ids[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+            found.update(
+                row[0] for row in self._cur.execute(
+                    f"""
+                    SELECT {id_column} FROM {table}
+                    WHERE {id_column} IN ({','.join(len(chunk)*['?'])})
+                    """, chunk)
+            )
+        return found
+
+    def _select_orders(self, query: str,
+                       order_ids: list[int]) -> dict[int, Order]:
+        # query: ORDER_QUERY or ARCHIVE_ORDER_QUERY
+        orders_found = dict()
+        for i in range(0, len(order_ids), SBB_DBAdmin.MAX_QUERY_PARAMS):
+            chunk = order_ids[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+            rows = self._cur.execute(f"""
+                {query}
+                WHERE orders.id IN ({','.join(len(chunk)*['?'])})
+                ORDER BY orders.id, ol.position
+                                     """, chunk)
+            orders_found.update(
+                (the_order.id, the_order)
+                for the_order in SBB_DBAdmin._group_order_rows(rows)
+            )
+        return orders_found
+
+    def _copy_to_archive(self, order_ids: list[int]) -> None:
+        # Within the caller's transaction. Lines copied before are replaced.
+        id_list = f"({','.join(len(order_ids)*['?'])})"
+        self._cur.execute(f"""
+            INSERT OR REPLACE INTO archive.orders
+            (id, order_type, entity_id, created_at, archived_at)
+            SELECT id, order_type, entity_id, created_at, ?
+            FROM main.orders WHERE id IN {id_list}
+            """, [time.time()] + order_ids)
+        self._cur.execute(f"DELETE FROM archive.order_line "
+                          f"WHERE order_id IN {id_list}", order_ids)
+        self._cur.execute(f"""
+            INSERT INTO archive.order_line
+            (id, order_id, position, sku, qty_ordered, qty_delivered)
+            SELECT id, order_id, position, sku, qty_ordered, qty_delivered
+            FROM main.order_line WHERE order_id IN {id_list}
+            """, order_ids)
+
+    def _delete_archived(self, order_ids: list[int]) -> int:
+        # Deletes from main the orders whose archived copy is identical (an
+        # order changed since its copy stays, to be archived again later).
+        # Returns the number of orders deleted.
+        with self.transaction():
+            id_list = f"({','.join(len(order_ids)*['?'])})"
+            archived_ids = [row[0] for row in self._cur.execute(f"""
+                SELECT orders.id FROM main.orders
+                WHERE orders.id IN {id_list}
+                AND EXISTS (SELECT 1 FROM archive.orders AS archived
+                            WHERE archived.id = orders.id)
+                AND NOT EXISTS (
+                    SELECT id, position, sku, qty_ordered, qty_delivered
+                    FROM main.order_line WHERE order_id = orders.id
+                    EXCEPT
+                    SELECT id, position, sku, qty_ordered, qty_delivered
+                    FROM archive.order_line WHERE order_id = orders.id
+                )
+                """, order_ids)]
+            if not archived_ids:
+                return 0
+            id_list = f"({','.join(len(archived_ids)*['?'])})"
+            self._cur.execute(f"DELETE FROM main.order_line "
+                              f"WHERE order_id IN {id_list}", archived_ids)
+            self._cur.execute(f"DELETE FROM main.orders "
+                              f"WHERE id IN {id_list}", archived_ids)
+            return len(archived_ids)
+
+    def _attach_archive(self, create: bool = False) -> bool:
+        # Attaches the archive to the calling thread's connection, if it
+        # exists (or create). Returns whether the archive is attached.
+        # ATTACH is impossible within a transaction: only a connection that
+        # was already open when the archive got created can miss it there.
+        con = self._pool.connection()
+        if con in self._archive_connections:
             return True
-        raise Exception(f'Unexpected exception: More than 1 sku for: {sku}')
+        if con.in_transaction:
+            return False
+        if not (create or (self._archive_path != ':memory:'
+                           and Path(self._archive_path).is_file())):
+            return False
+        self._attach_archive_to(con)
+        return True
+
+    def _attach_existing_archive(self, con: sqlite3.Connection) -> None:
+        # Connect hook: an archive file is attached to each new connection
+        if ((con not in self._archive_connections)
+                and not con.in_transaction
+                and (self._archive_path != ':memory:')
+                and Path(self._archive_path).is_file()):
+            self._attach_archive_to(con)
+
+    def _attach_archive_to(self, con: sqlite3.Connection) -> None:
+        archive_uri = self._archive_path
+        if self._pool.read_only:
+            archive_uri = f'file:{self._archive_path}?mode=ro'
+        con.execute("ATTACH DATABASE ? AS archive;", [archive_uri])
+        if not self._pool.read_only:
+            if archive_uri != ':memory:':
+                con.execute("PRAGMA archive.journal_mode=WAL;")
+            for statement in ARCHIVE_SETUP:
+                con.execute(statement)
+            con.commit()
+        self._archive_connections.add(con)
+
+    def _select_inventory(self, skus: list[int]) -> list[StockPosition]:
+        skus = list(skus)
+        positions = list()
+        for i in range(0, len(skus), SBB_DBAdmin.MAX_QUERY_PARAMS):
+            chunk = skus[i:i + SBB_DBAdmin.MAX_QUERY_PARAMS]
+            positions.extend(
+                StockPosition(position=row[0], sku=row[1], qty=row[2])
+                for row in self._cur.execute(f"""
+                    SELECT position_id, sku, qty FROM inventory
+                    WHERE sku IN ({','.join(len(chunk)*['?'])})
+                    """, chunk)
+            )
+        return positions
+
+    def _add_known_ids(self, skus: Iterable[int] = (),
+                       entity_ids: Iterable[int] = ()) -> None:
+        # Ids seen inside a transaction are forgotten if it rolls back
+        self._known_skus.update(skus)
+        self._known_entities.update(entity_ids)
+        if self._pool.state().tx_depth > 0 and self._known_ids_added:
+            self._known_ids_added[-1][0].update(skus)
+            self._known_ids_added[-1][1].update(entity_ids)
+
+    def _load_existence_cache(self) -> None:
+        self._known_skus = {
+            row[0] for row in self._cur.execute("SELECT sku FROM product")
+        }
+        self._known_entities = {
+            row[0] for row in self._cur.execute("SELECT id FROM external_entity")
+        }
+
+    def _push_next_expiry(self) -> None:
+        # Earliest expiry on disk (index lookup), e.g. reservations restored
+        # by a rollback or made by another instance since the last refresh
+        self._expiries_refreshed_at = time.time()
+        next_expiry = self._cur.execute(
+            "SELECT MIN(expires_at) FROM reservation"
+        ).fetchone()[0]
+        if next_expiry is not None:
+            heapq.heappush(self._reservation_expiries, next_expiry)
+
+    @staticmethod
+    def _group_order_rows(rows: Iterable[tuple]) -> Iterator[Order]:
+        # Rows (see ORDER_QUERY) must be sorted by order id
+        the_order = None
+        for row in rows:
+            if (the_order is None) or (the_order.id != row[0]):
+                if the_order is not None:
+                    yield the_order
+                the_order = Order(id=row[0], order_type=row[1],
+                                  entity_id=row[2])
+            if row[3] is not None:  # Order without lines
+                the_order.lines.append(OrderLine(
+                    position=row[3], sku=row[4],
+                    qty_ordered=row[5], qty_delivered=row[6]
+                ))
+        if the_order is not None:
+            yield the_order
+
+    def _keyset_page(self, select: str, key: str, conditions: list[str],
+                     params: list, after: int | None,
+                     limit: int) -> tuple[list[tuple], int | None]:
+        # Rows with key > after, by ascending key (the 1st column selected).
+        # Seeks through the key's index: a deep page costs the same as the
+        # first one, unlike OFFSET. One extra row tells if a next page exists.
+        if after is not None:
+            conditions = conditions + [f'{key} > ?']
+            params = params + [after]
+        where_clause = (
+            ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        )
+        rows = self._cur.execute(f"""
+            {select}
+            {where_clause}
+            ORDER BY {key}
+            LIMIT ?
+            """, params + [limit + 1]).fetchall()
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1][0]
+        return rows, None
+
+    def _next_id(self, table: str, id_column: str) -> int:
+        # Lets bulk inserts know their ids upfront (executemany has no lastrowid)
+        last_id = (
+            self._cur
+            .execute(f"SELECT MAX({id_column}) FROM {table}")
+            .fetchone()[0]
+        )
+        return 1 if last_id is None else last_id + 1
     
+    ##############################
+    ########## Instrumentation ###
+    ##############################
+
+    def enable_instrumentation(
+            self, instrumentation: SBB_Instrumentation = None
+            ) -> SBB_Instrumentation:
+        # Public methods are wrapped on this instance only
+        if self._instrumentation is not None:
+            return self._instrumentation
+        if instrumentation is None:
+            instrumentation = SBB_Instrumentation()
+        self._pool.add_connect_hook(instrumentation.attach)
+        for name, method in vars(SBB_DBAdmin).items():
+            if (callable(method) and not name.startswith('_')
+                    and name not in SBB_DBAdmin.NOT_INSTRUMENTED):
+                setattr(self, name, instrumentation.wrap(
+                    name, getattr(self, name), self._pool.connection
+                ))
+        self._instrumentation = instrumentation
+        return instrumentation
+
+    def disable_instrumentation(self) -> None:
+        if self._instrumentation is None:
+            return
+        self._pool.remove_connect_hook(self._instrumentation.attach,
+                                       self._instrumentation.detach)
+        for name, method in vars(SBB_DBAdmin).items():
+            if (callable(method) and not name.startswith('_')
+                    and name not in SBB_DBAdmin.NOT_INSTRUMENTED):
+                delattr(self, name)
+        self._instrumentation = None
+
+
     ##############################
     ########## Setup #############
     ##############################
 
+    @property
+    def _con(self) -> sqlite3.Connection:
+        return self._pool.connection()
+
+    @property
+    def _cur(self) -> sqlite3.Cursor:
+        return self._pool.cursor()
+
     def close_connection(self) -> None:
-        self._con.close()
+        self._pool.close_all()
 
     def is_db_setup(self) -> bool:
         res = self._cur.execute("SELECT name FROM sqlite_master").fetchall()
@@ -261,7 +1786,7 @@ class SBB_DBAdmin():
         return all([
             expected_table in list_tables
             for expected_table in SBB_DBAdmin.DB_TABLES
-            ])
+            ]) and self.get_schema_version() == SCHEMA_VERSION
     
     def setup_db(self) -> None:
         # Orders
@@ -310,4 +1835,48 @@ class SBB_DBAdmin():
                               entity_type TEXT NOT NULL
                           );
                           """)
-        
+
+        # Schema version (tables above are version 1)
+        self._cur.execute("""
+                          CREATE TABLE IF NOT EXISTS schema_version (
+                              version INTEGER NOT NULL
+                          );
+                          """)
+        num_versions = (
+            self._cur
+            .execute("SELECT COUNT(*) FROM schema_version")
+            .fetchone()[0]
+        )
+        if num_versions == 0:
+            self._cur.execute("INSERT INTO schema_version (version) VALUES (1);")
+            self._con.commit()
+
+        self.migrate_db()
+
+    def get_schema_version(self) -> int:
+        try:
+            version = (
+                self._cur
+                .execute("SELECT MAX(version) FROM schema_version")
+                .fetchone()[0]
+            )
+        except sqlite3.OperationalError:  # Created before schema versioning
+            return 0
+        return 0 if version is None else version
+
+    def migrate_db(self) -> None:
+        current_version = self.get_schema_version()
+        for version, statements in SCHEMA_MIGRATIONS:
+            if version <= current_version:
+                continue
+            # Each migration is applied atomically, together with its version
+            self._cur.execute("BEGIN;")
+            try:
+                for statement in statements:
+                    self._cur.execute(statement)
+                self._cur.execute("UPDATE schema_version SET version = ?;",
+                                  [version])
+            except sqlite3.Error:
+                self._con.rollback()
+                raise
+            self._con.commit()
@@ -0,0 +1,110 @@
+""" db_pool.py
+Connections to the database, shared between threads.
+Each thread gets its own connection (WAL journaling, so readers run
+concurrently with the writer); writes are serialized with write_lock.
+An in-memory database cannot be opened twice: its single connection is
+shared by all threads, which then see each other's uncommitted changes.
+A read-only pool opens file databases with mode=ro URIs: its connections
+never take the write lock of the database, so they never hold up writers.
+
+Class SBB_ConnectionPool - methods:
+    connection
+    cursor
+    state
+    add_connect_hook
+    remove_connect_hook
+    close_all
+    _connect
+"""
+
+import sqlite3
+import threading
+from collections.abc import Callable
+from types import SimpleNamespace
+
+
+class SBB_ConnectionPool():
+    BUSY_TIMEOUT = 5.0  # Seconds to wait for a lock held by another process
+
+    def __init__(self, db_path: str,
+                 busy_timeout: float = BUSY_TIMEOUT,
+                 read_only: bool = False) -> None:
+        self._db_path = db_path
+        self._busy_timeout = busy_timeout
+        self.read_only = read_only
+        self._connections = list()
+        self._connections_lock = threading.Lock()
+        self._connect_hooks = list()
+        self.write_lock = threading.RLock()
+        self.is_shared = db_path == ':memory:'
+        if read_only and self.is_shared:
+            raise ValueError('An in-memory database cannot be read-only')
+
+        self._thread_local = threading.local()
+        if self.is_shared:
+            self._shared_state = SimpleNamespace(con=self._connect(),
+                                                 tx_depth=0)
+
+    def connection(self) -> sqlite3.Connection:
+        return self.state().con
+
+    def cursor(self) -> sqlite3.Cursor:
+        # Cursors are never shared between threads
+        cur = getattr(self._thread_local, 'cur', None)
+        if cur is None:
+            cur = self.connection().cursor()
+            self._thread_local.cur = cur
+        return cur
+
+    def state(self) -> SimpleNamespace:
+        # Connection of the calling thread, with its transaction depth
+        if self.is_shared:
+            return self._shared_state
+        state = getattr(self._thread_local, 'state', None)
+        if state is None:
+            state = SimpleNamespace(con=self._connect(), tx_depth=0)
+            self._thread_local.state = state
+        return state
+
+    def add_connect_hook(self,
+                         hook: Callable[[sqlite3.Connection], None]) -> None:
+        # Applied to open connections, then to each new connection
+        with self._connections_lock:
+            self._connect_hooks.append(hook)
+            for con in self._connections:
+                hook(con)
+
+    def remove_connect_hook(self, hook: Callable[[sqlite3.Connection], None],
+                            undo: Callable[[sqlite3.Connection], None] = None
+                            ) -> None:
+        with self._connections_lock:
+            self._connect_hooks.remove(hook)
+            if undo is not None:
+                for con in self._connections:
+                    undo(con)
+
+    def close_all(self) -> None:
+        with self._connections_lock:
+            for con in self._connections:
+                con.close()
+            self._connections.clear()
+        self._thread_local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Thread affinity is guaranteed by the pool, not by sqlite3
+        if self.read_only:
+            # Journal mode is set by the writers (WAL)
+            con = sqlite3.connect(f'file:{self._db_path}?mode=ro', uri=True,
+                                  timeout=self._busy_timeout,
+                                  check_same_thread=False)
+            con.execute("PRAGMA query_only=ON;")
+        else:
+            con = sqlite3.connect(self._db_path, timeout=self._busy_timeout,
+                                  check_same_thread=False)
+            if not self.is_shared:
+                con.execute("PRAGMA journal_mode=WAL;")
+        with self._connections_lock:
+            self._connections.append(con)
+            for hook in self._connect_hooks:
+                hook(con)
+        return con
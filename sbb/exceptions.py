@@ -27,6 +27,18 @@ class SKUDoesntExist(SBB_Exception):
         msg = f'Requested SKU doesn\'t exist: {sku}'
         super().__init__(msg, *args, **kwargs)
 
+class OrderDoesntExist(SBB_Exception):
+    """Requested order doesn't exist."""
+    def __init__(self, order_id: int, *args, **kwargs):
+        msg = f'Requested order doesn\'t exist: {order_id}'
+        super().__init__(msg, *args, **kwargs)
+
+class ReadOnlyDatabase(SBB_Exception):
+    """Write requested on a read-only database access."""
+    def __init__(self, db_name: str, *args, **kwargs):
+        msg = f'Database opened read-only: {db_name}'
+        super().__init__(msg, *args, **kwargs)
+
 class OrderQtyIncorrect(SBB_Exception):
     """Order lines incorrect."""
     def __init__(self, order_type: str, order_lines: int, *args, **kwargs):
@@ -39,9 +51,18 @@ class WrongOrderType(SBB_Exception):
         msg = f'Expected order type {expected_order_type} but received order type {actual_order_type}'
         super().__init__(msg, *args, **kwargs)
 
-class NotEnoughStockToFullfillOrder(SBB_Exception):
+class NotEnoughStock(SBB_Exception):
+    """Not enough stock to issue the quantity requested."""
+    def __init__(self, sku: int, qty_required: int, qty_avail, *args, **kwargs):
+        self.sku, self.qty_required, self.qty_avail = sku, qty_required, qty_avail
+        msg = f'Unable to issue {sku=}: Required {qty_required=} but {qty_avail=}'
+        super().__init__(msg, *args, **kwargs)
+
+class NotEnoughStockToFullfillOrder(NotEnoughStock):
     """Not enough stock to fullfill sale order."""
     def __init__(self, order_id: int, sku: int, qty_required: int, qty_avail, *args, **kwargs):
+        self.order_id = order_id
+        self.sku, self.qty_required, self.qty_avail = sku, qty_required, qty_avail
         msg = f'Unable to fullfill sale {order_id=}, {sku=}: Required {qty_required=} but {qty_avail=}'
-        super().__init__(msg, *args, **kwargs)
+        SBB_Exception.__init__(self, msg, *args, **kwargs)
 
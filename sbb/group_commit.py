@@ -0,0 +1,172 @@
+""" group_commit.py
+Group commit of writes, for high rates of small commands (e.g. make_SO).
+Callers submit commands from any thread and get a future. A single writer
+thread applies the commands queued in one transaction (each command in its
+own savepoint, so that one failure doesn't affect others), and commits
+every max_batch commands or max_delay_ms after the first command of the
+batch, whichever comes first. Futures are resolved once the batch is
+committed: a few ms of latency buy one commit per batch instead of one
+per command.
+
+Usage:
+    with GroupCommitWriter(sbb) as writer:
+        futures = [writer.make_SO(customer_id, lines) for lines in orders]
+        so_ids = [future.result() for future in futures]
+
+Class GroupCommitWriter - methods:
+    submit
+    make_PO
+    make_SO
+    make_POs
+    make_SOs
+    receive_PO
+    issue_SO
+    close
+    _run
+    _next_batch
+Functions:
+    apply_commands
+"""
+
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import Any
+
+from sbb.exceptions import SBB_Exception
+from sbb.sbb import StockBackbone
+from sbb.sbb_objects import OrderLine
+
+
+class GroupCommitWriter():
+    MAX_BATCH = 100  # Commands per commit
+    MAX_DELAY_MS = 5.0  # Wait for more commands after the first of a batch
+
+    def __init__(self, sbb: StockBackbone, max_batch: int = MAX_BATCH,
+                 max_delay_ms: float = MAX_DELAY_MS) -> None:
+        if max_batch < 1 or max_delay_ms < 0:
+            raise SBB_Exception('Batches need max_batch >= 1, max_delay_ms >= 0')
+        self._sbb = sbb
+        self._max_batch = max_batch
+        self._max_delay = max_delay_ms / 1000
+        self._commands = queue.SimpleQueue()
+        self._closed = False
+        self._submit_lock = threading.Lock()  # No command queued after close
+        self._writer = threading.Thread(target=self._run,
+                                        name='sbb-group-commit', daemon=True)
+        self._writer.start()
+
+    def __enter__(self) -> 'GroupCommitWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+    ##############################
+    ########## Regular use #######
+    ##############################
+
+    def submit(self, method: Callable, *args) -> Future:
+        # method: a write method of the StockBackbone, called with args
+        result = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise SBB_Exception('Group commit writer closed')
+            self._commands.put((method, args, result))
+        return result
+
+    def make_PO(self, supplier_id: int, PO_lines: list[OrderLine]) -> Future:
+        return self.submit(self._sbb.make_PO, supplier_id, PO_lines)
+
+    def make_SO(self, customer_id: int, SO_lines: list[OrderLine]) -> Future:
+        return self.submit(self._sbb.make_SO, customer_id, SO_lines)
+
+    def make_POs(self, POs: list[tuple[int, list[OrderLine]]]) -> Future:
+        return self.submit(self._sbb.make_POs, POs)
+
+    def make_SOs(self, SOs: list[tuple[int, list[OrderLine]]]) -> Future:
+        return self.submit(self._sbb.make_SOs, SOs)
+
+    def receive_PO(self, mode: str, order_id: int,
+                   delivered_qtys: dict[int, float] = None) -> Future:
+        return self.submit(self._sbb.receive_PO, mode, order_id,
+                           delivered_qtys)
+
+    def issue_SO(self, mode: str, order_id: int,
+                 shipped_qtys: dict[int, float] = None) -> Future:
+        return self.submit(self._sbb.issue_SO, mode, order_id, shipped_qtys)
+
+    def close(self) -> None:
+        # Commands already submitted are applied before the writer stops
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._commands.put(None)
+        self._writer.join()
+
+
+    ##############################
+    ########## Writer thread #####
+    ##############################
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            batch = [
+                command for command in batch
+                if command[2].set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+
+            try:
+                outcomes = apply_commands(
+                    self._sbb, [(method, args) for method, args, _ in batch]
+                )
+            except Exception as error:  # Batch couldn't be committed
+                outcomes = [(None, error)] * len(batch)
+
+            for (_, _, result), (value, error) in zip(batch, outcomes):
+                if error is None:
+                    result.set_result(value)
+                else:
+                    result.set_exception(error)
+
+    def _next_batch(self) -> tuple[list[tuple], bool]:
+        # Blocks for the first command, then collects more until the batch
+        # is full or its delay is over. Returns the batch + whether to stop.
+        batch = list()
+        command = self._commands.get()
+        deadline = time.monotonic() + self._max_delay
+        while command is not None:
+            batch.append(command)
+            if len(batch) == self._max_batch:
+                return batch, False
+            try:
+                command = self._commands.get(
+                    timeout=max(deadline - time.monotonic(), 0)
+                )
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+
+def apply_commands(sbb: StockBackbone,
+                   commands: list[tuple[Callable, tuple]]
+                   ) -> list[tuple[Any, Exception]]:
+    # One commit for all (method, args) commands; each one in a savepoint.
+    # Returns (value, None) or (None, error) per command.
+    outcomes = list()
+    with sbb.transaction():
+        for method, args in commands:
+            try:
+                with sbb.transaction():
+                    outcomes.append((method(*args), None))
+            except Exception as error:
+                outcomes.append((None, error))
+    return outcomes
@@ -0,0 +1,158 @@
+""" instrumentation.py
+Opt-in measures of SBB_DBAdmin methods: calls, SQL statements executed,
+rows changed, SQLite VM work and wall time (with latency histograms).
+Counts are inclusive: a statement run by a nested call is counted for
+every instrumented method active in the calling thread.
+Nothing is measured, and no overhead is added, until it is attached with
+SBB_DBAdmin.enable_instrumentation.
+
+Class SBB_Instrumentation - methods:
+    attach
+    detach
+    wrap
+    snapshot
+    to_prometheus
+    reset
+    _on_statement
+    _on_progress
+    _record
+"""
+
+import functools
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+
+
+class SBB_Instrumentation():
+    LATENCY_BUCKETS = (  # Seconds
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+        0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+    )
+    PROGRESS_STEP = 1000  # VM instructions between 2 progress callbacks
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._active = threading.local()  # Methods running, per thread
+        self.reset()
+
+    def attach(self, con: sqlite3.Connection) -> None:
+        con.set_trace_callback(self._on_statement)
+        con.set_progress_handler(self._on_progress,
+                                 SBB_Instrumentation.PROGRESS_STEP)
+
+    def detach(self, con: sqlite3.Connection) -> None:
+        con.set_trace_callback(None)
+        con.set_progress_handler(None, SBB_Instrumentation.PROGRESS_STEP)
+
+    def wrap(self, name: str, method: Callable,
+             connection: Callable[[], sqlite3.Connection]) -> Callable:
+        @functools.wraps(method)
+        def instrumented(*args, **kwargs):
+            active = getattr(self._active, 'calls', None)
+            if active is None:
+                active = self._active.calls = list()
+            counters = {'queries': 0, 'vm_steps': 0}
+            active.append(counters)
+            con = connection()
+            changes_before = con.total_changes
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                active.pop()
+                self._record(name, duration, counters,
+                             con.total_changes - changes_before)
+        return instrumented
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    'calls': stats['calls'],
+                    'queries': stats['queries'],
+                    'rows_changed': stats['rows_changed'],
+                    'vm_instructions': (stats['vm_steps']
+                                        * SBB_Instrumentation.PROGRESS_STEP),
+                    'seconds': stats['seconds'],
+                    'latency_buckets': dict(zip(
+                        SBB_Instrumentation.LATENCY_BUCKETS + (float('inf'),),
+                        stats['buckets']
+                    )),
+                }
+                for name, stats in self._stats.items()
+            }
+
+    def to_prometheus(self) -> str:
+        stats = self.snapshot()
+        lines = list()
+        counters = [
+            ('calls', 'sbb_db_calls_total', 'Calls per SBB_DBAdmin method.'),
+            ('queries', 'sbb_db_queries_total',
+             'SQL statements executed per SBB_DBAdmin method.'),
+            ('rows_changed', 'sbb_db_rows_changed_total',
+             'Rows inserted, updated or deleted per SBB_DBAdmin method.'),
+            ('vm_instructions', 'sbb_db_vm_instructions_total',
+             'Approximate SQLite VM instructions per SBB_DBAdmin method.'),
+        ]
+        for key, metric, description in counters:
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} counter')
+            lines.extend(
+                f'{metric}{{method="{name}"}} {method_stats[key]}'
+                for name, method_stats in stats.items()
+            )
+
+        metric = 'sbb_db_latency_seconds'
+        lines.append(f'# HELP {metric} Wall time per SBB_DBAdmin method.')
+        lines.append(f'# TYPE {metric} histogram')
+        for name, method_stats in stats.items():
+            cumulative = 0
+            for bound, count in method_stats['latency_buckets'].items():
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(
+                    f'{metric}_bucket{{method="{name}",le="{le}"}} {cumulative}'
+                )
+            lines.append(
+                f'{metric}_sum{{method="{name}"}} {method_stats["seconds"]}'
+            )
+            lines.append(
+                f'{metric}_count{{method="{name}"}} {method_stats["calls"]}'
+            )
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = dict()
+
+    def _on_statement(self, statement: str) -> None:
+        for counters in getattr(self._active, 'calls', ()):
+            counters['queries'] += 1
+
+    def _on_progress(self) -> int:
+        for counters in getattr(self._active, 'calls', ()):
+            counters['vm_steps'] += 1
+        return 0  # Never interrupt the statement
+
+    def _record(self, name: str, duration: float, counters: dict,
+                rows_changed: int) -> None:
+        bucket = next(
+            (i for i, bound in enumerate(SBB_Instrumentation.LATENCY_BUCKETS)
+             if duration <= bound),
+            len(SBB_Instrumentation.LATENCY_BUCKETS)
+        )
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                'calls': 0, 'queries': 0, 'rows_changed': 0, 'vm_steps': 0,
+                'seconds': 0.0,
+                'buckets': [0] * (len(SBB_Instrumentation.LATENCY_BUCKETS) + 1),
+            })
+            stats['calls'] += 1
+            stats['queries'] += counters['queries']
+            stats['rows_changed'] += rows_changed
+            stats['vm_steps'] += counters['vm_steps']
+            stats['seconds'] += duration
+            stats['buckets'][bucket] += 1
@@ -0,0 +1,139 @@
+""" inventory_cache.py
+In-memory map SKU -> (inventory position, qty), bounded by LRU eviction.
+Kept current write-through by SBB_DBAdmin, and cleared on rollback.
+Every write (and every commit) starts a new generation: rows read from the
+database under an older generation may predate the write, and aren't stored.
+
+Class SBB_InventoryCache - methods:
+    lookup
+    generation
+    new_generation
+    store
+    update_position
+    add_qty
+    invalidate
+    clear
+    stats
+    _forget
+    _evict
+"""
+
+import threading
+from collections import OrderedDict
+
+from sbb.sbb_objects import StockPosition
+
+
+class SBB_InventoryCache():
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        # sku -> (position, qty), or None if the SKU has no inventory position
+        self._entries = OrderedDict()
+        self._sku_by_position = dict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, skus: list[int]) -> tuple[dict, list[int]]:
+        # Returns {sku: StockPosition | None} for cached SKUs + missing SKUs
+        found = dict()
+        missing = list()
+        with self._lock:
+            for sku in skus:
+                if sku in self._entries:
+                    self._entries.move_to_end(sku)
+                    entry = self._entries[sku]
+                    found[sku] = None if entry is None else StockPosition(
+                        position=entry[0], sku=sku, qty=entry[1]
+                    )
+                    self.hits += 1
+                else:
+                    missing.append(sku)
+                    self.misses += 1
+        return found, missing
+
+    def generation(self) -> int:
+        # To be read before selecting the rows passed to store()
+        with self._lock:
+            return self._generation
+
+    def new_generation(self) -> None:
+        with self._lock:
+            self._generation += 1
+
+    def store(self, positions: list[StockPosition],
+              skus_without_position: list[int] = (),
+              generation: int = None) -> bool:
+        # Returns False (nothing stored) if the rows were read before a write
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            for stock_position in positions:
+                self._forget(stock_position.sku)
+                self._entries[stock_position.sku] = (stock_position.position,
+                                                     stock_position.qty)
+                self._entries.move_to_end(stock_position.sku)
+                self._sku_by_position[stock_position.position] = (
+                    stock_position.sku
+                )
+            for sku in skus_without_position:
+                self._forget(sku)
+                self._entries[sku] = None
+                self._entries.move_to_end(sku)
+            self._evict()
+        return True
+
+    def update_position(self, position: int, qty: int) -> None:
+        with self._lock:
+            self._generation += 1
+            sku = self._sku_by_position.get(position)
+            if sku is not None:
+                self._entries[sku] = (position, qty)
+
+    def add_qty(self, qty_by_sku: dict[int, int]) -> None:
+        with self._lock:
+            self._generation += 1
+            for sku, qty in qty_by_sku.items():
+                entry = self._entries.get(sku)
+                if entry is not None:
+                    self._entries[sku] = (entry[0], entry[1] + qty)
+                else:  # Position possibly created, with an unknown id
+                    self._forget(sku)
+
+    def invalidate(self, skus: list[int]) -> None:
+        with self._lock:
+            self._generation += 1
+            for sku in skus:
+                self._forget(sku)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._sku_by_position.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _forget(self, sku: int) -> None:
+        entry = self._entries.pop(sku, None)
+        if entry is not None:
+            del self._sku_by_position[entry[0]]
+
+    def _evict(self) -> None:
+        # Least recently used entries go first
+        while len(self._entries) > self.max_size:
+            _, entry = self._entries.popitem(last=False)
+            if entry is not None:
+                del self._sku_by_position[entry[0]]
+            self.evictions += 1
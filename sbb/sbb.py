@@ -4,39 +4,114 @@ Interface to user.
 Class StockBackbone - methods:
     make_PO
     make_SO
+    make_POs
+    make_SOs
+    create_orders
     _make_order
+    _make_orders
+    _validate_order
+    _delivery_lines
     get_order
+    get_orders
+    iter_orders
+    iter_rows
+    list_orders
+    list_order_lines
+    list_skus
+    list_inventory
+    list_entities
+    _check_page_size
+    get_inventory_level
+    set_inventory_levels
     receive_PO
+    issue_SO
+    issue_SOs
+    availability_report
+    get_inventory_at
+    take_stock_snapshot
+    get_total_on_hand
+    get_sku_aggregates
+    get_open_order_qty
+    rebuild_aggregates
+    get_available_to_promise
+    release_expired_reservations
+    cancel_reservations
+    archive_orders
 
     create_supplier
     create customer
     create_sku
+    create_suppliers
+    create_customers
+    create_skus
+    _create_in_bulk
+
+    transaction
+    read_snapshot
+    reporting
+    close
+
+    enable_instrumentation
+    disable_instrumentation
 
     is_entity
     is_sku
+    missing_entities
+    missing_skus
     validate_text_input
 """
 
-import string
+import math
+import re
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import AbstractContextManager
+from datetime import datetime
 
-from sbb import db_admin
+from sbb import allocation, db_admin
 from sbb.exceptions import (
     SBB_Exception, UserInputInvalid,
-    EntityDoesntExist, SKUDoesntExist,
+    EntityDoesntExist, SKUDoesntExist, OrderDoesntExist,
     OrderQtyIncorrect, WrongOrderType,
-    NotEnoughStockToFullfillOrder
+    NotEnoughStock, NotEnoughStockToFullfillOrder
+)
+from sbb.instrumentation import SBB_Instrumentation
+from sbb.sbb_objects import (
+    Order, OrderLine, StockPosition, StockChange, WaveResult,
+    OrderBatch, InventoryFrame, BulkCreateResult, SkuAggregate, Page
 )
-from sbb.sbb_objects import Order, OrderLine, StockPosition, StockChange
 
 
 class StockBackbone():
+    TEXT_INPUT_PATTERNS = {  # Compiled once, used by validate_text_input
+        'db name': re.compile(r'[_A-Za-z0-9]{1,30}'),
+        'sku desc': re.compile(r'[ \-_.,()\[\]A-Za-z0-9]{1,50}'),
+        'external entity name': re.compile(r'[ \-_.,()\[\]A-Za-z0-9]{1,50}'),
+    }
+    MAX_PAGE_SIZE = 1000  # Rows per page of list_* methods
 
-    def __init__(self, db_name: str) -> None:
+    def __init__(self, db_name: str, cache_existence: bool = False,
+                 inventory_cache_size: int = 0,
+                 read_only: bool = False) -> None:
         if db_name == ':memory:':
             pass
         elif not StockBackbone.validate_text_input(db_name, 'db name'):
             raise UserInputInvalid('Database name', db_name)
-        self._db = db_admin.SBB_DBAdmin(db_name)
+        self._db_name = db_name
+        self._db = db_admin.SBB_DBAdmin(
+            db_name, cache_existence,
+            inventory_cache_size=inventory_cache_size,
+            read_only=read_only
+        )
+        self._reporting = None  # Read-only instance, created by reporting()
+        self._reporting_lock = threading.Lock()
+
+    def __enter__(self) -> 'StockBackbone':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
 
     ##############################
@@ -53,24 +128,115 @@ class StockBackbone():
             ]
         ))
 
-    def make_SO(self, customer_id: int, SO_lines: list[OrderLine]) -> int:
-        return self._make_order(Order(
+    def make_SO(self, customer_id: int, SO_lines: list[OrderLine],
+                reserve_ttl: float = None) -> int:
+        # reserve_ttl: seconds to hold the stock ordered (None = no hold)
+        return self._make_orders([Order(
             order_type='sale',
             entity_id=customer_id,
             lines=[
                 OrderLine(sku=item[0], qty_ordered=item[1], qty_delivered=0)
                 for item in SO_lines
             ]
-        ))
+        )], reserve_ttl)[0]
+
+    def make_POs(self, POs: list[tuple[int, list[OrderLine]]]) -> list[int]:
+        return self._make_orders([
+            Order(
+                order_type='purchase',
+                entity_id=supplier_id,
+                lines=[
+                    OrderLine(sku=item[0], qty_ordered=item[1], qty_delivered=0)
+                    for item in PO_lines
+                ]
+            )
+            for supplier_id, PO_lines in POs
+        ])
+
+    def make_SOs(self, SOs: list[tuple[int, list[OrderLine]]],
+                 reserve_ttl: float = None) -> list[int]:
+        return self._make_orders([
+            Order(
+                order_type='sale',
+                entity_id=customer_id,
+                lines=[
+                    OrderLine(sku=item[0], qty_ordered=item[1], qty_delivered=0)
+                    for item in SO_lines
+                ]
+            )
+            for customer_id, SO_lines in SOs
+        ], reserve_ttl)
+
+    def create_orders(self, orders: list[Order]) -> BulkCreateResult:
+        # Whole orders, e.g. imported with qty already delivered. Valid
+        # orders are inserted in one go; invalid ones get an error and no
+        # id, so that ids stay aligned with the input
+        result = BulkCreateResult(ids=[None] * len(orders))
+        missing_entities = self._db.missing_entities([
+            the_order.entity_id for the_order in orders
+        ])
+        missing_skus = self._db.missing_skus([
+            ol.sku for the_order in orders for ol in the_order.lines
+        ])
+        valid_indexes = list()
+        for i, the_order in enumerate(orders):
+            try:
+                if the_order.order_type not in ('purchase', 'sale'):
+                    raise WrongOrderType('purchase or sale',
+                                         the_order.order_type)
+                self._validate_order(the_order, missing_entities, missing_skus)
+                for ol in the_order.lines:
+                    if not (math.isfinite(ol.qty_ordered)
+                            and (0 < ol.qty_ordered)
+                            and (0 <= ol.qty_delivered <= ol.qty_ordered)):
+                        raise OrderQtyIncorrect(the_order.order_type, ol)
+            except SBB_Exception as error:
+                result.errors[i] = str(error)
+            else:
+                valid_indexes.append(i)
+
+        new_ids = self._db.add_orders([orders[i] for i in valid_indexes])
+        for i, new_id in zip(valid_indexes, new_ids):
+            result.ids[i] = new_id
+        return result
 
     def _make_order(self, the_order: Order) -> int:
+        return self._make_orders([the_order])[0]
+
+    def _make_orders(self, orders: list[Order],
+                     reserve_ttl: float = None) -> list[int]:
+        # All entities and SKUs of the batch are checked in one go.
+        # With reserve_ttl, orders are only created if their open qty can be
+        # reserved (else NotEnoughStock).
+        missing_entities = self._db.missing_entities([
+            the_order.entity_id for the_order in orders
+        ])
+        missing_skus = self._db.missing_skus([
+            ol.sku for the_order in orders for ol in the_order.lines
+        ])
+        for the_order in orders:
+            self._validate_order(the_order, missing_entities, missing_skus)
+
+        # Input validated
+        if reserve_ttl is None:
+            return self._db.add_orders(orders)
+        with self._db.transaction():
+            order_ids = self._db.add_orders(orders)
+            self._db.reserve_order_lines(
+                [ol for the_order in orders for ol in the_order.lines],
+                time.time() + reserve_ttl
+            )
+        return order_ids
+
+    def _validate_order(self, the_order: Order, missing_entities: set[int],
+                        missing_skus: set[int]) -> None:
         # FIXME: Prevent having 2 lines with same SKU
-        if not self.is_entity(the_order.entity_id):
+        if the_order.entity_id in missing_entities:
             raise EntityDoesntExist(the_order.entity_id)
-        
+
         position = 1
         for order_line in the_order.lines:
-            if not self.is_sku(order_line.sku):
+            if order_line.sku in missing_skus:
                 raise SKUDoesntExist(order_line.sku)
             
             try:
@@ -80,91 +246,276 @@ class StockBackbone():
             
             order_line.position = position
             position += 1
-        
-        # Input validated
-        order_id = self._db.add_order(the_order)
-        for ol in the_order.lines:
-            ol.order_id = order_id
-        num_lines_added = self._db.add_order_lines(the_order.lines)
-        if num_lines_added != len(the_order.lines):
-            raise SBB_Exception(
-                f'Unexpected exception: {num_lines_added} lines created ',
-                f'VS. expected {len(the_order.lines)}'
-                )
 
-        return order_id
+    def _delivery_lines(self, the_order: Order,
+                        delivered_qtys: dict[int, float]) -> list[OrderLine]:
+        # Lines with qty_delivered = qty delivered now (None = all open qty)
+        lines_by_position = {ol.position: ol for ol in the_order.lines}
+        if delivered_qtys is None:
+            delivered_qtys = {
+                ol.position: allocation.qty_required(ol)
+                for ol in the_order.lines
+            }
+
+        delivery = list()
+        for position, qty in delivered_qtys.items():
+            ol = lines_by_position.get(position)
+            try:
+                qty = float(qty)
+            except (TypeError, ValueError):
+                raise OrderQtyIncorrect(the_order.order_type, delivered_qtys)
+            if (ol is None) or (qty < 0) or (qty > allocation.qty_required(ol)):
+                raise OrderQtyIncorrect(the_order.order_type, delivered_qtys)
+            if qty > 0:
+                delivery.append(OrderLine(
+                    order_id=the_order.id, position=position, sku=ol.sku,
+                    qty_delivered=qty
+                ))
+        return delivery
 
     def get_order(self, order_id: int) -> Order:
         the_order = self._db.get_order(order_id)
+        if the_order is None:
+            raise OrderDoesntExist(order_id)
         return the_order
+
+    def get_orders(self, order_ids: list[int]) -> list[Order]:
+        orders = self._db.get_orders(order_ids)
+        if len(orders) != len(order_ids):
+            found_ids = {the_order.id for the_order in orders}
+            raise OrderDoesntExist(next(
+                order_id for order_id in order_ids if order_id not in found_ids
+            ))
+        return orders
+
+    def iter_orders(self, order_type: str = None, entity_id: int = None,
+                    open_only: bool = False,
+                    chunk_size: int = 1000) -> Iterator[Order]:
+        return self._db.iter_orders(order_type, entity_id, open_only,
+                                    chunk_size)
+
+    def iter_rows(self, kind: str, chunk_size: int = 1000) -> Iterator[tuple]:
+        # Whole table as plain rows: 'skus', 'entities', 'orders' (one row
+        # per line) or 'inventory'
+        return self._db.iter_rows(kind, chunk_size)
+
+    # Listings are paginated by key: pass a page's next_cursor as 'after' to
+    # get the next page (next_cursor None = last page)
+    def list_orders(self, order_type: str = None, entity_id: int = None,
+                    open_only: bool = False, after: int = None,
+                    limit: int = 100) -> Page:
+        self._check_page_size(limit)
+        return self._db.list_orders(order_type, entity_id, open_only,
+                                    after, limit)
+
+    def list_order_lines(self, order_id: int = None, sku: int = None,
+                         open_only: bool = False, after: int = None,
+                         limit: int = 100) -> Page:
+        self._check_page_size(limit)
+        return self._db.list_order_lines(order_id, sku, open_only,
+                                         after, limit)
+
+    def list_skus(self, desc_contains: str = None, after: int = None,
+                  limit: int = 100) -> Page:
+        self._check_page_size(limit)
+        return self._db.list_skus(desc_contains, after, limit)
+
+    def list_inventory(self, in_stock_only: bool = False, after: int = None,
+                       limit: int = 100) -> Page:
+        self._check_page_size(limit)
+        return self._db.list_inventory(in_stock_only, after, limit)
+
+    def list_entities(self, entity_type: str = None, after: int = None,
+                      limit: int = 100) -> Page:
+        self._check_page_size(limit)
+        return self._db.list_entities(entity_type, after, limit)
+
+    @staticmethod
+    def _check_page_size(limit: int) -> None:
+        if not (isinstance(limit, int)
+                and 0 < limit <= StockBackbone.MAX_PAGE_SIZE):
+            raise SBB_Exception(
+                f'Page size must be 1 to {StockBackbone.MAX_PAGE_SIZE}: {limit}'
+            )
+
+    def get_inventory_level(self, skus: list[int]) -> list[StockPosition]:
+        return self._db.get_inventory_level(skus)
+
+    def set_inventory_levels(self, levels: dict[int, float]) -> None:
+        # Absolute levels {sku: qty}, e.g. counted: existing positions are
+        # adjusted, the others created. One commit for all SKUs.
+        missing_skus = self._db.missing_skus(list(levels))
+        if missing_skus:
+            raise SKUDoesntExist(min(missing_skus))
+        for qty in levels.values():
+            if not (math.isfinite(qty) and qty >= 0):
+                raise UserInputInvalid('Inventory qty', qty)
+
+        levels = dict(levels)
+        with self._db.transaction():
+            existing = self._db.get_inventory_level(list(levels))
+            self._db.update_inventory_level([
+                StockChange(position=position.position, sku=position.sku,
+                            qty=levels.pop(position.sku))
+                for position in existing
+            ])
+            self._db.set_inventory_level([
+                StockPosition(sku=sku, qty=qty) for sku, qty in levels.items()
+            ])
     
-    def receive_PO(self, mode: str, order_id: int) -> bool:
-        if mode == 'full-delivery':
+    def receive_PO(self, mode: str, order_id: int,
+                   delivered_qtys: dict[int, float] = None) -> bool:
+        # delivered_qtys: {position: qty received now}, for mode 'partial'
+        match mode:
+            case 'full-delivery':
+                delivered_qtys = None
+            case 'partial' if delivered_qtys is not None:
+                pass
+            case _:
+                raise SBB_Exception(
+                    'Unexpected exception: order-setting order not expected'
+                    )
+
+        with self._db.transaction():  # One commit for stock and PO
             the_order = self.get_order(order_id)
             if the_order.order_type != 'purchase':
                 raise WrongOrderType('purchase', the_order.order_type)
-            
+            delivery = self._delivery_lines(the_order, delivered_qtys)
+            if not delivery:
+                return True
+
             # Add inventory to stock
             add_inv = self._db.change_inventory('101', [
-                StockChange(sku=ol.sku, qty=ol.qty_ordered)
-                for ol in the_order.lines
+                StockChange(sku=ol.sku, qty=ol.qty_delivered)
+                for ol in delivery
                 ])
 
             if add_inv:
-                # Update PO
-                for ol in the_order.lines:
-                    ol.qty_delivered = ol.qty_ordered
-                self._db.set_order_lines('delivered_qty', the_order.lines)
+                # Update PO, only on the lines delivered
+                self._db.set_order_lines('delivered_qty_delta', delivery)
             else:
                 raise SBB_Exception('Unable to increase inventory')
-        else:
-            raise SBB_Exception(
-                'Unexpected exception: order-setting order not expected'
-                )
+        return True
     
-    def issue_SO(self, mode: str, order_id: int) -> bool:
-        if mode == 'ship-full':
+    def issue_SO(self, mode: str, order_id: int,
+                 shipped_qtys: dict[int, float] = None) -> bool:
+        # shipped_qtys: {position: qty shipped now}, for mode 'ship-partial'
+        match mode:
+            case 'ship-full':
+                shipped_qtys = None
+            case 'ship-partial' if shipped_qtys is not None:
+                pass
+            case _:
+                raise SBB_Exception(
+                    'Unexpected exception: order-setting order not expected'
+                    )
+
+        with self._db.transaction():  # One commit for stock and SO
             the_order = self.get_order(order_id)
             if the_order.order_type != 'sale':
                 raise WrongOrderType('sale', the_order.order_type)
-            
-            # Check if order is fulfillable
-            inv_levels = self._db.get_inventory_level([
-                item.sku for item in the_order.lines
-            ])
-            inv_changes = []
-            for ol in the_order.lines:
-                qty_change = ol.qty_ordered - ol.qty_delivered
-                stock_position = [
-                    stk for stk in inv_levels
-                    if stk.sku == ol.sku
-                    ]
-                if not stock_position:
-                    raise NotEnoughStockToFullfillOrder(
-                        order_id, ol.sku, qty_change, 0
-                    )
-                stock_position = stock_position[0]
-                qty_after = stock_position.qty - qty_change
-                if qty_after < 0:
-                    raise NotEnoughStockToFullfillOrder(
-                        order_id, ol.sku, qty_change, stock_position.qty
-                    )
-                inv_changes.append(StockPosition(
-                    position=stock_position.position,
-                    qty=qty_after
-                ))
+            delivery = self._delivery_lines(the_order, shipped_qtys)
+            if not delivery:
+                return True
 
-            # We have enough stock. Proceed
-            rem_inv = self._db.change_inventory('201', inv_changes)
+            # Stock is checked by the decrement itself: a shortage on any
+            # SKU rolls back the whole shipment, reservations included
+            self._db.consume_reservations(delivery)
+            try:
+                self._db.change_inventory('201', [
+                    StockChange(sku=ol.sku, qty=ol.qty_delivered)
+                    for ol in delivery
+                ])
+            except NotEnoughStock as error:
+                raise NotEnoughStockToFullfillOrder(
+                    order_id, error.sku, error.qty_required, error.qty_avail
+                ) from error
+            self._db.set_order_lines('delivered_qty_delta', delivery)
+        return True
 
-            if rem_inv:  # All lines on SO have been fulfilled
-                for ol in the_order.lines:
-                    ol.qty_delivered = ol.qty_ordered
-                self._db.set_order_lines('delivered_qty', the_order.lines)
-        else:
-            raise SBB_Exception(
-                'Unexpected exception: order-setting order not expected'
-                )
+    def issue_SOs(self, order_ids: list[int], policy: str = 'fifo',
+                  allow_partial: bool = False) -> WaveResult:
+        with self._db.transaction():  # One commit for the whole wave
+            orders = self.get_orders(list(dict.fromkeys(order_ids)))
+            for the_order in orders:
+                if the_order.order_type != 'sale':
+                    raise WrongOrderType('sale', the_order.order_type)
+
+            # Stock of all SKUs in the wave is read once, allocated in memory:
+            # what is available to promise, plus what each order reserved
+            available = self._db.get_available_to_promise(list({
+                ol.sku for the_order in orders for ol in the_order.lines
+            }))
+            reserved = self._db.get_reserved_qty(
+                [the_order.id for the_order in orders]
+            )
+            stock = dict(available)
+            result, allocations = allocation.allocate_wave(
+                orders, stock, policy, allow_partial, reserved
+            )
+            if not allocations:
+                return result
+
+            # Waves can be large: writes go through columnar batches
+            deliveries = OrderBatch()
+            sku_by_line = {
+                (the_order.id, ol.position): ol.sku
+                for the_order in orders for ol in the_order.lines
+            }
+            for order_id, order_allocation in allocations.items():
+                for position, qty in order_allocation.items():
+                    deliveries.append(order_id, position,
+                                      sku_by_line[(order_id, position)], 0, qty)
+            issued = InventoryFrame()  # Positions not needed: 0
+            for sku, qty in zip(deliveries.sku, deliveries.qty_delivered):
+                issued.append(0, sku, qty)
+            self._db.consume_reservations(deliveries)
+            self._db.change_inventory('201', issued)
+            self._db.set_order_lines('delivered_qty_delta', deliveries)
+        return result
+
+    def availability_report(self, order_ids: list[int] = None,
+                            policy: str = 'fifo'):
+        # Returns an availability.AvailabilityReport. NumPy is only needed
+        # here, so it is imported on first use.
+        from sbb import availability
+        return availability.compute_availability(self._db, order_ids, policy)
+
+    def get_inventory_at(self, skus: list[int],
+                         at: datetime | float) -> list[StockPosition]:
+        return self._db.get_inventory_at(skus, at)
+
+    def take_stock_snapshot(self) -> int:
+        return self._db.take_stock_snapshot()
+
+    def get_total_on_hand(self) -> float:
+        return self._db.get_total_on_hand()
+
+    def get_sku_aggregates(self, skus: list[int]) -> list[SkuAggregate]:
+        return self._db.get_sku_aggregates(skus)
+
+    def get_open_order_qty(self, entity_ids: list[int],
+                           order_type: str = 'sale') -> dict[int, float]:
+        # 'sale': backlog per customer; 'purchase': qty due per supplier
+        return self._db.get_open_order_qty(entity_ids, order_type)
+
+    def rebuild_aggregates(self) -> None:
+        self._db.rebuild_aggregates()
+
+    def get_available_to_promise(self, skus: list[int]) -> dict[int, float]:
+        return self._db.get_available_to_promise(skus)
+
+    def release_expired_reservations(self) -> int:
+        return self._db.release_expired_reservations()
+
+    def cancel_reservations(self, order_ids: list[int]) -> int:
+        return self._db.cancel_reservations(order_ids)
+
+    def archive_orders(self, cutoff: datetime | float,
+                       chunk_size: int = 1000) -> int:
+        # Closed orders created before cutoff leave the working tables.
+        # get_order(s) still find them; listings only cover working tables.
+        return self._db.archive_orders(cutoff, chunk_size)
 
 
     ##############################
@@ -190,8 +541,81 @@ class StockBackbone():
             return self._db.add_sku(sku_desc)
         else:
             raise UserInputInvalid('SKU description', sku_desc)
+
+    def create_suppliers(self, supplier_names: list[str]) -> BulkCreateResult:
+        return self._create_in_bulk(
+            supplier_names, 'external entity name', 'Supplier name',
+            lambda names: self._db.add_external_entities(names, 'supplier')
+        )
+
+    def create_customers(self, customer_names: list[str]) -> BulkCreateResult:
+        return self._create_in_bulk(
+            customer_names, 'external entity name', 'Customer name',
+            lambda names: self._db.add_external_entities(names, 'customer')
+        )
+
+    def create_skus(self, sku_descs: list[str]) -> BulkCreateResult:
+        return self._create_in_bulk(sku_descs, 'sku desc', 'SKU description',
+                                    self._db.add_skus)
+
+    def _create_in_bulk(self, values: list[str], input_type: str,
+                        field_name: str, add_all) -> BulkCreateResult:
+        # Valid values are inserted in one go; invalid ones get an error
+        # and no id, so that ids stay aligned with the input
+        result = BulkCreateResult(ids=[None] * len(values))
+        valid_indexes = list()
+        for i, value in enumerate(values):
+            if StockBackbone.validate_text_input(value, input_type):
+                valid_indexes.append(i)
+            else:
+                result.errors[i] = str(UserInputInvalid(field_name, value))
+
+        new_ids = add_all([values[i] for i in valid_indexes])
+        for i, new_id in zip(valid_indexes, new_ids):
+            result.ids[i] = new_id
+        return result
     
 
+    ##############################
+    ########## Transactions ######
+    ##############################
+
+    def transaction(self) -> AbstractContextManager[None]:
+        return self._db.transaction()
+
+    def read_snapshot(self) -> AbstractContextManager[None]:
+        return self._db.read_snapshot()
+
+    def reporting(self) -> 'StockBackbone':
+        # Read-only access to the same database, for reports and long scans:
+        # it never takes the write lock, so order processing is not held up.
+        # Each thread reading through it gets its own connection.
+        # Created once, then shared; closed by close().
+        with self._reporting_lock:
+            if self._reporting is None:
+                self._reporting = StockBackbone(self._db_name, read_only=True)
+            return self._reporting
+
+    def close(self) -> None:
+        # Closes the connections, including those of reporting()
+        with self._reporting_lock:
+            if self._reporting is not None:
+                self._reporting.close()
+                self._reporting = None
+        self._db.close_connection()
+
+
+    ##############################
+    ########## Instrumentation ###
+    ##############################
+
+    def enable_instrumentation(self) -> SBB_Instrumentation:
+        return self._db.enable_instrumentation()
+
+    def disable_instrumentation(self) -> None:
+        self._db.disable_instrumentation()
+
+
     ##############################
     ########## Support ###########
     ##############################
@@ -202,22 +626,17 @@ class StockBackbone():
     def is_sku(self, sku: int) -> bool:
         return self._db.is_sku(sku)
 
+    def missing_entities(self, entity_ids: list[int]) -> set[int]:
+        return self._db.missing_entities(entity_ids)
+
+    def missing_skus(self, skus: list[int]) -> set[int]:
+        return self._db.missing_skus(skus)
+
     @staticmethod
     def validate_text_input(value: str, input_type: str) -> bool:
-        match input_type:
-            case 'db name':
-                valid_chrs = '_' + string.ascii_letters + string.digits
-                max_length = 30
-            case 'sku desc' | 'external entity name':
-                valid_chrs = ' -_.,()[]' + string.ascii_letters + string.digits
-                max_length = 50
-            case _:
-                return False
-        
-        acceptable_name = ''.join(char for char in value if char in valid_chrs)
+        pattern = StockBackbone.TEXT_INPUT_PATTERNS.get(input_type)
         return (
-            (value == acceptable_name)
-            and (len(value) > 0)
-            and (len(value) <= max_length)
+            (pattern is not None)
+            and isinstance(value, str)
+            and (pattern.fullmatch(value) is not None)
         )
-
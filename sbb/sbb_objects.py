@@ -1,12 +1,16 @@
 """ sbb_objects.py
 Defines objects used through the software.
+Row objects are slotted (no per-instance __dict__). Bulk paths use the
+columnar OrderBatch / InventoryFrame instead, with one array per column.
 """
 
+from array import array
+from collections.abc import Iterable, Iterator
 from dataclasses import dataclass, field
 from typing import Self
 
 
-@dataclass
+@dataclass(slots=True)
 class OrderLine:
     id: int = None
     order_id: int = None
@@ -25,7 +29,7 @@ class OrderLine:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Order:
     id: int = None
     order_type: str = None
@@ -40,7 +44,7 @@ class Order:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class StockPosition:
     position: int = None
     sku: int = None
@@ -53,9 +57,121 @@ class StockPosition:
         )
     
 
-@dataclass
+@dataclass(slots=True)
 class StockChange:
     position: int = None
     sku: int = None
     qty: int = None
 
+
+@dataclass(slots=True)
+class Product:
+    sku: int = None
+    desc: str = None
+
+
+@dataclass(slots=True)
+class ExternalEntity:
+    id: int = None
+    name: str = None
+    entity_type: str = None
+
+
+@dataclass(slots=True)
+class Page:  # One page of a keyset-paginated listing
+    items: list = field(default_factory=list)
+    next_cursor: int | None = None  # 'after' of the next page; None = last
+
+
+@dataclass(slots=True)
+class SkuAggregate:
+    sku: int = None
+    on_hand: float = 0
+    open_po_qty: float = 0
+    open_so_qty: float = 0
+
+
+@dataclass(slots=True)
+class WaveResult:
+    fulfilled: list[int] = field(default_factory=list)
+    partial: list[int] = field(default_factory=list)
+    unfulfilled: list[int] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class BulkCreateResult:
+    ids: list[int | None] = field(default_factory=list)  # Input sequence
+    errors: dict[int, str] = field(default_factory=dict)  # Input index -> error
+
+
+@dataclass(slots=True)
+class OrderBatch:  # Columnar order lines
+    order_id: array = field(default_factory=lambda: array('q'))
+    position: array = field(default_factory=lambda: array('q'))
+    sku: array = field(default_factory=lambda: array('q'))
+    qty_ordered: array = field(default_factory=lambda: array('d'))
+    qty_delivered: array = field(default_factory=lambda: array('d'))
+
+    def __len__(self) -> int:
+        return len(self.order_id)
+
+    def append(self, order_id: int, position: int, sku: int,
+               qty_ordered: float, qty_delivered: float) -> None:
+        self.order_id.append(order_id)
+        self.position.append(position)
+        self.sku.append(sku)
+        self.qty_ordered.append(qty_ordered)
+        self.qty_delivered.append(qty_delivered)
+
+    def extend(self, rows: Iterable[tuple]) -> None:
+        # rows: (order_id, position, sku, qty_ordered, qty_delivered)
+        for row in rows:
+            self.append(*row)
+
+    def rows(self) -> Iterator[tuple]:
+        return zip(self.order_id, self.position, self.sku,
+                   self.qty_ordered, self.qty_delivered)
+
+
+@dataclass(slots=True)
+class InventoryFrame:  # Columnar stock positions (or changes, position 0)
+    position: array = field(default_factory=lambda: array('q'))
+    sku: array = field(default_factory=lambda: array('q'))
+    qty: array = field(default_factory=lambda: array('d'))
+
+    def __len__(self) -> int:
+        return len(self.sku)
+
+    def append(self, position: int, sku: int, qty: float) -> None:
+        self.position.append(position)
+        self.sku.append(sku)
+        self.qty.append(qty)
+
+    def extend(self, rows: Iterable[tuple]) -> None:
+        # rows: (position, sku, qty)
+        for row in rows:
+            self.append(*row)
+
+    def rows(self) -> Iterator[tuple]:
+        return zip(self.position, self.sku, self.qty)
+
+    def qty_by_sku(self) -> dict[int, float]:
+        totals = dict()
+        for sku, qty in zip(self.sku, self.qty):
+            totals[sku] = totals.get(sku, 0) + qty
+        return totals
+
+
+@dataclass(slots=True)
+class RejectedRow:
+    row_number: int  # 1 = first data row of the file
+    row: dict
+    reason: str
+
+
+@dataclass(slots=True)
+class ImportReport:
+    kind: str
+    rows_read: int = 0
+    rows_imported: int = 0
+    rejected: list[RejectedRow] = field(default_factory=list)
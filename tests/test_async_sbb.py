@@ -0,0 +1,71 @@
+""" test_async_sbb.py
+Tests AsyncStockBackbone methods
+"""
+
+import asyncio
+import pytest
+
+from sbb.async_sbb import AsyncStockBackbone
+from sbb.exceptions import SKUDoesntExist, OrderDoesntExist
+
+
+def test_make_and_get_order():
+    async def scenario():
+        async with AsyncStockBackbone(':memory:') as sbb:
+            supplier_id = await sbb.create_supplier('A supplier')
+            sku = await sbb.create_sku('A product')
+            po_id = await sbb.make_PO(supplier_id, [(sku, 5)])
+            await sbb.receive_PO('full-delivery', po_id)
+            return await sbb.get_order(po_id)
+
+    the_order = asyncio.run(scenario())
+    assert the_order.lines[0].qty_delivered == 5
+
+
+def test_concurrent_writes_are_batched():
+    async def scenario():
+        async with AsyncStockBackbone(':memory:', max_write_batch=10) as sbb:
+            customer_id = await sbb.create_customer('A customer')
+            sku = await sbb.create_sku('A product')
+            commits = 0
+            def count_commits(statement: str) -> None:
+                nonlocal commits
+                commits += statement == 'COMMIT'
+            sbb._sbb._db._con.set_trace_callback(count_commits)
+            so_ids = await asyncio.gather(*[
+                sbb.make_SO(customer_id, [(sku, i + 1)]) for i in range(50)
+            ])
+            sbb._sbb._db._con.set_trace_callback(None)
+            return so_ids, commits
+
+    so_ids, commits = asyncio.run(scenario())
+    assert (len(set(so_ids)) == 50) and (1 <= commits <= 5)
+
+
+def test_failed_write_only_affects_its_caller():
+    async def scenario():
+        async with AsyncStockBackbone(':memory:') as sbb:
+            customer_id = await sbb.create_customer('A customer')
+            sku = await sbb.create_sku('A product')
+            return await asyncio.gather(
+                sbb.make_SO(customer_id, [(sku, 1)]),
+                sbb.make_SO(customer_id, [(sku + 1, 1)]),
+                sbb.make_SO(customer_id, [(sku, 2)]),
+                return_exceptions=True
+            )
+
+    outcomes = asyncio.run(scenario())
+    assert (
+        isinstance(outcomes[0], int)
+        and isinstance(outcomes[1], SKUDoesntExist)
+        and isinstance(outcomes[2], int)
+    )
+
+
+def test_read_error_propagates():
+    async def scenario():
+        async with AsyncStockBackbone(':memory:') as sbb:
+            await sbb.get_order(1)
+
+    with pytest.raises(OrderDoesntExist):
+        asyncio.run(scenario())
@@ -0,0 +1,189 @@
+""" test_availability.py
+Tests the vectorized availability report against the allocation rules
+"""
+
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from sbb import allocation, availability
+from sbb.exceptions import SBB_Exception
+from sbb.sbb import StockBackbone
+from sbb.sbb_objects import (
+    Order, OrderLine, StockPosition, OrderBatch, InventoryFrame
+)
+
+
+@pytest.fixture
+def sbb_with_backlog():
+    sbb_object = StockBackbone(':memory:')
+    customer_id = sbb_object.create_customer('A customer')
+    sku = [sbb_object.create_sku(f'Product {chr(65+i)}') for i in range(3)]
+    so_ids = sbb_object.make_SOs([
+        (customer_id, [(sku[0], 4), (sku[1], 1)]),
+        (customer_id, [(sku[0], 3)]),
+        (customer_id, [(sku[0], 2), (sku[1], 5), (sku[2], 1)]),
+        ])
+    sbb_object._db.set_inventory_level([
+        StockPosition(sku=sku[0], qty=8),
+        StockPosition(sku=sku[1], qty=2),
+    ])
+    yield sbb_object, so_ids, sku
+    sbb_object._db.close_connection()
+
+
+def test_availability_fifo(sbb_with_backlog):
+    sbb_object, so_ids, sku = sbb_with_backlog
+    report = sbb_object.availability_report()
+    assert (
+        (sorted(report.short_lines()) == [(so_ids[2], 1, sku[0], 1.0),
+                                          (so_ids[2], 2, sku[1], 4.0),
+                                          (so_ids[2], 3, sku[2], 1.0)])
+        and (report.covered_orders() == so_ids[:2])
+        and (report.demand_qty.tolist() == [9, 6, 1])
+        and (report.shortage_qty.tolist() == [1, 4, 1])
+    )
+
+def test_availability_priority(sbb_with_backlog):
+    sbb_object, so_ids, sku = sbb_with_backlog
+    report = sbb_object.availability_report(so_ids[::-1], policy='priority')
+    assert (
+        (report.covered_orders() == [so_ids[1]])
+        and (sorted(report.short_lines()) == [(so_ids[0], 1, sku[0], 1.0),
+                                              (so_ids[0], 2, sku[1], 1.0),
+                                              (so_ids[2], 2, sku[1], 3.0),
+                                              (so_ids[2], 3, sku[2], 1.0)])
+    )
+
+def test_availability_priority_needs_sequence(sbb_with_backlog):
+    sbb_object, so_ids, sku = sbb_with_backlog
+    with pytest.raises(SBB_Exception):
+        sbb_object.availability_report(policy='priority')
+
+def test_availability_matches_partial_wave(sbb_with_backlog):
+    sbb_object, so_ids, sku = sbb_with_backlog
+    sbb_object.issue_SOs(so_ids[1:2])  # Open lines only are reported
+    report = sbb_object.availability_report()
+    sbb_object.issue_SOs(so_ids, allow_partial=True)
+
+    delivered = {
+        (the_order.id, ol.position): ol.qty_delivered
+        for the_order in sbb_object.get_orders(so_ids)
+        for ol in the_order.lines
+    }
+    assert all(
+        delivered[(order_id, position)] == qty
+        for order_id, position, qty in zip(report.order_id.tolist(),
+                                           report.position.tolist(),
+                                           report.qty_allocated.tolist())
+    )
+
+def test_availability_with_reservations(sbb_with_backlog):
+    sbb_object, so_ids, sku = sbb_with_backlog
+    reserved_so_id = sbb_object.make_SO(
+        sbb_object.get_order(so_ids[0]).entity_id,
+        [(sku[0], 3), (sku[1], 1)], reserve_ttl=60
+    )
+    all_ids = so_ids + [reserved_so_id]
+    report = sbb_object.availability_report()
+    other_orders_report = sbb_object.availability_report(so_ids[1:])
+    sbb_object.issue_SOs(all_ids, allow_partial=True)
+
+    delivered = {
+        (the_order.id, ol.position): ol.qty_delivered
+        for the_order in sbb_object.get_orders(all_ids)
+        for ol in the_order.lines
+    }
+    assert (
+        (report.covered_orders() == [so_ids[0], reserved_so_id])
+        and (report.stock_qty.tolist() == [8, 2, 0])
+        and (other_orders_report.stock_qty.tolist() == [5, 1, 0])
+        and all(
+            delivered[(order_id, position)] == qty
+            for order_id, position, qty in zip(
+                report.order_id.tolist(), report.position.tolist(),
+                report.qty_allocated.tolist()
+            )
+        )
+    )
+
+def test_availability_excludes_stock_reserved_by_others():
+    sbb_object = StockBackbone(':memory:')
+    customer_id = sbb_object.create_customer('A customer')
+    sku = sbb_object.create_sku('A product')
+    sbb_object._db.set_inventory_level([StockPosition(sku=sku, qty=10)])
+    sbb_object.make_SO(customer_id, [(sku, 10)], reserve_ttl=60)
+    so_id = sbb_object.make_SO(customer_id, [(sku, 10)])
+    report = sbb_object.availability_report([so_id])
+    result = sbb_object.issue_SOs([so_id], allow_partial=True)
+    assert (
+        (report.covered_orders() == [])
+        and (report.short_lines() == [(so_id, 1, sku, 10.0)])
+        and (result.unfulfilled == [so_id])
+    )
+    sbb_object._db.close_connection()
+
+def test_availability_matches_allocate_wave():
+    sbb_object = StockBackbone(':memory:')
+    rng = random.Random(7)
+    customer_id = sbb_object.create_customer('A customer')
+    skus = [sbb_object.create_sku(f'Product {i}') for i in range(20)]
+    so_ids = sbb_object.make_SOs([
+        (customer_id, [(sku, rng.randint(1, 10))
+                       for sku in rng.sample(skus, rng.randint(1, 5))])
+        for _ in range(200)
+    ])
+    sbb_object._db.set_inventory_level([
+        StockPosition(sku=sku, qty=rng.randint(0, 60)) for sku in skus[:15]
+    ])
+
+    report = sbb_object.availability_report()
+    stock = {
+        stk.sku: stk.qty for stk in sbb_object._db.get_inventory_level(skus)
+    }
+    _, allocations = allocation.allocate_wave(
+        sbb_object.get_orders(so_ids), stock, allow_partial=True
+    )
+    assert all(
+        allocations.get(order_id, {}).get(position, 0) == qty
+        for order_id, position, qty in zip(report.order_id.tolist(),
+                                           report.position.tolist(),
+                                           report.qty_allocated.tolist())
+    )
+    sbb_object._db.close_connection()
+
+def test_allocate_lines_matches_allocate_wave_with_reservations():
+    rng = random.Random(11)
+    orders = [
+        Order(id=order_id, order_type='sale', entity_id=1, lines=[
+            OrderLine(order_id=order_id, position=position, sku=sku,
+                      qty_ordered=rng.randint(1, 10), qty_delivered=0)
+            for position, sku in enumerate(
+                rng.choices(range(8), k=rng.randint(1, 4)), start=1
+            )
+        ])
+        for order_id in range(1, 101)
+    ]
+    reserved = {
+        the_order.id: {ol.sku: rng.randint(1, 6) for ol in the_order.lines}
+        for the_order in rng.sample(orders, 30)
+    }
+    stock = {sku: rng.randint(0, 40) for sku in range(6)}
+    batch = OrderBatch()
+    batch.extend((ol.order_id, ol.position, ol.sku, ol.qty_ordered, 0)
+                 for the_order in orders for ol in the_order.lines)
+    frame = InventoryFrame()
+    frame.extend((0, sku, qty) for sku, qty in stock.items())
+
+    report = availability.allocate_lines(batch, frame, reserved=reserved)
+    _, allocations = allocation.allocate_wave(orders, dict(stock),
+                                              allow_partial=True,
+                                              reserved=reserved)
+    assert all(
+        allocations.get(order_id, {}).get(position, 0) == qty
+        for order_id, position, qty in zip(report.order_id.tolist(),
+                                           report.position.tolist(),
+                                           report.qty_allocated.tolist())
+    )
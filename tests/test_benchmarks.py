@@ -0,0 +1,35 @@
+""" test_benchmarks.py
+Tests the benchmark suite runs and its data generator is reproducible
+"""
+
+import random
+
+from benchmarks import datagen
+from benchmarks.run_benchmarks import run_benchmarks
+
+
+def test_datagen_is_seeded():
+    spec = datagen.CatalogSpec(num_skus=50)
+    lines = [
+        datagen.generate_order_lines(random.Random(spec.seed),
+                                     list(range(50)), spec)
+        for _ in range(2)
+    ]
+    assert (
+        (datagen.generate_skus(spec) == datagen.generate_skus(spec))
+        and (lines[0] == lines[1])
+        and (len({sku for sku, _ in lines[0]}) == len(lines[0]))
+    )
+
+def test_run_benchmarks_small_scale():
+    results = run_benchmarks([50], ['memory', 'file'], num_ops=5)
+    assert (
+        (len(results['results']) == 2)
+        and all([
+            set(result['operations']) == {
+                'create_sku', 'make_PO', 'receive_PO', 'make_SO',
+                'issue_SO', 'get_order', 'get_inventory_level'
+            }
+            for result in results['results']
+        ])
+    )
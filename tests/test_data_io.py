@@ -0,0 +1,137 @@
+""" test_data_io.py
+Tests CSV / JSONL imports and exports
+"""
+
+import json
+
+import pytest
+
+from sbb import data_io
+from sbb.sbb import StockBackbone
+
+
+@pytest.fixture
+def dummy_sbb():
+    sbb_object = StockBackbone(':memory:')
+    yield sbb_object
+    sbb_object._db.close_connection()
+
+
+def test_import_skus_csv_in_chunks(dummy_sbb, tmp_path):
+    path = tmp_path / 'catalog.csv'
+    path.write_text('desc,unused\n'
+                    'Product A,x\n'
+                    'Product %,x\n'
+                    ',x\n'
+                    'Product B,x\n'
+                    'Product C,x\n')
+    report = data_io.import_file(dummy_sbb, 'skus', path, chunk_size=2)
+    assert (
+        (report.rows_read == 5)
+        and (report.rows_imported == 3)
+        and ([rejected.row_number for rejected in report.rejected] == [2, 3])
+        and all(dummy_sbb.is_sku(sku) for sku in [1, 2, 3])
+        and not dummy_sbb.is_sku(4)
+    )
+
+def test_import_entities_jsonl(dummy_sbb, tmp_path):
+    path = tmp_path / 'entities.jsonl'
+    path.write_text(
+        '{"name": "A supplier", "entity_type": "supplier"}\n'
+        'not json\n'
+        '\n'
+        '{"name": "A customer", "entity_type": "customer"}\n'
+        '{"name": "Someone", "entity_type": "competitor"}\n'
+    )
+    report = data_io.import_file(dummy_sbb, 'entities', path)
+    assert (
+        (report.rows_imported == 2)
+        and ([(rejected.row_number, rejected.reason)
+              for rejected in report.rejected]
+             == [(2, 'Unreadable row'), (4, 'Invalid entity type')])
+        and dummy_sbb.is_entity(1) and dummy_sbb.is_entity(2)
+    )
+
+def test_import_orders_rejects_whole_orders(dummy_sbb, tmp_path):
+    supplier_id = dummy_sbb.create_supplier('A supplier')
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(2)]
+    path = tmp_path / 'orders.csv'
+    path.write_text(
+        'order,order_type,entity_id,sku,qty_ordered,qty_delivered\n'
+        f'A,purchase,{supplier_id},{sku[0]},5,\n'
+        f'A,purchase,{supplier_id},{sku[1]},2,2\n'
+        f'B,purchase,{supplier_id},{sku[0]},3,\n'
+        f'B,purchase,{supplier_id},999,3,\n'
+        f'C,purchase,{supplier_id},{sku[1]},-1,\n'
+    )
+    report = data_io.import_file(dummy_sbb, 'orders', path, chunk_size=1)
+    the_order = dummy_sbb.get_order(1)
+    assert (
+        (report.rows_imported == 2)
+        and ([rejected.row_number for rejected in report.rejected]
+             == [3, 4, 5])
+        and ([(ol.position, ol.sku, ol.qty_ordered, ol.qty_delivered)
+              for ol in the_order.lines]
+             == [(1, sku[0], 5, 0), (2, sku[1], 2, 2)])
+        and (dummy_sbb._db.get_orders([2]) == [])
+    )
+
+def test_import_inventory_levels(dummy_sbb, tmp_path):
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(2)]
+    supplier_id = dummy_sbb.create_supplier('A supplier')
+    dummy_sbb.receive_PO('full-delivery',
+                         dummy_sbb.make_PO(supplier_id, [(sku[0], 5)]))
+    path = tmp_path / 'inventory.jsonl'
+    path.write_text('\n'.join(json.dumps(row) for row in [
+        {'sku': sku[0], 'qty': 8},
+        {'sku': sku[1], 'qty': 3},
+        {'sku': 999, 'qty': 3},
+        {'sku': sku[1], 'qty': -3},
+    ]))
+    report = data_io.import_file(dummy_sbb, 'inventory', path)
+    assert (
+        (report.rows_imported == 2)
+        and (len(report.rejected) == 2)
+        and ([stk.qty for stk in dummy_sbb._db.get_inventory_level(sku)]
+             == [8, 3])
+    )
+
+@pytest.mark.parametrize("fmt", ['csv', 'jsonl'])
+def test_export_import_round_trip(dummy_sbb, tmp_path, fmt):
+    customer_id = dummy_sbb.create_customer('A customer')
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(3)]
+    dummy_sbb.make_SOs([
+        (customer_id, [(sku[0], 1), (sku[1], 2)]),
+        (customer_id, [(sku[2], 3)]),
+    ])
+    for kind in ['skus', 'orders']:
+        data_io.export_file(dummy_sbb, kind, tmp_path / f'{kind}.{fmt}',
+                            chunk_size=2)
+
+    new_sbb = StockBackbone(':memory:')
+    new_sbb.create_customer('A customer')
+    reports = [
+        data_io.import_file(new_sbb, kind, tmp_path / f'{kind}.{fmt}')
+        for kind in ['skus', 'orders']
+    ]
+    assert (
+        all(not report.rejected for report in reports)
+        and (new_sbb.get_orders([1, 2]) == dummy_sbb.get_orders([1, 2]))
+    )
+    new_sbb._db.close_connection()
+
+def test_cli_import_and_export(tmp_path, capsys, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'catalog.csv').write_text('desc\nProduct A\nProduct %\n')
+    data_io.main(['import', 'skus', 'catalog.csv', '--db', 'cli_db'])
+    data_io.main(['export', 'skus', 'skus.jsonl', '--db', 'cli_db'])
+    assert (
+        (capsys.readouterr().out.splitlines()
+         == ['Imported 1 of 2 rows',
+             'Row 2 rejected: User text input invalid for field '
+             '[SKU description]: Product %',
+             'Exported 1 rows'])
+        and (json.loads((tmp_path / 'skus.jsonl').read_text())
+             == {'sku': 1, 'desc': 'Product A'})
+    )
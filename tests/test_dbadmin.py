@@ -3,10 +3,19 @@ Tests SBB_DBAdmin methods.
 """
 
 import pytest
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
+from types import SimpleNamespace
 
 from sbb import db_admin
-from sbb.sbb_objects import Order, OrderLine, StockPosition, StockChange
+from sbb.exceptions import SBB_Exception, ReadOnlyDatabase, NotEnoughStock
+from sbb.sbb import StockBackbone
+from sbb.sbb_objects import (
+    Order, OrderLine, StockPosition, StockChange, OrderBatch, InventoryFrame,
+    Product
+)
 
 
 @pytest.fixture
@@ -27,6 +36,13 @@ def dummy_db():
     new_db.close_connection()
 
 
+@pytest.fixture
+def cached_db():
+    new_db = db_admin.SBB_DBAdmin(':memory:', cache_existence=True)
+    yield new_db
+    new_db.close_connection()
+
+
 def test_create_db_and_close_connection(dummy_db_file):
     assert dummy_db_file.is_file()
 
@@ -34,6 +50,270 @@ def test_missing_table(dummy_db):
     dummy_db._cur.execute("DROP TABLE inventory;")
     assert not dummy_db.is_db_setup()
 
+def test_transaction_commits_on_exit(dummy_db_file):
+    writer = db_admin.SBB_DBAdmin(dummy_db_file.stem)
+    reader = sqlite3.connect(dummy_db_file)
+    count_skus = "SELECT COUNT(*) FROM product;"
+    with writer.transaction():
+        writer.add_sku('product 1')
+        writer.add_sku('product 2')
+        num_skus_inside = reader.execute(count_skus).fetchone()[0]
+    num_skus_after = reader.execute(count_skus).fetchone()[0]
+    reader.close()
+    writer.close_connection()
+    assert (num_skus_inside == 0) and (num_skus_after == 2)
+
+def test_transaction_rolls_back_on_exception(cached_db):
+    with pytest.raises(ZeroDivisionError):
+        with cached_db.transaction():
+            sku = cached_db.add_sku('product')
+            cached_db.set_inventory_level([StockPosition(sku=sku, qty=5)])
+            1 / 0
+    num_rows = cached_db._cur.execute("""
+        SELECT (SELECT COUNT(*) FROM product)
+               + (SELECT COUNT(*) FROM inventory);
+        """).fetchone()[0]
+    assert (num_rows == 0) and not cached_db.is_sku(sku)
+
+def test_nested_transaction_rolls_back_to_savepoint(dummy_db):
+    with dummy_db.transaction():
+        dummy_db.add_sku('kept')
+        with pytest.raises(ZeroDivisionError):
+            with dummy_db.transaction():
+                dummy_db.add_sku('discarded')
+                1 / 0
+        dummy_db.add_sku('also kept')
+    descs = dummy_db._cur.execute("SELECT desc FROM product;").fetchall()
+    assert descs == [('kept',), ('also kept',)]
+
+def test_file_db_uses_wal(dummy_db_file):
+    new_db = db_admin.SBB_DBAdmin(dummy_db_file.stem)
+    journal_mode = new_db._cur.execute("PRAGMA journal_mode;").fetchone()[0]
+    new_db.close_connection()
+    assert journal_mode == 'wal'
+
+@pytest.mark.parametrize("db_name", ['test_threads_db', ':memory:'])
+def test_concurrent_threads(db_name):
+    new_db = db_admin.SBB_DBAdmin(db_name)
+
+    def add_and_check(i: int) -> bool:
+        skus = [new_db.add_sku(f'product {i}-{j}') for j in range(10)]
+        new_db.set_inventory_level([
+            StockPosition(sku=sku, qty=i) for sku in skus
+        ])
+        return (
+            not new_db.missing_skus(skus)
+            and len(new_db.get_inventory_level(skus)) == 10
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(add_and_check, range(40)))
+        num_skus = (
+            new_db._cur.execute("SELECT COUNT(*) FROM product;").fetchone()[0]
+        )
+    finally:
+        new_db.close_connection()
+        if db_name != ':memory:':
+            (Path('data') / (db_name + '.db')).unlink()
+
+    assert all(results) and (num_skus == 400)
+
+@pytest.mark.parametrize("db_name", ['test_threads_db', ':memory:'])
+def test_inventory_cache_not_filled_with_stale_read(db_name):
+    new_db = db_admin.SBB_DBAdmin(db_name, inventory_cache_size=10)
+    sku = new_db.add_sku('A product')
+    new_db.set_inventory_level([StockPosition(sku=sku, qty=5)])
+    position = new_db._select_inventory([sku])[0].position
+
+    # Another thread commits a new level between the read and the store
+    select_inventory = new_db._select_inventory
+    def select_then_write(skus: list[int]) -> list[StockPosition]:
+        fetched = select_inventory(skus)
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            writer.submit(new_db.update_inventory_level,
+                          [StockChange(position=position, qty=10)]).result()
+        return fetched
+
+    try:
+        new_db._select_inventory = select_then_write
+        stale_qty = new_db.get_inventory_level([sku])[0].qty
+        new_db._select_inventory = select_inventory
+        qty = new_db.get_inventory_level([sku])[0].qty
+        stats = new_db.inventory_cache_stats()
+    finally:
+        new_db.close_connection()
+        if db_name != ':memory:':
+            (Path('data') / (db_name + '.db')).unlink()
+
+    assert (stale_qty == 5) and (qty == 10) and (stats['misses'] == 2)
+
+@pytest.mark.parametrize("db_name", ['test_threads_db', ':memory:'])
+def test_concurrent_make_SO(db_name):
+    sbb_object = StockBackbone(db_name)
+    customer_id = sbb_object.create_customer('A customer')
+    sku = sbb_object.create_sku('A product')
+
+    def make_orders(i: int) -> list[int]:
+        so_ids = [sbb_object.make_SO(customer_id, [(sku, i + 1)])
+                  for _ in range(20)]
+        return so_ids + sbb_object.make_SOs([(customer_id, [(sku, 1)])] * 5)
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            so_ids = [so_id for thread_ids in executor.map(make_orders,
+                                                           range(16))
+                      for so_id in thread_ids]
+        num_lines = sbb_object._db._cur.execute(
+            "SELECT COUNT(*) FROM order_line;"
+        ).fetchone()[0]
+    finally:
+        sbb_object._db.close_connection()
+        if db_name != ':memory:':
+            for suffix in ['.db', '.db-wal', '.db-shm']:
+                (Path('data') / (db_name + suffix)).unlink(missing_ok=True)
+
+    assert (len(set(so_ids)) == 16 * 25) and (num_lines == 16 * 25)
+
+def test_new_db_at_latest_schema_version(dummy_db):
+    assert dummy_db.get_schema_version() == db_admin.SCHEMA_VERSION
+
+def test_legacy_db_upgraded_on_open():
+    db_name = 'test_legacy_db'
+    db_path = Path('data') / (db_name + '.db')
+    legacy_con = sqlite3.connect(db_path)
+    legacy_con.executescript("""
+        CREATE TABLE orders (id INTEGER PRIMARY KEY, order_type TEXT NOT NULL,
+                             entity_id INTEGER NOT NULL);
+        CREATE TABLE order_line (id INTEGER PRIMARY KEY,
+                                 order_id INTEGER NOT NULL,
+                                 position INTEGER NOT NULL,
+                                 sku INTEGER NOT NULL,
+                                 qty_ordered INTEGER NOT NULL,
+                                 qty_delivered INTEGER NOT NULL);
+        CREATE TABLE product (sku INTEGER PRIMARY KEY, desc TEXT NOT NULL);
+        CREATE TABLE inventory (position_id INTEGER PRIMARY KEY,
+                                sku INTEGER NOT NULL, qty INTEGER NOT NULL);
+        CREATE TABLE external_entity (id INTEGER PRIMARY KEY,
+                                      name TEXT NOT NULL,
+                                      entity_type TEXT NOT NULL);
+        INSERT INTO inventory (sku, qty) VALUES (1, 5), (2, 1), (1, 3);
+        INSERT INTO orders VALUES (1, 'purchase', 1);
+        INSERT INTO order_line VALUES (1, 1, 1, 1, 4, 1);
+    """)
+    legacy_con.close()
+
+    try:
+        upgraded_db = db_admin.SBB_DBAdmin(db_name)
+        indexes = {
+            row[0] for row in upgraded_db._cur.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )
+        }
+        inventory = upgraded_db._cur.execute(
+            "SELECT sku, qty FROM inventory ORDER BY sku"
+        ).fetchall()
+        aggregates = upgraded_db._cur.execute(
+            "SELECT sku, on_hand, open_po_qty FROM sku_aggregate ORDER BY sku"
+        ).fetchall()
+        version = upgraded_db.get_schema_version()
+        upgraded_db.close_connection()
+    finally:
+        db_path.unlink()
+
+    assert (
+        (version == db_admin.SCHEMA_VERSION)
+        and {'idx_order_line_order', 'idx_inventory_sku',
+             'idx_orders_type_entity'} <= indexes
+        and (inventory == [(1, 8), (2, 1)])
+        and (aggregates == [(1, 8, 3), (2, 1, 0)])
+    )
+
+
+@pytest.fixture
+def writer_and_reader():
+    db_name = 'test_read_only_db'
+    writer = db_admin.SBB_DBAdmin(db_name)
+    reader = db_admin.SBB_DBAdmin(db_name, read_only=True)
+    yield writer, reader
+    reader.close_connection()
+    writer.close_connection()
+    for suffix in ['.db', '.db-wal', '.db-shm', '_archive.db',
+                   '_archive.db-wal', '_archive.db-shm']:
+        (Path('data') / (db_name + suffix)).unlink(missing_ok=True)
+
+def test_read_only_rejects_writes(writer_and_reader):
+    writer, reader = writer_and_reader
+    sku = writer.add_sku('A product')
+    with pytest.raises(ReadOnlyDatabase):
+        reader.add_sku('Another product')
+    with pytest.raises(sqlite3.OperationalError):  # Even bypassing _write
+        reader._cur.execute("DELETE FROM product")
+    assert not reader.missing_skus([sku])
+
+def test_read_snapshot_isolated_from_writer(writer_and_reader):
+    writer, reader = writer_and_reader
+    writer.set_inventory_level([StockPosition(sku=1, qty=5)])
+    with reader.read_snapshot():
+        qty_before = reader.get_inventory_level([1])[0].qty
+        # The writer is not held up by the open snapshot
+        writer.change_inventory('101', [StockChange(sku=1, qty=2)])
+        qty_in_snapshot = reader.get_inventory_level([1])[0].qty
+    qty_after = reader.get_inventory_level([1])[0].qty
+    assert (qty_before, qty_in_snapshot, qty_after) == (5, 5, 7)
+
+def test_reader_falls_back_to_archive(writer_and_reader):
+    writer, reader = writer_and_reader
+    writer.add_orders([
+        Order(order_type='sale', entity_id=1, lines=[
+            OrderLine(position=1, sku=1, qty_ordered=2, qty_delivered=2)
+        ]),
+        Order(order_type='sale', entity_id=1, lines=[
+            OrderLine(position=1, sku=1, qty_ordered=2, qty_delivered=0)
+        ]),
+    ])
+    closed_order = reader.get_order(1)
+    num_archived = writer.archive_orders(datetime.now() + timedelta(hours=1))
+    with pytest.raises(ReadOnlyDatabase):
+        reader.archive_orders(datetime.now())
+    assert (
+        (num_archived == 1)
+        and (reader._cur.execute("SELECT COUNT(*) FROM orders").fetchone()
+             == (1,))
+        and (reader.get_order(1) == closed_order)
+        and (Path('data') / 'test_read_only_db_archive.db').is_file()
+    )
+
+def test_archive_read_within_transaction_of_new_thread(writer_and_reader):
+    writer, _ = writer_and_reader
+    writer.add_orders([
+        Order(order_type='sale', entity_id=1, lines=[
+            OrderLine(position=1, sku=1, qty_ordered=2, qty_delivered=2)
+        ]),
+        Order(order_type='sale', entity_id=1, lines=[
+            OrderLine(position=1, sku=1, qty_ordered=2, qty_delivered=0)
+        ]),
+    ])
+    closed_order = writer.get_order(1)
+    num_archived = writer.archive_orders(datetime.now() + timedelta(hours=1))
+
+    def read_in_transaction() -> Order | None:
+        with writer.transaction():
+            return writer.get_order(1)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        archived_order = executor.submit(read_in_transaction).result()
+    assert (num_archived == 1) and (archived_order == closed_order)
+
+@pytest.mark.parametrize("db_name,kwargs", [
+    (':memory:', {}),
+    ('test_missing_db', {}),
+    ('test_read_only_db', {'inventory_cache_size': 10}),
+    ])
+def test_read_only_unavailable(db_name, kwargs):
+    with pytest.raises(SBB_Exception):
+        db_admin.SBB_DBAdmin(db_name, read_only=True, **kwargs)
+    assert not (Path('data') / (db_name + '.db')).exists()
 
 ##############################
 ####### Entities & SKU #######
@@ -117,6 +397,70 @@ def test_is_sku_with_notexisting_sku(dummy_db):
     sku = dummy_db.add_sku(product_desc)
     assert not dummy_db.is_sku(sku + 1)
 
+def test_missing_skus(dummy_db):
+    skus = [dummy_db.add_sku(f'product {i}') for i in range(3)]
+    assert dummy_db.missing_skus(skus + [skus[-1] + 1]) == {skus[-1] + 1}
+
+def test_missing_entities(dummy_db):
+    entity_id = dummy_db.add_external_entity('entity name', 'type_of_entity')
+    assert dummy_db.missing_entities([entity_id, entity_id + 1]) == {entity_id + 1}
+
+def test_add_skus_and_entities_in_bulk(cached_db):
+    first_sku = cached_db.add_sku('product 0')
+    skus = cached_db.add_skus([f'product {i}' for i in range(1, 4)])
+    entity_ids = cached_db.add_external_entities(['A', 'B'], 'supplier')
+    assert (
+        (skus == [first_sku + 1, first_sku + 2, first_sku + 3])
+        and (entity_ids == [1, 2])
+        and (cached_db.missing_skus(skus) == set())
+        and (cached_db.missing_entities(entity_ids) == set())
+        and (list(cached_db.iter_rows('skus', chunk_size=2))[-1]
+             == (skus[-1], 'product 3'))
+    )
+
+def test_existence_cache_avoids_queries(cached_db):
+    skus = [cached_db.add_sku(f'product {i}') for i in range(3)]
+    entity_id = cached_db.add_external_entity('entity name', 'type_of_entity')
+    queries = []
+    cached_db._con.set_trace_callback(queries.append)
+    all_known = (
+        not cached_db.missing_skus(skus)
+        and cached_db.is_entity(entity_id)
+    )
+    cached_db._con.set_trace_callback(None)
+    assert all_known and (queries == [])
+
+def test_existence_cache_picks_up_external_inserts(cached_db):
+    cached_db._cur.execute("INSERT INTO product (desc) VALUES ('outside');")
+    sku = cached_db._cur.lastrowid
+    assert cached_db.is_sku(sku) and (sku in cached_db._known_skus)
+
+def test_existence_cache_rolled_back_per_savepoint(cached_db):
+    kept_sku = cached_db.add_sku('kept')
+    queries = []
+    cached_db._con.set_trace_callback(queries.append)
+    with cached_db.transaction():
+        outer_sku = cached_db.add_sku('outer')
+        with pytest.raises(ZeroDivisionError):
+            with cached_db.transaction():
+                inner_sku = cached_db.add_sku('inner')
+                inner_entity = cached_db.add_external_entity('A', 'supplier')
+                1 / 0
+        known_after_savepoint = set(cached_db._known_skus)
+    with pytest.raises(ZeroDivisionError):
+        with cached_db.transaction():
+            with cached_db.transaction():
+                released_sku = cached_db.add_sku('released')
+            1 / 0
+    cached_db._con.set_trace_callback(None)
+    assert (
+        (known_after_savepoint == {kept_sku, outer_sku})
+        and (cached_db._known_skus == {kept_sku, outer_sku})
+        and (inner_entity not in cached_db._known_entities)
+        and (released_sku not in cached_db._known_skus)
+        and not any('FROM product' in query for query in queries)
+    )
+
 
 ##############################
 ########### Orders ###########
@@ -199,6 +543,40 @@ def test_add_order_lines(dummy_db):
     )
 
 
+def test_add_orders(dummy_db):
+    orders_in = [
+        Order(order_type='some_order_type', entity_id=123, lines=[
+            OrderLine(position=1, sku=111, qty_ordered=1, qty_delivered=0),
+            OrderLine(position=2, sku=222, qty_ordered=4, qty_delivered=0)
+        ]),
+        Order(order_type='other_order_type', entity_id=456, lines=[
+            OrderLine(position=1, sku=333, qty_ordered=9, qty_delivered=0)
+        ])
+    ]
+    order_ids = dummy_db.add_orders(orders_in)
+
+    num_lines = (
+        dummy_db
+        ._cur
+        .execute("SELECT COUNT(*) FROM order_line;")
+        .fetchone()
+        [0]
+    )
+    lines_second_order = (
+        dummy_db
+        ._cur
+        .execute("SELECT sku FROM order_line WHERE order_id = ?;",
+                 [order_ids[1]])
+        .fetchall()
+    )
+
+    assert (
+        (order_ids == [1, 2])
+        and (num_lines == 3)
+        and (lines_second_order == [(333,)])
+    )
+
+
 def test_get_order(dummy_db):
     order_in = Order(order_type='some_order_type', entity_id=123)
     order_no = dummy_db.add_order(order_in)
@@ -229,6 +607,168 @@ def test_get_order(dummy_db):
     assert expected_order == order_fetched
 
 
+@pytest.fixture
+def db_with_orders(dummy_db):
+    dummy_db.add_orders([
+        Order(order_type='purchase', entity_id=1, lines=[
+            OrderLine(position=1, sku=111, qty_ordered=1, qty_delivered=1),
+            OrderLine(position=2, sku=222, qty_ordered=4, qty_delivered=4)
+        ]),
+        Order(order_type='sale', entity_id=2, lines=[
+            OrderLine(position=1, sku=111, qty_ordered=2, qty_delivered=0)
+        ]),
+        Order(order_type='purchase', entity_id=1, lines=[
+            OrderLine(position=1, sku=333, qty_ordered=9, qty_delivered=3),
+            OrderLine(position=2, sku=111, qty_ordered=5, qty_delivered=0)
+        ]),
+        Order(order_type='sale', entity_id=3),
+    ])
+    yield dummy_db
+
+
+def test_get_order_only_fetches_own_lines(db_with_orders):
+    the_order = db_with_orders.get_order(3)
+    assert (
+        [(ol.position, ol.sku) for ol in the_order.lines]
+        == [(1, 333), (2, 111)]
+    )
+
+def test_get_order_without_lines(db_with_orders):
+    assert db_with_orders.get_order(4) == Order(id=4, order_type='sale',
+                                                 entity_id=3)
+
+def test_get_order_not_existing(db_with_orders):
+    assert db_with_orders.get_order(5) is None
+
+def test_get_orders(db_with_orders):
+    orders = db_with_orders.get_orders([3, 5, 1])
+    assert (
+        ([the_order.id for the_order in orders] == [3, 1])
+        and all([
+            the_order == db_with_orders.get_order(the_order.id)
+            for the_order in orders
+        ])
+    )
+
+@pytest.mark.parametrize("filters,expected_ids", [
+    ({}, [1, 2, 3, 4]),
+    ({'order_type': 'purchase'}, [1, 3]),
+    ({'entity_id': 2}, [2]),
+    ({'open_only': True}, [2, 3]),
+    ({'order_type': 'purchase', 'open_only': True}, [3]),
+    ])
+def test_iter_orders(db_with_orders, filters, expected_ids):
+    orders = list(db_with_orders.iter_orders(chunk_size=1, **filters))
+    assert (
+        ([the_order.id for the_order in orders] == expected_ids)
+        and all([
+            the_order == db_with_orders.get_order(the_order.id)
+            for the_order in orders
+        ])
+    )
+
+def test_domain_objects_are_slotted():
+    assert not hasattr(OrderLine(), '__dict__')
+    with pytest.raises(AttributeError):
+        StockPosition().unknown_attribute = 1
+
+@pytest.mark.parametrize("filters,expected_rows", [
+    ({}, [(1, 1, 111, 1, 1), (1, 2, 222, 4, 4), (2, 1, 111, 2, 0),
+          (3, 1, 333, 9, 3), (3, 2, 111, 5, 0)]),
+    ({'order_ids': [3, 5, 2]}, [(2, 1, 111, 2, 0), (3, 1, 333, 9, 3),
+                                (3, 2, 111, 5, 0)]),
+    ({'order_type': 'purchase', 'open_only': True}, [(3, 1, 333, 9, 3),
+                                                     (3, 2, 111, 5, 0)]),
+    ])
+def test_get_order_batch(db_with_orders, filters, expected_rows):
+    batch = db_with_orders.get_order_batch(**filters)
+    assert (len(batch) == len(expected_rows)
+            and list(batch.rows()) == expected_rows)
+
+def all_pages(list_method, **filters) -> tuple[list, int]:
+    # Items of every page, and the number of pages
+    items, num_pages, after = [], 0, None
+    while True:
+        page = list_method(after=after, **filters)
+        items.extend(page.items)
+        num_pages += 1
+        if page.next_cursor is None:
+            return items, num_pages
+        after = page.next_cursor
+
+@pytest.mark.parametrize("filters", [
+    {}, {'order_type': 'purchase'}, {'entity_id': 2}, {'open_only': True},
+    ])
+def test_list_orders_pages(db_with_orders, filters):
+    orders, num_pages = all_pages(db_with_orders.list_orders, limit=1,
+                                  **filters)
+    assert (
+        (orders == list(db_with_orders.iter_orders(**filters)))
+        and (num_pages == len(orders))
+    )
+
+def test_list_order_lines(db_with_orders):
+    first_page = db_with_orders.list_order_lines(sku=111, limit=2)
+    lines, num_pages = all_pages(db_with_orders.list_order_lines, sku=111,
+                                 limit=2)
+    open_lines, _ = all_pages(db_with_orders.list_order_lines,
+                              open_only=True)
+    assert (
+        ([(ol.id, ol.order_id, ol.position) for ol in lines]
+         == [(1, 1, 1), (3, 2, 1), (5, 3, 2)])
+        and (first_page.next_cursor == 3) and (num_pages == 2)
+        and ([ol.id for ol in open_lines] == [3, 4, 5])
+    )
+
+def test_list_order_lines_seeks_by_key(db_with_orders):
+    queries = []
+    db_with_orders._con.set_trace_callback(queries.append)
+    db_with_orders.list_order_lines(sku=111, after=3, limit=2)
+    db_with_orders._con.set_trace_callback(None)
+    plan = ' '.join(
+        row[3] for row in db_with_orders._cur.execute(
+            'EXPLAIN QUERY PLAN ' + queries[-1]
+        )
+    )
+    assert ('idx_order_line_sku' in plan) and ('TEMP B-TREE' not in plan)
+
+def test_list_skus_inventory_entities(dummy_db):
+    skus = dummy_db.add_skus(['Blue pen', 'Red pen', 'Eraser'])
+    dummy_db.add_external_entities(['A', 'B', 'C'], 'customer')
+    dummy_db.add_external_entity('D', 'supplier')
+    dummy_db.set_inventory_level([StockPosition(sku=skus[2], qty=0),
+                                  StockPosition(sku=skus[0], qty=4)])
+    pens, _ = all_pages(dummy_db.list_skus, desc_contains='pen', limit=1)
+    customers, num_pages = all_pages(dummy_db.list_entities,
+                                     entity_type='customer', limit=2)
+    assert (
+        (pens == [Product(skus[0], 'Blue pen'), Product(skus[1], 'Red pen')])
+        and ([entity.name for entity in customers] == ['A', 'B', 'C'])
+        and (num_pages == 2)
+        and ([(stk.sku, stk.qty) for stk in dummy_db.list_inventory().items]
+             == [(skus[0], 4), (skus[2], 0)])
+        and (dummy_db.list_inventory(in_stock_only=True).items
+             == [StockPosition(2, skus[0], 4)])
+        and (dummy_db.list_entities(after=4).items == [])
+    )
+
+def test_add_order_batch_and_set_order_lines(db_with_orders):
+    batch = OrderBatch()
+    batch.append(4, 1, 222, 6, 0)
+    batch.append(4, 2, 333, 1, 0)
+    assert db_with_orders.add_order_batch(batch) == 2
+
+    deltas = OrderBatch()
+    deltas.append(4, 1, 0, 0, 2)
+    deltas.append(3, 1, 0, 0, 6)
+    db_with_orders.set_order_lines('delivered_qty_delta', deltas)
+    assert (
+        [(ol.position, ol.qty_delivered)
+         for ol in db_with_orders.get_order(4).lines] == [(1, 2), (2, 0)]
+        and db_with_orders.get_order(3).lines[0].qty_delivered == 9
+    )
+
+
 def test_set_inventory_level(dummy_db):
     # The change
     create_stock_positions = [
@@ -306,6 +846,54 @@ def test_get_inventory_level(dummy_db):
     ])
 
 
+@pytest.fixture
+def inv_cached_db():
+    new_db = db_admin.SBB_DBAdmin(':memory:', inventory_cache_size=5)
+    new_db.set_inventory_level([
+        StockPosition(sku=i, qty=i*i)
+        for i in range(1, 11)
+    ])
+    yield new_db
+    new_db.close_connection()
+
+
+def test_inventory_cache_hits_and_misses(inv_cached_db):
+    first_read = inv_cached_db.get_inventory_level([1, 2, 3])
+    queries = []
+    inv_cached_db._con.set_trace_callback(queries.append)
+    second_read = inv_cached_db.get_inventory_level([3, 2, 1])
+    inv_cached_db._con.set_trace_callback(None)
+    stats = inv_cached_db.inventory_cache_stats()
+    assert (
+        (first_read == second_read[::-1])
+        and (queries == [])
+        and (stats['hits'] == 3) and (stats['misses'] == 3)
+    )
+
+def test_inventory_cache_write_through(inv_cached_db):
+    inv_cached_db.warm_inventory_cache([4, 11])
+    inv_cached_db.update_inventory_level([StockChange(position=4, qty=99)])
+    inv_cached_db.set_inventory_level([StockPosition(sku=11, qty=7)])
+    levels = inv_cached_db.get_inventory_level([4, 11])
+    assert [(pos.sku, pos.qty) for pos in levels] == [(4, 99), (11, 7)]
+
+def test_inventory_cache_eviction(inv_cached_db):
+    inv_cached_db.warm_inventory_cache()
+    inv_cached_db.get_inventory_level(list(range(1, 11)))
+    stats = inv_cached_db.inventory_cache_stats()
+    assert (stats['size'] == 5) and (stats['evictions'] == 5)
+
+def test_inventory_cache_cleared_on_rollback(inv_cached_db):
+    inv_cached_db.warm_inventory_cache([1])
+    with pytest.raises(ZeroDivisionError):
+        with inv_cached_db.transaction():
+            inv_cached_db.update_inventory_level([
+                StockChange(position=1, qty=50)
+            ])
+            1 / 0
+    assert inv_cached_db.get_inventory_level([1])[0].qty == 1
+
+
 def test_change_inventory_101(dummy_db):
     # Setup
     create_stock_positions = [
@@ -338,3 +926,426 @@ def test_change_inventory_101(dummy_db):
         for i in range(5)
     ])
 
+
+def test_inventory_frame(dummy_db):
+    dummy_db.set_inventory_level([StockPosition(sku=i, qty=i) for i in [3, 1, 2]])
+    frame = dummy_db.get_inventory_frame()
+    assert list(frame.sku) == [1, 2, 3] and list(frame.qty) == [1, 2, 3]
+
+    changes = InventoryFrame()
+    changes.append(0, 2, 1)
+    changes.append(0, 2, 0.5)
+    changes.append(0, 3, 3)
+    assert dummy_db.change_inventory('201', changes)
+    frame = dummy_db.get_inventory_frame([3, 2, 9])
+    assert dict(zip(frame.sku, frame.qty)) == {2: 0.5, 3: 0}
+
+def test_change_inventory_101_merges_duplicate_skus(inv_cached_db):
+    inv_cached_db.warm_inventory_cache([2, 12])
+    data = [
+        StockChange(sku=2, qty=1),
+        StockChange(sku=12, qty=5),
+        StockChange(sku=2, qty=3),
+        StockChange(sku=12, qty=1)
+    ]
+    success = inv_cached_db.change_inventory('101', data)
+
+    num_positions = (
+        inv_cached_db
+        ._cur
+        .execute("SELECT COUNT(*) FROM inventory WHERE sku IN (2, 12);")
+        .fetchone()
+        [0]
+    )
+    new_inv = inv_cached_db.get_inventory_level([2, 12])
+    assert (
+        success
+        and (num_positions == 2)
+        and [(pos.sku, pos.qty) for pos in new_inv] == [(2, 8), (12, 6)]
+    )
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(db_admin, 'time', SimpleNamespace(time=lambda: now[0]))
+    yield now
+
+
+def test_change_inventory_201_never_below_zero(dummy_db):
+    dummy_db.set_inventory_level([StockPosition(sku=1, qty=5),
+                                  StockPosition(sku=2, qty=1)])
+    with pytest.raises(NotEnoughStock) as error:
+        dummy_db.change_inventory('201', [StockChange(sku=1, qty=2),
+                                          StockChange(sku=2, qty=2),
+                                          StockChange(sku=3, qty=1)])
+    num_movements = dummy_db._cur.execute(
+        "SELECT COUNT(*) FROM stock_movement WHERE movement_code = '201'"
+    ).fetchone()[0]
+    assert (
+        ((error.value.sku, error.value.qty_avail) == (2, 1))
+        and ([stk.qty for stk in dummy_db.get_inventory_level([1, 2])]
+             == [5, 1])
+        and (num_movements == 0)
+    )
+
+def test_inventory_changes_recorded_as_movements(dummy_db):
+    dummy_db.set_inventory_level([StockPosition(sku=1, qty=10)])
+    dummy_db.change_inventory('101', [StockChange(sku=1, qty=5),
+                                      StockChange(sku=2, qty=3)])
+    dummy_db.change_inventory('201', [StockChange(sku=1, qty=4)])
+    dummy_db.update_inventory_level([StockChange(position=1, qty=20)])
+    movements = dummy_db._cur.execute("""
+        SELECT movement_code, sku, qty FROM stock_movement ORDER BY id
+        """).fetchall()
+    assert movements == [
+        ('561', 1, 10), ('101', 1, 5), ('101', 2, 3), ('201', 1, -4),
+        ('711', 1, 9)
+    ]
+
+def test_repeated_position_update_recorded_once(dummy_db, clock):
+    dummy_db.set_inventory_level([StockPosition(sku=1, qty=5)])
+    clock[0] += 10
+    dummy_db.update_inventory_level([StockChange(position=1, qty=10),
+                                     StockChange(position=1, qty=20)])
+    assert (
+        (dummy_db.get_inventory_level([1])[0].qty == 20)
+        and ([(stk.sku, stk.qty)
+              for stk in dummy_db.get_inventory_at([1], clock[0])]
+             == [(1, 20)])
+    )
+
+def test_aggregates_follow_every_write_path(db_with_orders):
+    db = db_with_orders
+    db.set_inventory_level([StockPosition(sku=111, qty=5)])
+    db.change_inventory('101', [StockChange(sku=111, qty=2),
+                                StockChange(sku=222, qty=4)])
+    db.change_inventory('201', [StockChange(sku=111, qty=1)])
+    position = db.get_inventory_level([222])[0].position
+    db.update_inventory_level([StockChange(position=position, qty=1)])
+    db.add_order_lines([OrderLine(order_id=4, position=1, sku=222,
+                                  qty_ordered=6, qty_delivered=0)])
+    db.set_order_lines('delivered_qty_delta', [
+        OrderLine(order_id=2, position=1, qty_delivered=1),
+        OrderLine(order_id=3, position=1, qty_delivered=6),
+    ])
+    db.set_order_lines('delivered_qty', [
+        OrderLine(order_id=4, position=1, qty_delivered=2),
+    ])
+    aggregates = [
+        (agg.sku, agg.on_hand, agg.open_po_qty, agg.open_so_qty)
+        for agg in db.get_sku_aggregates([111, 222, 333, 444])
+    ]
+    assert (
+        (db.get_total_on_hand() == 7)
+        and (aggregates == [(111, 6, 5, 1), (222, 1, 0, 4), (333, 0, 0, 0),
+                            (444, 0, 0, 0)])
+        and (db.get_open_order_qty([1, 2, 3], 'sale') == {1: 0, 2: 1, 3: 4})
+        and (db.get_open_order_qty([1], 'purchase') == {1: 5})
+    )
+
+def test_archive_orders(clock, db_with_orders):
+    db = db_with_orders
+    db.add_orders([
+        Order(order_type='sale', entity_id=2, lines=[
+            OrderLine(position=1, sku=111, qty_ordered=3, qty_delivered=3)
+        ]),
+        Order(order_type='sale', entity_id=3, lines=[
+            OrderLine(position=1, sku=222, qty_ordered=1, qty_delivered=0)
+        ]),
+        Order(order_type='sale', entity_id=3),
+    ])
+    closed_orders = db.get_orders([1, 5])
+    aggregates = db.get_sku_aggregates([111, 222, 333])
+    nothing_old_enough = db.archive_orders(clock[0])
+    clock[0] += 10
+    num_archived = db.archive_orders(clock[0], chunk_size=1)
+    new_order_id = db.add_orders([Order(order_type='sale', entity_id=2)])[0]
+    assert (
+        (nothing_old_enough == 0) and (num_archived == 2)
+        and ([the_order.id for the_order in db.list_orders().items]
+             == [2, 3, 4, 6, 7, 8])
+        and (db.get_orders([5, 2, 1]) == [closed_orders[1], db.get_order(2),
+                                          closed_orders[0]])
+        and (db.get_order(1) == closed_orders[0])
+        and (db.get_sku_aggregates([111, 222, 333]) == aggregates)
+        and (db.archive_orders(clock[0]) == 0)
+        and (new_order_id == 8)
+    )
+
+def test_archive_orders_after_copy_without_delete(clock, db_with_orders):
+    # As after a crash between the archive commit and the delete from main
+    db = db_with_orders
+    closed_order = db.get_order(1)
+    db._attach_archive(create=True)
+    with db.transaction():
+        db._copy_to_archive([1])
+    copy_read_first = db.get_order(1) == closed_order
+    clock[0] += 10
+    num_archived = db.archive_orders(clock[0])
+    assert (
+        copy_read_first and (num_archived == 1)
+        and (db._cur.execute("SELECT COUNT(*) FROM main.orders WHERE id = 1")
+             .fetchone() == (0,))
+        and (db.get_order(1) == closed_order)
+        and (db._cur.execute(
+            "SELECT COUNT(*) FROM archive.order_line WHERE order_id = 1"
+        ).fetchone() == (2,))
+    )
+
+def test_archived_copy_changed_since_is_not_deleted(db_with_orders):
+    db = db_with_orders
+    db._attach_archive(create=True)
+    with db.transaction():
+        db._copy_to_archive([1])
+    db.add_order_lines([OrderLine(order_id=1, position=3, sku=111,
+                                  qty_ordered=1, qty_delivered=1)])
+    assert (db._delete_archived([1]) == 0) and (len(db.get_order(1).lines) == 3)
+
+def test_archive_orders_not_within_transaction(db_with_orders):
+    with pytest.raises(SBB_Exception), db_with_orders.transaction():
+        db_with_orders.archive_orders(datetime.now())
+
+def test_rebuild_aggregates(db_with_orders):
+    db_with_orders.change_inventory('101', [StockChange(sku=111, qty=3)])
+    expected = (db_with_orders.get_total_on_hand(),
+                db_with_orders.get_sku_aggregates([111, 222, 333]),
+                db_with_orders.get_open_order_qty([1, 2], 'purchase'))
+    db_with_orders._cur.execute("UPDATE sku_aggregate SET open_po_qty = 99")
+    db_with_orders._cur.execute("DELETE FROM stock_total")
+    db_with_orders._con.commit()
+    db_with_orders.rebuild_aggregates()
+    assert expected == (db_with_orders.get_total_on_hand(),
+                        db_with_orders.get_sku_aggregates([111, 222, 333]),
+                        db_with_orders.get_open_order_qty([1, 2], 'purchase'))
+
+def test_reservations_and_available_to_promise(db_with_orders, clock):
+    db = db_with_orders
+    db.set_inventory_level([StockPosition(sku=111, qty=10),
+                            StockPosition(sku=222, qty=1)])
+    db.reserve_order_lines([OrderLine(order_id=2, position=1, sku=111,
+                                      qty_ordered=2, qty_delivered=0)],
+                           clock[0] + 60)
+    db.reserve_order_lines([OrderLine(order_id=4, position=1, sku=111,
+                                      qty_ordered=5, qty_delivered=0)],
+                           clock[0] + 30)
+    with pytest.raises(NotEnoughStock):  # Rolled back: nothing reserved
+        db.reserve_order_lines([
+            OrderLine(order_id=4, position=2, sku=111, qty_ordered=1,
+                      qty_delivered=0),
+            OrderLine(order_id=4, position=3, sku=222, qty_ordered=2,
+                      qty_delivered=0),
+        ], clock[0] + 30)
+    atp_reserved = db.get_available_to_promise([111, 222, 333])
+
+    db.consume_reservations([OrderLine(order_id=2, position=1,
+                                       qty_delivered=1)])
+    clock[0] += 30
+    atp_after_expiry = db.get_available_to_promise([111])
+    assert (
+        (atp_reserved == {111: 3, 222: 1, 333: 0})
+        and (atp_after_expiry == {111: 9})
+        and (db.get_reserved_qty([2, 4]) == {2: {111: 1}})
+    )
+
+def test_release_expired_reservations_uses_heap(db_with_orders, clock):
+    db = db_with_orders
+    db.set_inventory_level([StockPosition(sku=111, qty=10)])
+    db.reserve_order_lines([OrderLine(order_id=2, position=1, sku=111,
+                                      qty_ordered=2, qty_delivered=0)],
+                           clock[0] + 60)
+    queries = []
+    db._con.set_trace_callback(queries.append)
+    nothing_due = db.release_expired_reservations()
+    db._con.set_trace_callback(None)
+    clock[0] += 60
+    assert (
+        (nothing_due == 0) and (queries == [])
+        and (db.release_expired_reservations() == 1)
+        and (db.get_available_to_promise([111]) == {111: 10})
+    )
+
+def test_reservations_protect_stock_from_other_orders(db_with_orders, clock):
+    db = db_with_orders
+    db.set_inventory_level([StockPosition(sku=111, qty=3)])
+    db.reserve_order_lines([OrderLine(order_id=2, position=1, sku=111,
+                                      qty_ordered=2, qty_delivered=0)],
+                           clock[0] + 60)
+    with pytest.raises(NotEnoughStock):
+        db.change_inventory('201', [StockChange(sku=111, qty=2)])
+    assert (db.cancel_reservations([2]) == 1) and db.change_inventory(
+        '201', [StockChange(sku=111, qty=2)]
+    )
+
+@pytest.fixture
+def db_with_expired_reservation(db_with_orders, clock):
+    # All the stock of SKU 111 reserved by order 2, then the reservation expires
+    db_with_orders.set_inventory_level([StockPosition(sku=111, qty=10)])
+    db_with_orders.reserve_order_lines([
+        OrderLine(order_id=2, position=1, sku=111, qty_ordered=10,
+                  qty_delivered=0)
+    ], clock[0] + 1)
+    clock[0] += 1
+    yield db_with_orders
+
+def test_expired_reservation_released_before_decrement(
+        db_with_expired_reservation):
+    db = db_with_expired_reservation
+    assert (
+        db.change_inventory('201', [StockChange(sku=111, qty=10)])
+        and (db.get_inventory_level([111])[0].qty == 0)
+        and (db.get_reserved_qty([2]) == {})
+    )
+
+def test_expired_reservation_released_before_reserving(
+        db_with_expired_reservation):
+    db = db_with_expired_reservation
+    num_reserved = db.reserve_order_lines([
+        OrderLine(order_id=4, position=1, sku=111, qty_ordered=10,
+                  qty_delivered=0)
+    ], db_admin.time.time() + 60)
+    assert (
+        (num_reserved == 1)
+        and (db.get_reserved_qty([2, 4]) == {4: {111: 10}})
+        and (db.get_available_to_promise([111]) == {111: 0})
+    )
+
+@pytest.fixture
+def two_instances(clock):
+    db_name = 'test_reservation_db'
+    first_db = db_admin.SBB_DBAdmin(db_name)
+    second_db = db_admin.SBB_DBAdmin(db_name)
+    yield first_db, second_db
+    first_db.close_connection()
+    second_db.close_connection()
+    for suffix in ['.db', '.db-wal', '.db-shm']:
+        (Path('data') / (db_name + suffix)).unlink(missing_ok=True)
+
+def test_reservations_of_another_instance_expire(two_instances, clock):
+    first_db, second_db = two_instances
+    first_db.set_inventory_level([StockPosition(sku=1, qty=10),
+                                  StockPosition(sku=2, qty=10)])
+    first_db.reserve_order_lines([OrderLine(order_id=1, position=1, sku=2,
+                                            qty_ordered=1, qty_delivered=0)],
+                                 clock[0] + 3600)  # Not due: heap not empty
+    second_db.reserve_order_lines([OrderLine(order_id=2, position=1, sku=1,
+                                             qty_ordered=10, qty_delivered=0)],
+                                  clock[0] + 0.2)
+    clock[0] += 0.2
+    # Writes always delete expired reservations
+    decremented = first_db.change_inventory('201', [StockChange(sku=1, qty=4)])
+
+    second_db.reserve_order_lines([OrderLine(order_id=3, position=1, sku=1,
+                                             qty_ordered=6, qty_delivered=0)],
+                                  clock[0] + 0.2)
+    clock[0] += 0.2
+    atp_before_refresh = first_db.get_available_to_promise([1])
+    clock[0] += db_admin.SBB_DBAdmin.RESERVATION_REFRESH_INTERVAL
+    atp_after_refresh = first_db.get_available_to_promise([1])
+    assert (
+        decremented
+        and (atp_before_refresh == {1: 0})
+        and (atp_after_refresh == {1: 6})
+    )
+
+def test_reservations_of_another_instance_seen_by_empty_heap(two_instances,
+                                                            clock):
+    first_db, second_db = two_instances
+    first_db.set_inventory_level([StockPosition(sku=1, qty=10)])
+    second_db.reserve_order_lines([OrderLine(order_id=1, position=1, sku=1,
+                                             qty_ordered=10, qty_delivered=0)],
+                                  clock[0] + 0.2)
+    second_db.close_connection()
+    clock[0] += 0.2
+    assert first_db.get_available_to_promise([1]) == {1: 10}
+
+def test_get_inventory_at(dummy_db, clock):
+    dummy_db.set_inventory_level([StockPosition(sku=1, qty=10)])
+    clock[0] += 100
+    dummy_db.change_inventory('101', [StockChange(sku=1, qty=5)])
+    snapshot_time = clock[0] = clock[0] + 100
+    dummy_db.take_stock_snapshot()
+    clock[0] += 100
+    dummy_db.change_inventory('201', [StockChange(sku=1, qty=12)])
+    dummy_db.change_inventory('101', [StockChange(sku=2, qty=1)])
+
+    def qty_at(at: float) -> list[tuple]:
+        return [
+            (stk.sku, stk.qty) for stk in dummy_db.get_inventory_at([1, 2], at)
+        ]
+
+    assert (
+        (qty_at(1_000_000.0 + 50) == [(1, 10)])
+        and (qty_at(snapshot_time) == [(1, 15)])
+        and (qty_at(clock[0]) == [(1, 3), (2, 1)])
+    )
+
+def test_automatic_stock_snapshot():
+    new_db = db_admin.SBB_DBAdmin(':memory:', snapshot_interval=3)
+    for sku in range(1, 5):
+        new_db.change_inventory('101', [StockChange(sku=sku, qty=sku)])
+    snapshots = new_db._cur.execute("""
+        SELECT last_movement_id, COUNT(sku) FROM stock_snapshot
+        LEFT JOIN stock_snapshot_line ON snapshot_id = id
+        GROUP BY id ORDER BY id
+        """).fetchall()
+    new_db.close_connection()
+    assert snapshots == [(0, 0), (3, 3)]
+
+def test_stock_snapshot_holds_moved_skus_only(dummy_db, clock):
+    dummy_db.set_inventory_level([
+        StockPosition(sku=sku, qty=10 * sku) for sku in range(1, 4)
+    ])
+    clock[0] += 100
+    dummy_db.take_stock_snapshot()
+    dummy_db.change_inventory('101', [StockChange(sku=2, qty=5)])
+    clock[0] += 100
+    last_snapshot_id = dummy_db.take_stock_snapshot()
+    clock[0] += 100
+    dummy_db.change_inventory('101', [StockChange(sku=3, qty=1)])
+
+    num_lines = dummy_db._cur.execute("""
+        SELECT COUNT(*) FROM stock_snapshot_line WHERE snapshot_id = ?
+        """, [last_snapshot_id]).fetchone()[0]
+    qtys = [
+        (stk.sku, stk.qty)
+        for stk in dummy_db.get_inventory_at([1, 2, 3], clock[0] - 50)
+    ]
+    assert (num_lines == 1) and (qtys == [(1, 10), (2, 25), (3, 30)])
+
+
+def test_instrumentation_counts_calls_queries_and_rows(dummy_db):
+    instrumentation = dummy_db.enable_instrumentation()
+    skus = [dummy_db.add_sku(f'product {i}') for i in range(3)]
+    dummy_db.missing_skus(skus)
+    dummy_db.change_inventory('101', [StockChange(sku=sku, qty=1)
+                                      for sku in skus])
+    stats = instrumentation.snapshot()
+    assert (
+        (stats['add_sku']['calls'] == 3)
+        and (stats['add_sku']['rows_changed'] == 3)
+        and (stats['missing_skus']['queries'] == 1)
+        # Inventory + movements + aggregates maintained by triggers
+        and (stats['change_inventory']['rows_changed'] == 12)
+        and (sum(stats['missing_skus']['latency_buckets'].values()) == 1)
+    )
+
+def test_instrumentation_prometheus_format(dummy_db):
+    instrumentation = dummy_db.enable_instrumentation()
+    dummy_db.get_inventory_level([1])
+    text = instrumentation.to_prometheus()
+    assert (
+        ('sbb_db_calls_total{method="get_inventory_level"} 1' in text)
+        and ('sbb_db_latency_seconds_bucket{method="get_inventory_level",'
+             'le="+Inf"} 1' in text)
+        and ('# TYPE sbb_db_latency_seconds histogram' in text)
+    )
+
+def test_disable_instrumentation(dummy_db):
+    instrumentation = dummy_db.enable_instrumentation()
+    dummy_db.disable_instrumentation()
+    dummy_db.add_sku('product')
+    assert (
+        (instrumentation.snapshot() == {})
+        and ('add_sku' not in vars(dummy_db))
+    )
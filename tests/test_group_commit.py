@@ -0,0 +1,75 @@
+""" test_group_commit.py
+Tests the group-commit writer
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from sbb.exceptions import SBB_Exception, SKUDoesntExist
+from sbb.group_commit import GroupCommitWriter
+from sbb.sbb import StockBackbone
+
+
+@pytest.fixture
+def sbb_with_catalog():
+    sbb_object = StockBackbone(':memory:')
+    customer_id = sbb_object.create_customer('A customer')
+    sku = sbb_object.create_sku('A product')
+    yield sbb_object, customer_id, sku
+    sbb_object._db.close_connection()
+
+
+def test_commands_committed_in_batches(sbb_with_catalog):
+    sbb_object, customer_id, sku = sbb_with_catalog
+    commits = 0
+    def count_commits(statement: str) -> None:
+        nonlocal commits
+        commits += statement == 'COMMIT'
+
+    # Submitted from several threads, while the writer is held up
+    with GroupCommitWriter(sbb_object, max_batch=10,
+                           max_delay_ms=1000) as writer:
+        with sbb_object.transaction():
+            sbb_object._db._con.set_trace_callback(count_commits)
+            with ThreadPoolExecutor(4) as callers:
+                futures = list(callers.map(
+                    lambda i: writer.make_SO(customer_id, [(sku, i + 1)]),
+                    range(50)
+                ))
+        so_ids = [future.result(timeout=5) for future in futures]
+    sbb_object._db._con.set_trace_callback(None)
+    assert (
+        (len(set(so_ids)) == 50)
+        and (commits == 1 + 5)  # Transaction of the test, then 5 batches
+        and ([ol.qty_ordered for ol in sbb_object.get_order(so_ids[9]).lines]
+             == [10])
+    )
+
+def test_batch_committed_after_delay(sbb_with_catalog):
+    sbb_object, customer_id, sku = sbb_with_catalog
+    with GroupCommitWriter(sbb_object, max_batch=100,
+                           max_delay_ms=10) as writer:
+        so_id = writer.make_SO(customer_id, [(sku, 1)]).result(timeout=5)
+        assert sbb_object.get_order(so_id).entity_id == customer_id
+
+def test_failed_command_only_affects_its_caller(sbb_with_catalog):
+    sbb_object, customer_id, sku = sbb_with_catalog
+    with GroupCommitWriter(sbb_object) as writer:
+        futures = [
+            writer.make_SO(customer_id, [(sku, 1)]),
+            writer.make_SO(customer_id, [(sku + 1, 1)]),
+            writer.make_SO(customer_id, [(sku, 2)]),
+        ]
+    assert (
+        isinstance(futures[0].result(), int)
+        and isinstance(futures[1].exception(), SKUDoesntExist)
+        and isinstance(futures[2].result(), int)
+    )
+
+def test_submit_after_close(sbb_with_catalog):
+    sbb_object, customer_id, sku = sbb_with_catalog
+    writer = GroupCommitWriter(sbb_object)
+    writer.close()
+    with pytest.raises(SBB_Exception):
+        writer.make_SO(customer_id, [(sku, 1)])
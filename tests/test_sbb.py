@@ -3,13 +3,17 @@ Tests StockBackbone and StockBackbone_Admin methods
 """
 
 import pytest
+from pathlib import Path
+from types import SimpleNamespace
 
+from sbb import db_admin
+from sbb import sbb as sbb_module
 from sbb.sbb import StockBackbone
 from sbb.exceptions import (
-    EntityDoesntExist, SKUDoesntExist, OrderQtyIncorrect,
-    NotEnoughStockToFullfillOrder
+    SBB_Exception, EntityDoesntExist, SKUDoesntExist, OrderDoesntExist,
+    OrderQtyIncorrect, NotEnoughStock, NotEnoughStockToFullfillOrder, ReadOnlyDatabase
 )
-from sbb.sbb_objects import StockPosition
+from sbb.sbb_objects import Order, OrderLine, StockPosition
 
 
 @pytest.fixture
@@ -34,6 +38,69 @@ def test_validate_text_input(field_type, test_input, expected_outcome):
     )
 
 
+def test_validate_text_input_length_and_type():
+    assert (
+        StockBackbone.validate_text_input('a' * 50, 'sku desc')
+        and not StockBackbone.validate_text_input('a' * 51, 'sku desc')
+        and not StockBackbone.validate_text_input('', 'sku desc')
+        and not StockBackbone.validate_text_input('name\n', 'db name')
+        and not StockBackbone.validate_text_input(123, 'sku desc')
+        and not StockBackbone.validate_text_input('a_name', 'unknown type')
+    )
+
+def test_create_skus(dummy_sbb):
+    result = dummy_sbb.create_skus(['Product A', 'Product %', 'Product B'])
+    assert (
+        (result.ids == [1, None, 2])
+        and (list(result.errors) == [1])
+        and dummy_sbb.is_sku(2) and not dummy_sbb.is_sku(3)
+    )
+
+def test_create_suppliers_and_customers(dummy_sbb):
+    suppliers = dummy_sbb.create_suppliers(['Supplier A', 'Supplier B'])
+    customers = dummy_sbb.create_customers(['', 'Customer A'])
+    entity_types = dict(dummy_sbb._db._cur.execute(
+        "SELECT id, entity_type FROM external_entity"
+    ))
+    assert (
+        (suppliers.ids == [1, 2]) and (suppliers.errors == {})
+        and (customers.ids == [None, 3]) and (list(customers.errors) == [0])
+        and (entity_types == {1: 'supplier', 2: 'supplier', 3: 'customer'})
+    )
+
+def test_create_orders(dummy_sbb):
+    supplier_id = dummy_sbb.create_supplier('A supplier')
+    sku = dummy_sbb.create_sku('A product')
+    def an_order(order_type='purchase', entity_id=supplier_id, sku=sku,
+                 qty_delivered=0):
+        return Order(order_type=order_type, entity_id=entity_id, lines=[
+            OrderLine(sku=sku, qty_ordered=5, qty_delivered=qty_delivered)
+        ])
+
+    result = dummy_sbb.create_orders([
+        an_order(qty_delivered=2),
+        an_order(order_type='return'),
+        an_order(entity_id=999),
+        an_order(sku=999),
+        an_order(qty_delivered=6),
+        an_order(),
+    ])
+    assert (
+        (result.ids == [1, None, None, None, None, 2])
+        and (list(result.errors) == [1, 2, 3, 4])
+        and (dummy_sbb.get_order(1).lines[0].qty_delivered == 2)
+    )
+
+def test_set_inventory_levels(dummy_sbb):
+    skus = dummy_sbb.create_skus(['Product A', 'Product B']).ids
+    dummy_sbb.set_inventory_levels({skus[0]: 5})
+    dummy_sbb.set_inventory_levels({skus[0]: 8, skus[1]: 3})
+    with pytest.raises(SKUDoesntExist):
+        dummy_sbb.set_inventory_levels({skus[1]: 4, 999: 1})
+    assert [
+        (stk.sku, stk.qty) for stk in dummy_sbb.get_inventory_level(skus)
+    ] == [(skus[0], 8), (skus[1], 3)]
+
 ##############################
 ######## Purch. orders #######
 ##############################
@@ -65,6 +132,36 @@ def test_make_PO_valid(dummy_sbb):
         ])
     assert isinstance(po_id, int)
 
+def test_make_POs_valid(dummy_sbb):
+    supplier_ids = [dummy_sbb.create_supplier(f'Supplier {i}') for i in range(2)]
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(3)]
+    po_ids = dummy_sbb.make_POs([
+        (supplier_ids[0], [(sku[0], 5), (sku[1], 1)]),
+        (supplier_ids[1], [(sku[2], 100)]),
+        ])
+    lines_per_order = (
+        dummy_sbb._db._cur
+        .execute("""
+                 SELECT order_id, COUNT(*) FROM order_line
+                 GROUP BY order_id ORDER BY order_id
+                 """)
+        .fetchall()
+    )
+    assert lines_per_order == [(po_ids[0], 2), (po_ids[1], 1)]
+
+def test_make_POs_invalid_sku_creates_nothing(dummy_sbb):
+    supplier_id = dummy_sbb.create_supplier('A supplier')
+    sku = dummy_sbb.create_sku('A product')
+    with pytest.raises(SKUDoesntExist):
+        dummy_sbb.make_POs([
+            (supplier_id, [(sku, 5)]),
+            (supplier_id, [(sku + 1, 1)]),
+            ])
+    num_orders = (
+        dummy_sbb._db._cur.execute("SELECT COUNT(*) FROM orders;").fetchone()[0]
+    )
+    assert num_orders == 0
+
 def test_receive_PO(dummy_sbb):
     supplier_id = dummy_sbb.create_supplier('A supplier')
     sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(3)]
@@ -84,6 +181,78 @@ def test_receive_PO(dummy_sbb):
         for i in range(len(lines_before))
         ])
 
+def test_receive_PO_only_updates_its_lines(dummy_sbb):
+    supplier_id = dummy_sbb.create_supplier('A supplier')
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(2)]
+    po_ids = dummy_sbb.make_POs([
+        (supplier_id, [(sku[0], 5), (sku[1], 1)]),
+        (supplier_id, [(sku[1], 7), (sku[0], 2)]),
+        ])
+
+    dummy_sbb.receive_PO('full-delivery', po_ids[1])
+    first_po, second_po = dummy_sbb.get_orders(po_ids)
+
+    assert (
+        all([ol.qty_delivered == 0 for ol in first_po.lines])
+        and all([ol.qty_delivered == ol.qty_ordered for ol in second_po.lines])
+    )
+
+def test_receive_PO_partial(dummy_sbb):
+    supplier_id = dummy_sbb.create_supplier('A supplier')
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(3)]
+    po_id = dummy_sbb.make_PO(supplier_id, [
+        (sku[0], 5),
+        (sku[1], 1),
+        (sku[2], 100)
+        ])
+
+    dummy_sbb.receive_PO('partial', po_id, {1: 2, 3: 40})
+    dummy_sbb.receive_PO('partial', po_id, {3: 10})
+    lines_after = dummy_sbb.get_order(po_id).lines
+    inv_level_after = dummy_sbb._db.get_inventory_level(sku)
+
+    assert (
+        ([ol.qty_delivered for ol in lines_after] == [2, 0, 50])
+        and ([(stk.sku, stk.qty) for stk in inv_level_after]
+             == [(sku[0], 2), (sku[2], 50)])
+    )
+
+def test_receive_PO_full_after_partial(dummy_sbb):
+    supplier_id = dummy_sbb.create_supplier('A supplier')
+    sku = dummy_sbb.create_sku('A product')
+    po_id = dummy_sbb.make_PO(supplier_id, [(sku, 5)])
+
+    dummy_sbb.receive_PO('partial', po_id, {1: 2})
+    dummy_sbb.receive_PO('full-delivery', po_id)
+    assert (
+        (dummy_sbb.get_order(po_id).lines[0].qty_delivered == 5)
+        and (dummy_sbb._db.get_inventory_level([sku])[0].qty == 5)
+    )
+
+@pytest.mark.parametrize("delivered_qtys", [{1: 6}, {2: 1}, {1: -1}, {1: 'b'}])
+def test_receive_PO_partial_invalid_qty(dummy_sbb, delivered_qtys):
+    supplier_id = dummy_sbb.create_supplier('A supplier')
+    sku = dummy_sbb.create_sku('A product')
+    po_id = dummy_sbb.make_PO(supplier_id, [(sku, 5)])
+    with pytest.raises(OrderQtyIncorrect):
+        dummy_sbb.receive_PO('partial', po_id, delivered_qtys)
+
+def test_transaction_rolls_back_PO(dummy_sbb):
+    supplier_id = dummy_sbb.create_supplier('A supplier')
+    sku = dummy_sbb.create_sku('A product')
+    with pytest.raises(SKUDoesntExist):
+        with dummy_sbb.transaction():
+            po_id = dummy_sbb.make_PO(supplier_id, [(sku, 5)])
+            dummy_sbb.receive_PO('full-delivery', po_id)
+            dummy_sbb.make_PO(supplier_id, [(sku + 1, 5)])
+    with pytest.raises(OrderDoesntExist):
+        dummy_sbb.get_order(po_id)
+    assert dummy_sbb._db.get_inventory_level([sku]) == []
+
+def test_get_order_not_existing(dummy_sbb):
+    with pytest.raises(OrderDoesntExist):
+        dummy_sbb.get_order(1)
+
 
 ##############################
 ########## Sale orders #######
@@ -117,6 +286,16 @@ def test_make_SO_valid(dummy_sbb):
     assert isinstance(so_id, int)
 
 
+def test_make_SOs_invalid_customer_id(dummy_sbb):
+    customer_id = dummy_sbb.create_customer('A customer')
+    sku = dummy_sbb.create_sku('A product')
+    with pytest.raises(EntityDoesntExist):
+        dummy_sbb.make_SOs([
+            (customer_id, [(sku, 5)]),
+            (666, [(sku, 1)]),
+            ])
+
+
 def test_issue_SO_stock_unavailable(dummy_sbb):
     customer_id = dummy_sbb.create_customer('A customer')
     sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(3)]
@@ -132,6 +311,36 @@ def test_issue_SO_stock_unavailable(dummy_sbb):
     with pytest.raises(NotEnoughStockToFullfillOrder):
         _ = dummy_sbb.issue_SO('ship-full', so_id)
 
+def test_issue_SO_shortage_rolls_back_order(dummy_sbb):
+    customer_id = dummy_sbb.create_customer('A customer')
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(2)]
+    so_id = dummy_sbb.make_SO(customer_id, [(sku[0], 5), (sku[1], 3)])
+    dummy_sbb._db.set_inventory_level([
+        StockPosition(sku=sku[0], qty=10),
+        StockPosition(sku=sku[1], qty=2),
+    ])
+    with pytest.raises(NotEnoughStockToFullfillOrder) as error:
+        dummy_sbb.issue_SO('ship-full', so_id)
+    assert (
+        ((error.value.order_id, error.value.sku, error.value.qty_avail)
+         == (so_id, sku[1], 2))
+        and ([stk.qty for stk in dummy_sbb.get_inventory_level(sku)]
+             == [10, 2])
+        and ([ol.qty_delivered for ol in dummy_sbb.get_order(so_id).lines]
+             == [0, 0])
+    )
+
+def test_issue_SO_does_not_read_stock_first(dummy_sbb):
+    customer_id = dummy_sbb.create_customer('A customer')
+    sku = dummy_sbb.create_sku('A product')
+    so_id = dummy_sbb.make_SO(customer_id, [(sku, 5)])
+    dummy_sbb._db.set_inventory_level([StockPosition(sku=sku, qty=10)])
+    queries = []
+    dummy_sbb._db._con.set_trace_callback(queries.append)
+    dummy_sbb.issue_SO('ship-full', so_id)
+    dummy_sbb._db._con.set_trace_callback(None)
+    assert not any('FROM inventory' in query for query in queries)
+
 
 def test_issue_SO_stock_available(dummy_sbb):
     customer_id = dummy_sbb.create_customer('A customer')
@@ -159,4 +368,175 @@ def test_issue_SO_stock_available(dummy_sbb):
     assert all([
         exp.is_like(inv_level_after[i])
         for i, exp in enumerate(expected_inventory)
-    ])
\ No newline at end of file
+    ])
+
+def test_issue_SO_updates_order_lines(dummy_sbb):
+    customer_id = dummy_sbb.create_customer('A customer')
+    sku = dummy_sbb.create_sku('A product')
+    so_id = dummy_sbb.make_SO(customer_id, [(sku, 3)])
+    dummy_sbb._db.set_inventory_level([StockPosition(sku=sku, qty=10)])
+
+    dummy_sbb.issue_SO('ship-full', so_id)
+    assert dummy_sbb.get_order(so_id).lines[0].qty_delivered == 3
+
+
+@pytest.fixture
+def sbb_with_wave(dummy_sbb):
+    customer_id = dummy_sbb.create_customer('A customer')
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(2)]
+    so_ids = dummy_sbb.make_SOs([
+        (customer_id, [(sku[0], 4), (sku[1], 1)]),
+        (customer_id, [(sku[0], 3)]),
+        (customer_id, [(sku[0], 2), (sku[1], 5)]),
+        ])
+    dummy_sbb._db.set_inventory_level([
+        StockPosition(sku=sku[0], qty=8),
+        StockPosition(sku=sku[1], qty=2),
+    ])
+    yield dummy_sbb, so_ids, sku
+
+
+def test_issue_SOs_fifo(sbb_with_wave):
+    dummy_sbb, so_ids, sku = sbb_with_wave
+    result = dummy_sbb.issue_SOs(so_ids)
+    inv_level_after = dummy_sbb._db.get_inventory_level(sku)
+    delivered = [
+        [ol.qty_delivered for ol in the_order.lines]
+        for the_order in dummy_sbb.get_orders(so_ids)
+    ]
+    assert (
+        (result.fulfilled == so_ids[:2])
+        and (result.partial == [so_ids[2]])
+        and (result.unfulfilled == [])
+        and ([stk.qty for stk in inv_level_after] == [1, 1])
+        and (delivered == [[4, 1], [3], [0, 0]])
+    )
+
+def test_issue_SOs_priority(sbb_with_wave):
+    dummy_sbb, so_ids, sku = sbb_with_wave
+    result = dummy_sbb.issue_SOs(so_ids[::-1], policy='priority')
+    assert (
+        (result.fulfilled == [so_ids[1], so_ids[0]])
+        and (result.partial == [so_ids[2]])
+    )
+
+def test_issue_SOs_allow_partial(sbb_with_wave):
+    dummy_sbb, so_ids, sku = sbb_with_wave
+    dummy_sbb.issue_SOs(so_ids, allow_partial=True)
+    inv_level_after = dummy_sbb._db.get_inventory_level(sku)
+    delivered = [
+        [ol.qty_delivered for ol in the_order.lines]
+        for the_order in dummy_sbb.get_orders(so_ids)
+    ]
+    assert (
+        ([stk.qty for stk in inv_level_after] == [0, 0])
+        and (delivered == [[4, 1], [3], [1, 1]])
+    )
+
+
+def test_issue_SO_ship_partial(dummy_sbb):
+    customer_id = dummy_sbb.create_customer('A customer')
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(2)]
+    so_id = dummy_sbb.make_SO(customer_id, [(sku[0], 5), (sku[1], 3)])
+    dummy_sbb._db.set_inventory_level([
+        StockPosition(sku=sku[0], qty=4),
+        StockPosition(sku=sku[1], qty=1),
+    ])
+
+    dummy_sbb.issue_SO('ship-partial', so_id, {1: 4})
+    with pytest.raises(NotEnoughStockToFullfillOrder):
+        dummy_sbb.issue_SO('ship-partial', so_id, {2: 2})
+    lines_after = dummy_sbb.get_order(so_id).lines
+    inv_level_after = dummy_sbb._db.get_inventory_level(sku)
+
+    assert (
+        ([ol.qty_delivered for ol in lines_after] == [4, 0])
+        and ([stk.qty for stk in inv_level_after] == [0, 1])
+    )
+
+
+def test_reporting_reads_committed_orders():
+    try:
+        with StockBackbone('test_reporting_db') as sbb_object:
+            customer_id = sbb_object.create_customer('A customer')
+            sku = sbb_object.create_sku('A product')
+            so_id = sbb_object.make_SO(customer_id, [(sku, 2)])
+            report_sbb = sbb_object.reporting()
+            with report_sbb.read_snapshot():
+                the_order = report_sbb.get_order(so_id)
+                open_orders = list(report_sbb.iter_orders(open_only=True))
+            with pytest.raises(ReadOnlyDatabase):
+                report_sbb.create_sku('Another product')
+            same_instance = sbb_object.reporting() is report_sbb
+        report_connections = report_sbb._db._pool._connections
+    finally:
+        for suffix in ['.db', '.db-wal', '.db-shm']:
+            Path('data', 'test_reporting_db' + suffix).unlink(missing_ok=True)
+
+    assert (
+        (the_order.lines[0].qty_ordered == 2) and (open_orders == [the_order])
+        and same_instance and (report_connections == [])
+    )
+
+
+def test_make_SO_with_reservation(dummy_sbb, monkeypatch):
+    now = [1_000_000.0]
+    clock = SimpleNamespace(time=lambda: now[0])
+    monkeypatch.setattr(sbb_module, 'time', clock)
+    monkeypatch.setattr(db_admin, 'time', clock)
+    customer_id = dummy_sbb.create_customer('A customer')
+    sku = [dummy_sbb.create_sku(f'Product {chr(65+i)}') for i in range(2)]
+    dummy_sbb._db.set_inventory_level([
+        StockPosition(sku=sku[0], qty=5),
+        StockPosition(sku=sku[1], qty=5),
+    ])
+    so_id = dummy_sbb.make_SO(customer_id, [(sku[0], 4), (sku[1], 1)],
+                              reserve_ttl=60)
+    with pytest.raises(NotEnoughStock):
+        dummy_sbb.make_SO(customer_id, [(sku[0], 2)], reserve_ttl=60)
+    unreserved_so_id = dummy_sbb.make_SO(customer_id, [(sku[0], 2)])
+    with pytest.raises(NotEnoughStockToFullfillOrder):
+        dummy_sbb.issue_SO('ship-full', unreserved_so_id)
+    atp_reserved = dummy_sbb.get_available_to_promise(sku)
+
+    dummy_sbb.issue_SO('ship-partial', so_id, {1: 3})
+    atp_partly_shipped = dummy_sbb.get_available_to_promise(sku)
+    now[0] += 60
+    atp_expired = dummy_sbb.get_available_to_promise(sku)
+    assert (
+        (atp_reserved == {sku[0]: 1, sku[1]: 4})
+        and (atp_partly_shipped == {sku[0]: 1, sku[1]: 4})
+        and (atp_expired == {sku[0]: 2, sku[1]: 5})
+        and (dummy_sbb._db.get_orders([3]) == [])
+    )
+
+def test_issue_SOs_uses_own_reservations(sbb_with_wave):
+    dummy_sbb, so_ids, sku = sbb_with_wave
+    reserved_so_id = dummy_sbb.make_SO(dummy_sbb.get_order(so_ids[0]).entity_id,
+                                       [(sku[0], 3)], reserve_ttl=60)
+    result = dummy_sbb.issue_SOs(so_ids + [reserved_so_id])
+    assert (
+        (result.fulfilled == [so_ids[0], reserved_so_id])
+        and (result.partial == so_ids[1:])
+        and (dummy_sbb.get_available_to_promise(sku) == {sku[0]: 1, sku[1]: 1})
+        and (dummy_sbb._db.get_reserved_qty([reserved_so_id]) == {})
+    )
+
+@pytest.mark.parametrize("limit", [0, StockBackbone.MAX_PAGE_SIZE + 1, '10'])
+def test_list_page_size_checked(dummy_sbb, limit):
+    with pytest.raises(SBB_Exception):
+        dummy_sbb.list_order_lines(limit=limit)
+
+def test_list_open_orders_of_customer(sbb_with_wave):
+    dummy_sbb, so_ids, sku = sbb_with_wave
+    dummy_sbb.issue_SO('ship-full', so_ids[1])
+    customer_id = dummy_sbb.get_order(so_ids[0]).entity_id
+    first_page = dummy_sbb.list_orders('sale', customer_id, open_only=True,
+                                       limit=1)
+    last_page = dummy_sbb.list_orders('sale', customer_id, open_only=True,
+                                      after=first_page.next_cursor, limit=1)
+    assert (
+        ([the_order.id for the_order in first_page.items + last_page.items]
+         == [so_ids[0], so_ids[2]])
+        and (last_page.next_cursor is None)
+    )